@@ -0,0 +1,118 @@
+'''
+Compares the fanout throughput of the celery path with the asyncio
+and process pool executors
+
+    python benchmarks/fanout_executors.py --followers 10000 --latency 0.0005
+
+The feeds use the in memory storage by default, every write sleeps for
+--latency seconds to stand in for the round trip to redis. Pass --redis to
+write to the default redis server of your settings instead. Celery runs
+with task_always_eager, so the celery numbers are those of a single worker.
+The process pool workers write to their own copy of the in memory storage
+'''
+from __future__ import print_function
+from celery import current_app
+from stream_framework.executors.asyncio import AsyncioFanoutExecutor
+from stream_framework.executors.celery import CeleryFanoutExecutor
+from stream_framework.executors.process import ProcessPoolFanoutExecutor
+from stream_framework.feed_managers.base import FanoutPriority, Manager
+from stream_framework.feed_managers.registry import register
+from stream_framework.feeds.base import UserBaseFeed
+from stream_framework.feeds.memory import Feed
+from stream_framework.storage.memory import InMemoryTimelineStorage
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+import argparse
+import datetime
+import time
+
+
+class LatencyTimelineStorage(InMemoryTimelineStorage):
+    latency = 0.0
+
+    def add_to_storage(self, key, activities, *args, **kwargs):
+        time.sleep(self.latency)
+        return super(LatencyTimelineStorage, self).add_to_storage(
+            key, activities, *args, **kwargs)
+
+
+class LatencyFeed(Feed):
+    timeline_storage_class = LatencyTimelineStorage
+
+
+class LatencyUserFeed(UserBaseFeed, Feed):
+    pass
+
+
+class BenchmarkManager(Manager):
+    follower_count = 0
+
+    def get_user_follower_ids(self, user_id):
+        return {FanoutPriority.HIGH: range(self.follower_count)}
+
+
+@register
+class MemoryBenchmarkManager(BenchmarkManager):
+    name = 'benchmark_memory'
+    feed_classes = {'feed': LatencyFeed}
+    user_feed_class = LatencyUserFeed
+
+
+def get_redis_manager_class():
+    from stream_framework.feeds.redis import RedisFeed
+
+    class RedisUserFeed(UserBaseFeed, RedisFeed):
+        pass
+
+    @register
+    class RedisBenchmarkManager(BenchmarkManager):
+        name = 'benchmark_redis'
+        feed_classes = {'feed': RedisFeed}
+        user_feed_class = RedisUserFeed
+    return RedisBenchmarkManager
+
+
+def run(manager, executor, activity_id):
+    manager.fanout_executor = executor
+    pin = Pin(id=activity_id, created_at=datetime.datetime.now())
+    activity = FakeActivity(1, LoveVerb, pin, activity_id, datetime.datetime.now(), {})
+    start = time.time()
+    manager.add_user_activity(1, activity)
+    executor.wait()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--followers', type=int, default=10000)
+    parser.add_argument('--chunk-size', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.0005)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--redis', action='store_true')
+    args = parser.parse_args()
+
+    current_app.conf.task_always_eager = True
+    LatencyTimelineStorage.latency = args.latency
+    manager_class = get_redis_manager_class() if args.redis else MemoryBenchmarkManager
+    manager = manager_class()
+    manager.follower_count = args.followers
+    manager.fanout_chunk_size = args.chunk_size
+
+    executors = [
+        ('celery', CeleryFanoutExecutor()),
+        ('asyncio', AsyncioFanoutExecutor(concurrency=args.concurrency)),
+        ('process', ProcessPoolFanoutExecutor(processes=args.processes)),
+    ]
+    for activity_id, (name, executor) in enumerate(executors, 1):
+        duration = run(manager, executor, activity_id)
+        print('%-8s %8d writes in %6.2fs %10.0f writes/s' % (
+            name, args.followers, duration, args.followers / duration))
+        if hasattr(executor, 'shutdown'):
+            executor.shutdown()
+        for feed_class in manager.feed_classes.values():
+            feed_class.flush()
+
+
+if __name__ == '__main__':
+    main()
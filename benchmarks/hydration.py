@@ -0,0 +1,64 @@
+'''
+Compares reading the pages of a redis feed in two round trips (the slice,
+then the activities) with reading them in one lua script
+
+    python benchmarks/hydration.py --activities 1000 --page-size 25 --reads 1000
+
+Both feeds read the same timeline and activities from the default
+redis server of your settings
+'''
+from __future__ import print_function
+from stream_framework.feeds.redis import RedisFeed
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+import argparse
+import datetime
+import time
+
+
+class BenchmarkFeed(RedisFeed):
+    key_format = 'benchmark_feed:%(user_id)s'
+    max_length = 10 ** 6
+
+
+class ServerSideHydrationFeed(BenchmarkFeed):
+    server_side_hydration = True
+
+
+def run(feed, reads, page_size, pages):
+    start = time.time()
+    for x in range(reads):
+        offset = (x % pages) * page_size
+        feed[offset:offset + page_size]
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--activities', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=25)
+    parser.add_argument('--reads', type=int, default=1000)
+    args = parser.parse_args()
+
+    now = datetime.datetime.now()
+    activities = []
+    for x in range(args.activities):
+        pin = Pin(id=x, created_at=now)
+        activity_time = now - datetime.timedelta(seconds=x)
+        activities.append(FakeActivity(1, LoveVerb, pin, x, activity_time, dict(x=x)))
+    feed = BenchmarkFeed(1)
+    feed.insert_activities(activities)
+    feed.add_many(activities)
+
+    pages = max(1, args.activities // args.page_size)
+    for name, feed_class in [('two-step', BenchmarkFeed), ('lua', ServerSideHydrationFeed)]:
+        duration = run(feed_class(1), args.reads, args.page_size, pages)
+        print('%-9s %6d pages of %d in %6.2fs %8.0f pages/s' % (
+            name, args.reads, args.page_size, duration, args.reads / duration))
+
+    feed.delete()
+    feed.activity_storage.remove_many(activities)
+
+
+if __name__ == '__main__':
+    main()
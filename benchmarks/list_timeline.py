@@ -0,0 +1,68 @@
+'''
+Compares the memory and latency of timelines stored as sorted sets
+(RedisTimelineStorage) and as lists (RedisListTimelineStorage)
+
+    python benchmarks/list_timeline.py --timelines 100 --length 100 --reads 1000
+
+Activities are added one at a time in chronological order, like a fanout
+does. The memory is read with MEMORY USAGE and needs redis 4 or newer
+'''
+from __future__ import print_function
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.storage.redis.list_timeline_storage import RedisListTimelineStorage
+from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+import argparse
+import datetime
+import time
+
+
+def build_activities(length):
+    now = datetime.datetime.now()
+    return [FakeActivity(i, LoveVerb, Pin(id=i), i, now + datetime.timedelta(seconds=i), {})
+            for i in range(length)]
+
+
+def run(storage, keys, activities, reads, page_size):
+    for key in keys:
+        storage.delete(key)
+    start = time.time()
+    for activity in activities:
+        for key in keys:
+            storage.add_many(key, [activity], max_length=len(activities))
+    write_time = time.time() - start
+
+    start = time.time()
+    for x in range(reads):
+        storage.get_slice(keys[x % len(keys)], 0, page_size)
+    read_time = time.time() - start
+
+    redis = get_redis_connection()
+    memory = sum(int(redis.execute_command('MEMORY', 'USAGE', key)) for key in keys)
+    for key in keys:
+        storage.delete(key)
+    return write_time, read_time, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--timelines', type=int, default=100)
+    parser.add_argument('--length', type=int, default=100)
+    parser.add_argument('--reads', type=int, default=1000)
+    parser.add_argument('--page-size', type=int, default=25)
+    args = parser.parse_args()
+
+    activities = build_activities(args.length)
+    keys = ['benchmark_timeline:%s' % i for i in range(args.timelines)]
+    writes = len(activities) * len(keys)
+    for storage_class in (RedisTimelineStorage, RedisListTimelineStorage):
+        write_time, read_time, memory = run(
+            storage_class(), keys, activities, args.reads, args.page_size)
+        print('%-26s %8.3f ms/write %8.3f ms/read %8d bytes/timeline' % (
+            storage_class.__name__, write_time * 1000 / writes,
+            read_time * 1000 / args.reads, memory / len(keys)))
+
+
+if __name__ == '__main__':
+    main()
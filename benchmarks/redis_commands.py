@@ -0,0 +1,58 @@
+'''
+Counts the redis commands the structures send for bulk operations
+
+    python benchmarks/redis_commands.py --items 5000
+
+The commands are queued on a pipeline which is never executed, so no
+redis server is needed. Before the variadic commands every item cost
+one command
+'''
+from __future__ import print_function
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.storage.redis.structures.hash import RedisHashCache, ShardedHashCache
+from stream_framework.storage.redis.structures.sorted_set import RedisSortedSetCache
+import argparse
+
+
+def count_commands(structure_class, operation):
+    pipe = get_redis_connection().pipeline(transaction=False)
+    operation(structure_class('benchmark', redis=pipe))
+    return len(pipe.command_stack)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=5000)
+    args = parser.parse_args()
+
+    items = list(range(args.items))
+    operations = [
+        ('RedisSortedSetCache.remove_many', RedisSortedSetCache,
+         lambda cache: cache.remove_many(items)),
+        ('RedisSortedSetCache.remove_by_scores', RedisSortedSetCache,
+         lambda cache: cache.remove_by_scores(items)),
+        ('RedisHashCache.set_many', RedisHashCache,
+         lambda cache: cache.set_many([(item, 'value') for item in items])),
+        ('RedisHashCache.delete_many', RedisHashCache,
+         lambda cache: cache.delete_many(items)),
+        ('ShardedHashCache.set_many', ShardedHashCache,
+         lambda cache: cache.set_many([(item, 'value') for item in items])),
+        ('ShardedHashCache.delete_many', ShardedHashCache,
+         lambda cache: cache.delete_many(items)),
+    ]
+    for name, structure_class, operation in operations:
+        commands = count_commands(structure_class, operation)
+        print('%-38s %6d items %6d commands (was %d)' % (
+            name, args.items, commands, args.items))
+
+    # get_many needs the results, it executes its own pipeline
+    for structure_class in (RedisHashCache, ShardedHashCache):
+        cache = structure_class('benchmark')
+        commands = len(cache.group_fields(items))
+        print('%-38s %6d items %6d commands (was %d)' % (
+            structure_class.__name__ + '.get_many', args.items, commands,
+            1 if structure_class is RedisHashCache else args.items))
+
+
+if __name__ == '__main__':
+    main()
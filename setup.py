@@ -18,6 +18,7 @@ tests_require = [
 
 install_requires = [
     'celery>=3.0.0',
+    'futures; python_version < "3.2"',
     'six'
 ]
 
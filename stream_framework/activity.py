@@ -36,12 +36,16 @@ class DehydratedActivity(BaseActivity):
 
     def get_hydrated(self, activities):
         '''
-        returns the full hydrated Activity from activities
+        returns the full hydrated Activity from activities,
+        None if the activity is missing from activities (it was removed
+        from the activity storage but is still referenced by a timeline)
 
         :param activities a dict {'activity_id': Activity}
 
         '''
-        activity = activities[int(self.serialization_id)]
+        activity = activities.get(int(self.serialization_id))
+        if activity is None:
+            return None
         activity.dehydrated = False
         return activity
 
@@ -214,12 +218,19 @@ class AggregatedActivity(BaseActivity):
         '''
         expects activities to be a dict like this {'activity_id': Activity}
 
+        the activities missing from activities are left out, returns None
+        if all of them are missing
+
         '''
         assert self.dehydrated, 'not dehydrated yet'
         for activity_id in self._activity_ids:
-            self.activities.append(activities[activity_id])
+            activity = activities.get(activity_id)
+            if activity is not None:
+                self.activities.append(activity)
         self._activity_ids = []
         self.dehydrated = False
+        if not self.activities:
+            return None
         return self
 
     def __len__(self):
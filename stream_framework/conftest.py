@@ -14,6 +14,24 @@ def redis_reset():
     redis.Redis().flushall()
 
 
+@pytest.fixture
+def redis_cluster(monkeypatch):
+    '''
+    Registers the cluster_* servers of the test settings, the settings
+    are only loaded through django otherwise
+    '''
+    from stream_framework import settings
+    from stream_framework.storage.redis import connection
+    from stream_framework.tests import settings as test_settings
+    config = dict(settings.STREAM_REDIS_CONFIG)
+    for name, server_config in test_settings.STREAM_REDIS_CONFIG.items():
+        if name.startswith('cluster_'):
+            config.setdefault(name, server_config)
+    monkeypatch.setattr(settings, 'STREAM_REDIS_CONFIG', config)
+    # the next connection sets up the pools of the cluster servers
+    monkeypatch.setattr(connection, 'connection_pool', None)
+
+
 @pytest.fixture
 def cassandra_reset():
     from stream_framework.feeds.cassandra import CassandraFeed
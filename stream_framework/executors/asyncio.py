@@ -0,0 +1,73 @@
+from __future__ import absolute_import
+from stream_framework.executors.base import run_fanout
+from stream_framework.executors.local import LocalFanoutExecutor
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import threading
+
+
+class AsyncioFanoutExecutor(LocalFanoutExecutor):
+
+    '''
+    Runs the fanout chunks in this process on a pool of concurrency
+    threads, scheduled by an asyncio event loop in a background thread.
+    Requires python 3.5 or higher
+
+    This is a thread pool behind an event loop, not async I/O: the redis
+    client is blocking, every chunk takes a thread and its own connection
+    from the connection pool, so at most concurrency chunks run at the
+    same time. submit blocks once max_pending chunks are waiting
+
+    **Example** ::
+
+        executor = AsyncioFanoutExecutor(concurrency=20)
+
+        class PinManager(Manager):
+            fanout_executor = executor
+
+        manager.add_user_activity(user_id, activity)
+        executor.wait()
+
+    '''
+
+    def __init__(self, concurrency=10, max_pending=100):
+        super(AsyncioFanoutExecutor, self).__init__(max_pending)
+        self.concurrency = concurrency
+        self.loop = None
+        self.thread_pool = None
+
+    def get_loop(self):
+        '''
+        Starts the event loop thread the first time it's needed
+        '''
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+                thread = threading.Thread(target=self.loop.run_forever)
+                thread.daemon = True
+                thread.start()
+        return self.loop
+
+    async def run(self, kwargs):
+        # the pool of concurrency threads limits the running chunks
+        await self.loop.run_in_executor(
+            self.thread_pool, functools.partial(run_fanout, **kwargs))
+
+    def submit_chunk(self, kwargs):
+        loop = self.get_loop()
+        return asyncio.run_coroutine_threadsafe(self.run(kwargs), loop)
+
+    def shutdown(self):
+        '''
+        Waits for the submitted chunks and stops the event loop
+        '''
+        if self.loop is None:
+            return
+        try:
+            self.wait()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread_pool.shutdown()
+            self.loop = None
@@ -0,0 +1,65 @@
+from stream_framework.feed_managers.registry import get_manager_by_name
+import six
+
+
+def run_fanout(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+               fanout_priority=None, enqueued_at=None, started_at=None, fanout_id=None):
+    '''
+    Runs one fanout chunk, this is what the fanout tasks do
+
+    feed_manager is either the manager or the name of a registered manager
+    '''
+    if isinstance(feed_manager, six.string_types):
+        feed_manager = get_manager_by_name(feed_manager)
+    feed_manager.fanout(user_ids, feed_class, operation, operation_kwargs,
+                        fanout_priority=fanout_priority, enqueued_at=enqueued_at,
+                        started_at=started_at, fanout_id=fanout_id)
+
+
+class BaseFanoutExecutor(object):
+
+    '''
+    Executes the fanout chunks created by the manager
+
+    The manager calls submit for every chunk of followers, the fanout_task
+    is the celery task picked for the priority of the fanout (see
+    Manager.get_fanout_task), executors running the chunks without celery
+    can ignore it and call run_fanout with the kwargs instead
+    '''
+
+    def submit(self, fanout_task, **kwargs):
+        '''
+        Schedules one fanout chunk
+
+        :param fanout_task: the celery task for the chunk
+        :param kwargs: the feed_manager, feed_class, user_ids, operation,
+            operation_kwargs, fanout_priority, enqueued_at, started_at and
+            fanout_id arguments of the fanout
+        :returns: a handle for the chunk, like an AsyncResult or a future
+        '''
+        raise NotImplementedError()
+
+    def submit_task(self, task, countdown=None, **kwargs):
+        '''
+        Schedules one of the other fanout tasks, like the coordinator of
+        the hierarchical fanout or the flush of the fanout buffer
+
+        :param task: the celery task
+        :param countdown: run the task after countdown seconds
+        :param kwargs: the arguments of the task
+        :returns: a handle for the task, like an AsyncResult or a future
+        '''
+        raise NotImplementedError()
+
+    def runs_in_process(self, task):
+        '''
+        Returns True if submit_task runs task in this process, in
+        process state like a FanoutBuffer only works then
+        '''
+        return False
+
+    def wait(self):
+        '''
+        Blocks until the submitted chunks which run in this process are done
+        '''
+        pass
@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+from stream_framework.executors.base import BaseFanoutExecutor
+
+
+def is_eager(task):
+    '''
+    Returns True if the celery task runs in the calling process
+    '''
+    conf = task.app.conf
+    return bool(conf.get('task_always_eager') or conf.get('CELERY_ALWAYS_EAGER'))
+
+
+class CeleryFanoutExecutor(BaseFanoutExecutor):
+
+    '''
+    Sends every fanout chunk to celery, this is the default executor
+    '''
+
+    def submit(self, fanout_task, **kwargs):
+        return fanout_task.delay(**kwargs)
+
+    def submit_task(self, task, countdown=None, **kwargs):
+        return task.apply_async(kwargs=kwargs, countdown=countdown)
+
+    def runs_in_process(self, task):
+        return is_eager(task)
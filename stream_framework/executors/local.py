@@ -0,0 +1,148 @@
+from __future__ import absolute_import
+from stream_framework.executors.base import BaseFanoutExecutor
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_write_count(kwargs):
+    '''
+    Returns the number of feeds a fanout chunk writes to
+    '''
+    feed_class = kwargs['feed_class']
+    feed_class_count = len(feed_class) if isinstance(feed_class, (list, tuple)) else 1
+    return len(kwargs['user_ids']) * feed_class_count
+
+
+class LocalFanoutExecutor(BaseFanoutExecutor):
+
+    '''
+    The base for executors running the fanout chunks on this host
+
+    Every chunk runs as a concurrent.futures.Future. submit blocks once
+    max_pending chunks are waiting (backpressure), so a large fanout doesn't
+    build an unbounded queue in memory. The executor counts the chunks and
+    the feeds written to measure the throughput
+
+    The other tasks run in this process, right away or in a timer
+    thread after their countdown
+    '''
+
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.futures = set()
+        self.errors = []
+        self.lock = threading.Lock()
+        #: the number of chunks and feeds written, for measuring throughput
+        self.chunk_count = 0
+        self.write_count = 0
+        self.started_at = None
+
+    def submit_chunk(self, kwargs):
+        '''
+        Starts running the chunk, returns a concurrent.futures.Future
+        '''
+        raise NotImplementedError()
+
+    def submit(self, fanout_task, **kwargs):
+        # blocks while max_pending chunks are waiting
+        self.pending.acquire()
+        with self.lock:
+            if self.started_at is None:
+                self.started_at = time.time()
+        try:
+            future = self.submit_chunk(kwargs)
+        except Exception:
+            self.pending.release()
+            raise
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(functools.partial(self.on_done, kwargs))
+        return future
+
+    def submit_task(self, task, countdown=None, **kwargs):
+        future = concurrent.futures.Future()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(task(**kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self.on_task_done)
+        if countdown:
+            timer = threading.Timer(countdown, run)
+            timer.daemon = True
+            timer.start()
+        else:
+            run()
+        return future
+
+    def runs_in_process(self, task):
+        return True
+
+    def on_task_done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+            if future.exception() is not None:
+                logger.error('fanout task failed: %r', future.exception())
+                self.errors.append(future.exception())
+
+    def on_done(self, kwargs, future):
+        self.pending.release()
+        with self.lock:
+            self.futures.discard(future)
+            if future.exception() is not None:
+                logger.error('fanout chunk failed: %r', future.exception())
+                self.errors.append(future.exception())
+            else:
+                self.chunk_count += 1
+                self.write_count += get_write_count(kwargs)
+
+    def wait(self):
+        '''
+        Blocks until all submitted chunks are done,
+        raises the error of the first failed chunk
+        '''
+        while True:
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                break
+            concurrent.futures.wait(futures)
+        with self.lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def get_stats(self):
+        '''
+        Returns the number of chunks, the number of feeds written, the seconds
+        since the first chunk and the feeds written per second
+        '''
+        duration = 0.0
+        if self.started_at is not None:
+            duration = time.time() - self.started_at
+        writes_per_second = self.write_count / duration if duration else 0.0
+        return dict(
+            chunks=self.chunk_count,
+            writes=self.write_count,
+            duration=duration,
+            writes_per_second=writes_per_second
+        )
+
+    def get_throughput(self):
+        '''
+        Returns the number of feeds written per second since the first chunk
+        '''
+        return self.get_stats()['writes_per_second']
@@ -0,0 +1,92 @@
+from __future__ import absolute_import
+from stream_framework.executors.base import run_fanout
+from stream_framework.executors.local import LocalFanoutExecutor
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import sys
+
+
+def init_worker():
+    '''
+    Gives every worker process its own redis connection pools
+    '''
+    try:
+        from stream_framework.storage.redis import connection
+    except ImportError:
+        return
+    connection.connection_pool = None
+
+
+def run_chunk(kwargs):
+    run_fanout(**kwargs)
+
+
+class ProcessPoolFanoutExecutor(LocalFanoutExecutor):
+
+    '''
+    Runs the fanout chunks in a pool of worker processes on this host,
+    without a broker. Meant for backfills like Manager.batch_import, the
+    throughput scales with the number of cores
+
+    The chunks are pickled to reach the workers, register the manager
+    (see :mod:`stream_framework.feed_managers.registry`) so they only carry
+    its name. Before python 3.7 the workers are forked with the default
+    context and reset the redis connections when they first use them
+
+    **Example** ::
+
+        executor = ProcessPoolFanoutExecutor(processes=8)
+
+        @register
+        class BackfillManager(PinManager):
+            name = 'backfill'
+            fanout_executor = executor
+
+        manager = BackfillManager()
+        for user_id, activities in history:
+            manager.batch_import(user_id, activities)
+        executor.wait()
+        print(executor.get_stats())
+
+    '''
+
+    def __init__(self, processes=None, max_pending=None, mp_context=None):
+        '''
+        :param processes: the number of worker processes, defaults to the number of cores
+        :param max_pending: the number of waiting chunks after which submit blocks
+        :param mp_context: the multiprocessing context, the workers need to import
+            the module registering the manager when it's not fork
+        '''
+        if mp_context is not None and sys.version_info < (3, 7):
+            raise ValueError('mp_context needs python 3.7 or higher')
+        self.processes = processes or multiprocessing.cpu_count()
+        if max_pending is None:
+            max_pending = self.processes * 4
+        super(ProcessPoolFanoutExecutor, self).__init__(max_pending)
+        self.mp_context = mp_context
+        self.pool = None
+
+    def get_pool(self):
+        with self.lock:
+            if self.pool is None:
+                pool_kwargs = dict(max_workers=self.processes)
+                if sys.version_info >= (3, 7):
+                    pool_kwargs.update(
+                        mp_context=self.mp_context, initializer=init_worker)
+                self.pool = ProcessPoolExecutor(**pool_kwargs)
+        return self.pool
+
+    def submit_chunk(self, kwargs):
+        return self.get_pool().submit(run_chunk, kwargs)
+
+    def shutdown(self):
+        '''
+        Waits for the submitted chunks and stops the worker processes
+        '''
+        if self.pool is None:
+            return
+        try:
+            self.wait()
+        finally:
+            self.pool.shutdown()
+            self.pool = None
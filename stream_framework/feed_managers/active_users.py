@@ -0,0 +1,126 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.utils import LRUCache, MISSING
+import time
+
+
+class ActiveUserTracker(object):
+
+    '''
+    Keeps track of the users who recently used the app
+
+    Time is divided in periods of period seconds, users marked active
+    in one of the last periods periods are active. Users who were never
+    marked have no history and count as active, so enabling the tracker
+    doesn't leave everyone with stale feeds
+
+    The default implementation keeps the last period of at most capacity
+    users in process, for ttl seconds. Forgotten users have no history
+    again, use :class:`RedisActiveUserTracker` to keep all users and to
+    share them between processes
+    '''
+    #: the length of a period in seconds
+    period = 7 * 24 * 60 * 60
+    #: the number of periods a user stays active
+    periods = 4
+    #: the seconds the last period of a user is kept in process
+    ttl = 52 * 7 * 24 * 60 * 60
+
+    def __init__(self, period=None, periods=None, capacity=1000000, ttl=None):
+        if period is not None:
+            self.period = period
+        if periods is not None:
+            self.periods = periods
+        if ttl is not None:
+            self.ttl = ttl
+        self.last_periods = LRUCache(capacity, ttl=self.ttl)
+
+    def get_period(self):
+        return int(time.time() // self.period)
+
+    def mark_active(self, user_id):
+        '''
+        Marks user_id as active, returns True if the user was already active
+
+        :param user_id: the user id
+        '''
+        was_active = user_id in self.get_active([user_id])
+        self.last_periods.set(user_id, self.get_period())
+        return was_active
+
+    def get_active(self, user_ids):
+        '''
+        Returns the set of active users among user_ids
+
+        :param user_ids: a list of user ids
+        '''
+        first_period = self.get_period() - self.periods + 1
+        active = set()
+        for user_id in user_ids:
+            last_period = self.last_periods.get(user_id)
+            if last_period is MISSING or last_period >= first_period:
+                active.add(user_id)
+        return active
+
+    def is_active(self, user_id):
+        return user_id in self.get_active([user_id])
+
+
+class RedisActiveUserTracker(ActiveUserTracker):
+
+    '''
+    Keeps one redis bitmap per period, with one bit per user id
+
+    The user ids need to be (not too large) integers, a bitmap for
+    100 million users takes 12.5MB. One more bitmap without expiry
+    keeps the users who were ever marked
+    '''
+    key_format = 'fanout:active:%s'
+    seen_key = 'fanout:active:seen'
+
+    def __init__(self, period=None, periods=None, redis_server='default'):
+        super(RedisActiveUserTracker, self).__init__(period, periods)
+        self.redis_server = redis_server
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def get_keys(self):
+        '''
+        Returns the keys of the bitmaps of the last periods, newest first
+        '''
+        period = self.get_period()
+        return [self.key_format % p for p in range(period, period - self.periods, -1)]
+
+    def is_active_result(self, seen, period_bits):
+        '''
+        Returns True for users without history or marked in one of the periods
+        '''
+        return not seen or any(period_bits)
+
+    def mark_active(self, user_id):
+        keys = self.get_keys()
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.setbit(self.seen_key, user_id, 1)
+        for key in keys:
+            pipe.getbit(key, user_id)
+        pipe.setbit(keys[0], user_id, 1)
+        pipe.expire(keys[0], self.period * (self.periods + 1))
+        results = pipe.execute()
+        # setbit returns the previous bit
+        return self.is_active_result(results[0], results[1:len(keys) + 1])
+
+    def get_active(self, user_ids):
+        user_ids = list(user_ids)
+        keys = [self.seen_key] + self.get_keys()
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            for key in keys:
+                pipe.getbit(key, user_id)
+        results = pipe.execute()
+        active = set()
+        for index, user_id in enumerate(user_ids):
+            user_results = results[index * len(keys):(index + 1) * len(keys)]
+            if self.is_active_result(user_results[0], user_results[1:]):
+                active.add(user_id)
+        return active
@@ -1,12 +1,28 @@
+from stream_framework.activity import DehydratedActivity
 from stream_framework.feeds.base import UserBaseFeed
+from stream_framework.executors.celery import CeleryFanoutExecutor
+from stream_framework.feed_managers.buffer import FanoutBuffer
+from stream_framework.feed_managers.cost_tracker import FanoutCostTracker
+from stream_framework.feed_managers.cost_tracker import get_feed_class_name
+from stream_framework.feed_managers.registry import is_registered
+from stream_framework.serializers.activity_serializer import ActivitySerializer
 from stream_framework.tasks import follow_many, unfollow_many
 from stream_framework.tasks import fanout_operation
+from stream_framework.tasks import fanout_coordinator
+from stream_framework.tasks import fanout_flush
 from stream_framework.tasks import fanout_operation_hi_priority
 from stream_framework.tasks import fanout_operation_low_priority
 from stream_framework.utils import chunks
 from stream_framework.utils import get_metrics_instance
 from stream_framework.utils.timing import timer
+from collections import OrderedDict
+import hashlib
+import itertools
 import logging
+import math
+import six
+import time
+import uuid
 from stream_framework.feeds.redis import RedisFeed
 
 
@@ -98,9 +114,81 @@ class Manager(object):
 
     # : the number of activities which enter your feed when you follow someone
     follow_activity_limit = 5000
+    # : set to True when the user feeds only hold the activities of their
+    # : own user (activity.actor_id == user_id), unfollowing then uses them as
+    # : an index of activity ids per actor instead of hydrating the feeds
+    user_feed_actor_index = False
     # : the number of users which are handled in one asynchronous task
     # : when doing the fanout
     fanout_chunk_size = 100
+    # : size the chunks per feed class using the measured fanout cost per user
+    # : so that every task takes about fanout_chunk_duration seconds
+    adaptive_fanout_chunk_size = False
+    fanout_chunk_duration = 1.0
+    min_fanout_chunk_size = 10
+    max_fanout_chunk_size = 1000
+    # : keeps track of the fanout cost per user, use a RedisFanoutCostTracker
+    # : to share the measurements between workers and web processes
+    fanout_cost_tracker = FanoutCostTracker()
+    # : users with more followers than the threshold get a hierarchical fanout
+    # : one coordinator task creates the fanout tasks instead of the caller
+    # : None disables the hierarchical fanout
+    hierarchical_fanout_threshold = None
+    # : users with more followers than the threshold don't fanout new activities
+    # : their followers pull them from the user feed at read time (see get_read_feeds)
+    # : None disables the pull mode
+    pull_fanout_threshold = None
+    # : keeps track of the users who recently used the app, for example a
+    # : RedisActiveUserTracker. The fanout skips inactive users, their feeds
+    # : are rebuilt when they return (see get_read_feeds)
+    # : None fans out to all followers
+    active_user_tracker = None
+    # : the task creating the fanout tasks in the hierarchical fanout
+    fanout_coordinator_task = fanout_coordinator
+    # : stores the progress of fanouts so they can resume after a crash
+    # : for example a RedisFanoutCheckpoint, None disables checkpoints
+    fanout_checkpoint = None
+    # : records the completed (activities, feed class, chunk) units of the
+    # : fanout tasks, retried tasks skip them. For example a RedisFanoutIdempotency
+    # : None disables the idempotency keys
+    fanout_idempotency = None
+    # : buffers the new activities of an author for fanout_coalesce_window
+    # : seconds, or until fanout_coalesce_max_items activities are buffered
+    # : and fans them out together. None fans out every activity right away
+    fanout_coalesce_window = None
+    fanout_coalesce_max_items = 20
+    # : stores the buffered activities, use a RedisFanoutBuffer when
+    # : the flush task runs in another process (the default raises then)
+    fanout_buffer = FanoutBuffer()
+    # : the task flushing the fanout buffer
+    fanout_flush_task = fanout_flush
+    # : when True a single task applies the operation to all feed_classes
+    # : for a chunk of followers, instead of one task per feed class
+    # : feed classes sharing a redis server also share one pipeline
+    combined_feed_fanout = False
+
+    # : the name used to register the manager (see feed_managers.registry)
+    # : fanout tasks of registered managers carry a compact payload
+    name = None
+    # : maps between operation codes and the operations sent in compact payloads
+    fanout_operations = {
+        'add': add_operation,
+        'remove': remove_operation
+    }
+    # : how activities travel in compact payloads, 'serialized' sends
+    # : ActivitySerializer strings, 'ids' only sends the serialization ids
+    # : and loads the activities from the activity storage of the user feed
+    # : None sends ids when the user feed stores them (see get_fanout_activity_payload)
+    fanout_activity_payload = None
+
+    # : rate limits the fanout chunks per priority and feed class and sheds
+    # : the chunks which miss the deadline of their priority, for example a
+    # : RedisFanoutScheduler. None runs every chunk right away
+    fanout_scheduler = None
+
+    # : runs the fanout chunks and the coordinator and flush tasks, for example
+    # : an AsyncioFanoutExecutor runs them in process instead of sending them to celery
+    fanout_executor = CeleryFanoutExecutor()
 
     # maps between priority and fanout tasks
     priority_fanout_task = {
@@ -118,10 +206,50 @@ class Manager(object):
         eg.
         {'HIGH': [...], 'LOW': [...]}
 
+        The values can be any iterable, for instance a generator paging
+        through a database cursor, they are consumed once and streamed
+        into the fanout tasks
+
         :param user_id: the user id for which to get the follower ids
         '''
         raise NotImplementedError()
 
+    def get_user_follower_count(self, user_id):
+        '''
+        Returns the number of followers of user_id, used to decide if
+        the fanout runs through a coordinator task (see hierarchical_fanout_threshold)
+
+        You need to implement this when using hierarchical_fanout_threshold
+        or pull_fanout_threshold, preferably with a cheap count query instead of loading the follower ids
+
+        :param user_id: the user id for which to count the followers
+        '''
+        raise NotImplementedError()
+
+    def get_user_pull_ids(self, user_id):
+        '''
+        Returns the ids of the users followed by user_id whose activities
+        are merged in at read time, these are the followed users for which
+        use_pull_fanout is True
+
+        You need to implement this when using pull_fanout_threshold,
+        preferably with a query on a stored follower count
+
+        :param user_id: the user id for which to get the pulled user ids
+        '''
+        raise NotImplementedError()
+
+    def get_user_following_ids(self, user_id):
+        '''
+        Returns the ids of the users followed by user_id, used to rebuild
+        the feeds of users returning after a period of inactivity
+
+        You need to implement this when using an active_user_tracker
+
+        :param user_id: the user id for which to get the followed user ids
+        '''
+        raise NotImplementedError()
+
     def add_user_activity(self, user_id, activity):
         '''
         Store the new activity and then fanout to user followers
@@ -134,6 +262,7 @@ class Manager(object):
         :param user_id: the id of the user
         :param activity: the activity which to add
         '''
+        started_at = time.time()
         # add into the global activity cache (if we are using it)
         self.user_feed_class.insert_activity(activity)
         # now add to the user's personal feed
@@ -141,18 +270,78 @@ class Manager(object):
         user_feed.add(activity)
         operation_kwargs = dict(activities=[activity], trim=True)
 
-        for priority_group, follower_ids in self.get_user_follower_ids(user_id=user_id).items():
-            # create the fanout tasks
-            for feed_class in self.feed_classes.values():
-                self.create_fanout_tasks(
-                    follower_ids,
-                    feed_class,
-                    add_operation,
-                    operation_kwargs=operation_kwargs,
-                    fanout_priority=priority_group
-                )
+        follower_count = self.get_fanout_follower_count(user_id)
+        if self.use_pull_fanout(user_id, follower_count=follower_count):
+            logger.info('followers pull the activities of user %s', user_id)
+            self.start_pull_user_fanout(
+                user_id, add_operation, operation_kwargs=operation_kwargs,
+                started_at=started_at, follower_count=follower_count)
+        elif self.fanout_coalesce_window is not None:
+            self.buffer_user_fanout(user_id, activity)
+        else:
+            self.start_user_fanout(
+                user_id, add_operation, operation_kwargs=operation_kwargs,
+                started_at=started_at, follower_count=follower_count)
         self.metrics.on_activity_published()
 
+    def buffer_user_fanout(self, user_id, activity):
+        '''
+        Adds the activity to the fanout buffer of user_id, the first activity
+        schedules a flush after fanout_coalesce_window seconds, a full
+        buffer is flushed right away
+
+        :param user_id: the id of the user
+        :param activity: the activity to fanout
+        '''
+        in_process = self.fanout_executor.runs_in_process(self.fanout_flush_task)
+        if not self.fanout_buffer.shared and not in_process:
+            raise ValueError(
+                'the flush task cant read the in process %s, use a RedisFanoutBuffer'
+                % self.fanout_buffer.__class__.__name__)
+        serializer = self.get_fanout_serializer()
+        buffered = self.fanout_buffer.add(
+            self.get_fanout_buffer_key(user_id), serializer.dumps(activity))
+        if buffered >= self.fanout_coalesce_max_items:
+            self.flush_fanout_buffer(user_id)
+        elif buffered == 1:
+            feed_manager = self.name if is_registered(self.__class__) else self
+            self.fanout_executor.submit_task(
+                self.fanout_flush_task,
+                countdown=self.fanout_coalesce_window,
+                feed_manager=feed_manager,
+                user_id=user_id
+            )
+
+    def flush_fanout_buffer(self, user_id):
+        '''
+        Starts one fanout for all the activities buffered for user_id
+
+        :param user_id: the id of the user
+        :returns list: the activities which were fanned out
+        '''
+        serializer = self.get_fanout_serializer()
+        buffer_key = self.get_fanout_buffer_key(user_id)
+        activities = [serializer.loads(serialized)
+                      for serialized in self.fanout_buffer.pop_all(buffer_key)]
+        # skip the activities which were removed while they were buffered
+        user_feed = self.get_user_feed(user_id)
+        contains = getattr(user_feed.timeline_storage, 'contains', None)
+        if contains is not None:
+            activities = [a for a in activities
+                          if contains(user_feed.key, a.serialization_id)]
+        if activities:
+            operation_kwargs = dict(activities=activities, trim=True)
+            self.start_user_fanout(
+                user_id, add_operation, operation_kwargs=operation_kwargs)
+        return activities
+
+    def get_fanout_buffer_key(self, user_id):
+        '''
+        Returns the key of the fanout buffer of user_id, managers
+        sharing a fanout_buffer have their own keys
+        '''
+        return '%s:%s' % (self.name or self.__class__.__name__, user_id)
+
     def remove_user_activity(self, user_id, activity):
         '''
         Remove the activity and then fanout to user followers
@@ -160,23 +349,20 @@ class Manager(object):
         :param user_id: the id of the user
         :param activity: the activity which to remove
         '''
+        started_at = time.time()
         # we don't remove from the global feed due to race conditions
         # but we do remove from the personal feed
         user_feed = self.get_user_feed(user_id)
         user_feed.remove(activity)
 
         # no need to trim when removing items
+        # users in pull mode also fanout the removal, the activity
+        # could have been added before they crossed the pull_fanout_threshold
         operation_kwargs = dict(activities=[activity], trim=False)
 
-        for priority_group, follower_ids in self.get_user_follower_ids(user_id=user_id).items():
-            for feed_class in self.feed_classes.values():
-                self.create_fanout_tasks(
-                    follower_ids,
-                    feed_class,
-                    remove_operation,
-                    operation_kwargs=operation_kwargs,
-                    fanout_priority=priority_group
-                )
+        self.start_user_fanout(
+            user_id, remove_operation, operation_kwargs=operation_kwargs,
+            started_at=started_at)
         self.metrics.on_activity_removed()
 
     def get_feeds(self, user_id):
@@ -188,6 +374,78 @@ class Manager(object):
         '''
         return dict([(k, feed(user_id)) for k, feed in self.feed_classes.items()])
 
+    def get_read_feeds(self, user_id):
+        '''
+        Returns the feeds of user_id for reading, with pull_fanout_threshold
+        the user feeds of the followed users in pull mode are merged in
+
+        Inactive users are marked active, their feeds are rebuilt
+        when they were skipped by the fanout (see active_user_tracker)
+
+        Users skipped by expired fanout chunks get their feeds
+        rebuilt as well (see fanout_scheduler)
+
+        :param user_id: the id of the user
+        :returns dict: a dictionary with the feeds to read from
+        '''
+        if not self.mark_user_active(user_id):
+            self.rebuild_stale_feeds(user_id)
+        feeds = self.get_feeds(user_id)
+        if self.pull_fanout_threshold is None:
+            return feeds
+        pull_feeds = [self.get_user_feed(pull_id)
+                      for pull_id in self.get_user_pull_ids(user_id)]
+        if not pull_feeds:
+            return feeds
+        for name, feed in feeds.items():
+            if feed.pull_merging_supported:
+                feeds[name] = feed.with_pull_feeds(pull_feeds)
+        return feeds
+
+    def mark_user_active(self, user_id):
+        '''
+        Marks user_id as active in the active_user_tracker, the feeds
+        of returning users are rebuilt
+
+        :param user_id: the id of the user
+        :returns bool: True if the feeds were rebuilt
+        '''
+        if self.active_user_tracker is None:
+            return False
+        if self.active_user_tracker.mark_active(user_id):
+            return False
+        self.rebuild_feeds(user_id)
+        return True
+
+    def rebuild_stale_feeds(self, user_id):
+        '''
+        Rebuilds the feeds of user_id when the fanout_scheduler skipped them
+
+        :param user_id: the id of the user
+        :returns bool: True if the feeds were rebuilt
+        '''
+        if self.fanout_scheduler is None:
+            return False
+        namespace = self.name or self.__class__.__name__
+        if not self.fanout_scheduler.pop_stale(namespace, user_id):
+            return False
+        self.rebuild_feeds(user_id)
+        return True
+
+    def rebuild_feeds(self, user_id):
+        '''
+        Rebuilds the feeds of user_id from the user feeds of the users
+        they follow, like following them all again
+
+        :param user_id: the id of the user
+        '''
+        logger.info('rebuilding the feeds of user %s', user_id)
+        for feed in self.get_feeds(user_id).values():
+            feed.delete()
+        following_ids = list(self.get_user_following_ids(user_id))
+        if following_ids:
+            self.follow_many_users(user_id, following_ids, async_=False)
+
     def get_user_feed(self, user_id):
         '''
         feed where activity from :user_id is saved
@@ -196,6 +454,22 @@ class Manager(object):
         '''
         return self.user_feed_class(user_id)
 
+    def get_user_feed_slices(self, user_ids, start, stop, filter_kwargs=None):
+        '''
+        Reads a slice of the user feeds of user_ids at once (in one round
+        trip with redis) without hydrating the activities
+
+        :param user_ids: the ids of the users
+        :param start: the start of the slices
+        :param stop: the stop of the slices
+        :param filter_kwargs: the filter kwargs (see BaseFeed.filter)
+        :returns list: a list of activities for every user id
+        '''
+        keys = [self.get_user_feed(user_id).key for user_id in user_ids]
+        timeline_storage = self.user_feed_class.get_timeline_storage()
+        return timeline_storage.get_slices(
+            keys, start, stop, filter_kwargs=filter_kwargs)
+
     def update_user_activities(self, activities):
         '''
         Update the user activities
@@ -287,6 +561,293 @@ class Manager(object):
 
         unfollow_many_fn(self, user_id, target_ids)
 
+    def get_fanout_feed_classes(self, feed_class_keys=None):
+        '''
+        Returns the feed class targets of the fanout, every target gets its
+        own fanout tasks. With combined_feed_fanout the target is a tuple
+        of all feed classes, handled together in one task
+
+        :param feed_class_keys: only fanout to these keys of feed_classes
+        '''
+        feed_classes = [feed_class for key, feed_class in self.feed_classes.items()
+                        if feed_class_keys is None or key in feed_class_keys]
+        if not feed_classes:
+            return []
+        if self.combined_feed_fanout:
+            return [tuple(feed_classes)]
+        return feed_classes
+
+    def get_fanout_batches(self, feed_classes):
+        '''
+        Groups the feed classes which can share a timeline batch interface,
+        keeping the order of feed_classes
+
+        :param feed_classes: the list of feed classes
+        '''
+        batches = OrderedDict()
+        for feed_class in feed_classes:
+            batch_key = feed_class.get_timeline_batch_interface_key()
+            if batch_key is None:
+                batch_key = feed_class
+            batches.setdefault(batch_key, []).append(feed_class)
+        return list(batches.values())
+
+    def get_fanout_follower_count(self, user_id):
+        '''
+        Returns the follower count of user_id when one of the fanout
+        decisions needs it, so it's queried once per publish
+
+        :returns int: the follower count or None without thresholds
+        '''
+        if self.pull_fanout_threshold is None and self.hierarchical_fanout_threshold is None:
+            return None
+        return self.get_user_follower_count(user_id)
+
+    def use_pull_fanout(self, user_id, follower_count=None):
+        '''
+        Returns True if the activities of user_id are not fanned out
+        but pulled by their followers at read time
+
+        :param follower_count: the follower count when it's already known
+        '''
+        if self.pull_fanout_threshold is None:
+            return False
+        if follower_count is None:
+            follower_count = self.get_user_follower_count(user_id)
+        return follower_count > self.pull_fanout_threshold
+
+    def get_pull_fanout_feed_class_keys(self):
+        '''
+        Returns the keys of the feed classes which can't merge the pulled
+        user feeds at read time (like aggregated feeds), the activities of
+        users in pull mode are still fanned out to them
+        '''
+        return [key for key, feed_class in self.feed_classes.items()
+                if not feed_class.pull_merging_supported]
+
+    def start_pull_user_fanout(self, user_id, operation, operation_kwargs=None, started_at=None,
+                               follower_count=None):
+        '''
+        Starts the fanout of a user in pull mode, only to the feed classes
+        of get_pull_fanout_feed_class_keys
+
+        :returns list: the fanout tasks, empty when all feeds pull
+        '''
+        feed_class_keys = self.get_pull_fanout_feed_class_keys()
+        if not feed_class_keys:
+            return []
+        return self.start_user_fanout(
+            user_id, operation, operation_kwargs=operation_kwargs,
+            started_at=started_at, follower_count=follower_count,
+            feed_class_keys=feed_class_keys)
+
+    def use_hierarchical_fanout(self, user_id, follower_count=None):
+        '''
+        Returns True if the followers of user_id should be handled
+        by a coordinator task
+
+        :param follower_count: the follower count when it's already known
+        '''
+        if self.hierarchical_fanout_threshold is None:
+            return False
+        if follower_count is None:
+            follower_count = self.get_user_follower_count(user_id)
+        return follower_count > self.hierarchical_fanout_threshold
+
+    def estimate_fanout(self, user_id, activities, workers=1, chunk_size=None):
+        '''
+        Estimates the cost of the fanout of activities to the followers of
+        user_id without writing anything, for example to run large imports
+        off-peak or to send the posts of celebrities through a slower path
+
+        Lists of follower ids are counted, when get_user_follower_ids returns
+        other iterables they are left alone and get_user_follower_count is
+        used instead. The number of commands and bytes is derived from the
+        serialized activities, the duration from the fanout cost per user
+        recorded by the fanout_cost_tracker (None before the first fanout)
+
+        **Example**::
+
+            estimates = manager.estimate_fanout(user_id, activities, workers=8)
+            if max(e['seconds'] or 0 for e in estimates.values()) > 60:
+                schedule_off_peak(user_id, activities)
+
+        :param user_id: the user whose followers we fanout to
+        :param activities: the list of activities
+        :param workers: the number of workers running the fanout tasks
+        :param chunk_size: estimate a batch_import with this chunk_size
+            instead of a single fanout
+        :returns dict: for every key of feed_classes a dict with the number
+            of followers, tasks, storage commands, bytes written and seconds.
+            With combined_feed_fanout the first feed class gets the tasks,
+            users in pull mode only fanout to some feed classes
+        '''
+        activities = list(activities)
+        follower_counts = []
+        follower_count = self.get_fanout_follower_count(user_id)
+        feed_class_keys = None
+        if self.use_pull_fanout(user_id, follower_count=follower_count):
+            feed_class_keys = self.get_pull_fanout_feed_class_keys()
+        if feed_class_keys is None or feed_class_keys:
+            follower_ids_by_prio = self.get_user_follower_ids(user_id=user_id)
+            if all(hasattr(ids, '__len__') for ids in follower_ids_by_prio.values()):
+                follower_counts = [len(ids) for ids in follower_ids_by_prio.values()]
+            else:
+                if follower_count is None:
+                    follower_count = self.get_user_follower_count(user_id)
+                follower_counts = [follower_count]
+        follower_count = sum(follower_counts)
+        if chunk_size is None:
+            activity_chunks = [activities]
+        else:
+            activity_chunks = list(chunks(activities, chunk_size))
+        # batch imports don't trim the feeds
+        trim = chunk_size is None
+
+        # the feed classes without fanout
+        estimates = dict(
+            (key, dict(followers=0, tasks=0, commands=0, bytes=0, seconds=0))
+            for key in self.feed_classes)
+        for target in self.get_fanout_feed_classes(feed_class_keys):
+            target_chunk_size = self.get_fanout_chunk_size(target)
+            tasks = sum(int(math.ceil(float(count) / target_chunk_size))
+                        for count in follower_counts) * len(activity_chunks)
+            if isinstance(target, tuple):
+                feed_classes = target
+            else:
+                feed_classes = [target]
+            for index, feed_class in enumerate(feed_classes):
+                feed = feed_class(user_id)
+                commands, bytes_written = 0, 0
+                for activity_chunk in activity_chunks:
+                    chunk_commands, chunk_bytes = feed.estimate_add_many(
+                        activity_chunk, trim=trim)
+                    commands += chunk_commands
+                    bytes_written += chunk_bytes
+                seconds = None
+                cost = self.fanout_cost_tracker.get_cost(feed_class)
+                if cost is not None:
+                    seconds = cost * follower_count * len(activity_chunks) / workers
+                estimates[self.get_feed_class_key(feed_class)] = dict(
+                    followers=follower_count,
+                    # the feed classes of a combined target share its tasks
+                    tasks=tasks if index == 0 else 0,
+                    commands=int(math.ceil(commands * follower_count)),
+                    bytes=bytes_written * follower_count,
+                    seconds=seconds
+                )
+        return estimates
+
+    def start_user_fanout(self, user_id, operation, operation_kwargs=None, started_at=None,
+                          follower_count=None, feed_class_keys=None):
+        '''
+        Starts the fanout to the followers of user_id, either by creating
+        the fanout tasks right away or via a single coordinator task
+
+        :param user_id: the user whose followers we fanout to
+        :param operation: the operation function applied to all follower feeds
+        :param operation_kwargs: kwargs passed to the operation
+        :param started_at: the timestamp the fanout lag is measured from,
+            defaults to now
+        :param follower_count: the follower count when it's already known
+        :param feed_class_keys: only fanout to these keys of feed_classes
+        '''
+        if started_at is None:
+            started_at = time.time()
+        fanout_id = self.create_fanout_id()
+        if not self.use_hierarchical_fanout(user_id, follower_count=follower_count):
+            return self.create_user_fanout_tasks(
+                user_id, operation, operation_kwargs=operation_kwargs,
+                started_at=started_at, fanout_id=fanout_id,
+                feed_class_keys=feed_class_keys)
+        logger.info('starting hierarchical fanout for user %s', user_id)
+        feed_manager, _, operation, operation_kwargs = self.get_fanout_payload(
+            None, operation, operation_kwargs)
+        task = self.fanout_executor.submit_task(
+            self.fanout_coordinator_task,
+            feed_manager=feed_manager,
+            user_id=user_id,
+            operation=operation,
+            operation_kwargs=operation_kwargs,
+            started_at=started_at,
+            fanout_id=fanout_id,
+            feed_class_keys=feed_class_keys
+        )
+        return [task]
+
+    def create_fanout_id(self):
+        '''
+        Returns a new id for a fanout, it's sent along with all the chunks
+        of the fanout and tells the fanout_idempotency keys of a retried
+        chunk apart from the ones of a later fanout of the same activities
+        '''
+        return uuid.uuid4().hex
+
+    def create_user_fanout_tasks(self, user_id, operation, operation_kwargs=None, started_at=None,
+                                 fanout_id=None, feed_class_keys=None):
+        '''
+        Creates the fanout tasks towards all followers of user_id
+        for every priority group and feed class target
+
+        The follower ids of every priority group are streamed once for all
+        feed class targets. When fanout_checkpoint is set the progress is
+        stored, running the same fanout again after a crash continues
+        after the last enqueued chunk
+
+        :param user_id: the user whose followers we fanout to
+        :param operation: the operation function applied to all follower feeds
+        :param operation_kwargs: kwargs passed to the operation
+        :param started_at: the timestamp the fanout lag is measured from
+        :param fanout_id: the id of the fanout, a new one by default
+        :param feed_class_keys: only fanout to these keys of feed_classes
+        '''
+        if fanout_id is None:
+            fanout_id = self.create_fanout_id()
+        checkpoint_key = None
+        if self.fanout_checkpoint is not None:
+            checkpoint_key = self.get_fanout_checkpoint_key(
+                user_id, operation, operation_kwargs)
+        tasks = []
+        follower_counter = itertools.count()
+        follower_ids_by_prio = self.get_user_follower_ids(user_id=user_id)
+        for priority_group, follower_ids in follower_ids_by_prio.items():
+            # count the followers while they are streamed
+            counted_follower_ids = (
+                follower_id for follower_id, _ in six.moves.zip(follower_ids, follower_counter))
+            tasks += self.create_fanout_tasks_for_feed_classes(
+                counted_follower_ids,
+                self.get_fanout_feed_classes(feed_class_keys),
+                operation,
+                operation_kwargs=operation_kwargs,
+                fanout_priority=priority_group,
+                checkpoint_key=checkpoint_key,
+                started_at=started_at,
+                fanout_id=fanout_id
+            )
+        if checkpoint_key is not None:
+            self.fanout_checkpoint.delete(checkpoint_key)
+        follower_count = next(follower_counter)
+        activities_count = len((operation_kwargs or {}).get('activities', []))
+        for key, feed_class in self.feed_classes.items():
+            if feed_class_keys is not None and key not in feed_class_keys:
+                continue
+            self.metrics.on_fanout_amplification(
+                feed_class, activities_count, follower_count)
+        return tasks
+
+    def get_fanout_checkpoint_key(self, user_id, operation, operation_kwargs):
+        '''
+        Returns the key identifying a fanout in the fanout_checkpoint,
+        the same user, operation and activities give the same key
+        '''
+        activities = (operation_kwargs or {}).get('activities', [])
+        activity_ids = ','.join(
+            str(getattr(a, 'serialization_id', a)) for a in activities)
+        activities_hash = hashlib.md5(activity_ids.encode('utf-8')).hexdigest()
+        operation_name = getattr(operation, '__name__', operation)
+        return '%s:%s:%s:%s' % (self.name or self.__class__.__name__,
+                                user_id, operation_name, activities_hash)
+
     def get_fanout_task(self, priority=None, feed_class=None):
         '''
         Returns the fanout task taking priority in account.
@@ -296,6 +857,142 @@ class Manager(object):
         '''
         return self.priority_fanout_task.get(priority, fanout_operation)
 
+    def get_fanout_chunk_size(self, feed_class):
+        '''
+        Returns the number of users handled per fanout task
+
+        With adaptive_fanout_chunk_size the chunk size is derived from the
+        recorded cost per user of feed_class (the sum of the costs when
+        feed_class is a tuple) and bounded by min_fanout_chunk_size and
+        max_fanout_chunk_size
+
+        :param feed_class: the feed class (or tuple of feed classes)
+        '''
+        if not self.adaptive_fanout_chunk_size:
+            return self.fanout_chunk_size
+        if isinstance(feed_class, (list, tuple)):
+            feed_classes = feed_class
+        else:
+            feed_classes = [feed_class]
+        costs = [self.fanout_cost_tracker.get_cost(f) for f in feed_classes]
+        if None in costs or not sum(costs):
+            # we didn't measure these feeds yet
+            return self.fanout_chunk_size
+        chunk_size = int(self.fanout_chunk_duration / sum(costs))
+        chunk_size = max(chunk_size, self.min_fanout_chunk_size)
+        chunk_size = min(chunk_size, self.max_fanout_chunk_size)
+        return chunk_size
+
+    def get_fanout_activity_payload(self):
+        '''
+        Returns how activities travel in compact payloads, 'ids' unless
+        fanout_activity_payload says otherwise or the activities of the
+        user feed don't live in an activity storage
+        '''
+        if self.fanout_activity_payload is not None:
+            return self.fanout_activity_payload
+        if self.user_feed_class.activity_storage_class is None:
+            return 'serialized'
+        if not self.user_feed_class.timeline_stores_ids():
+            return 'serialized'
+        return 'ids'
+
+    def get_fanout_serializer(self):
+        '''
+        Returns the serializer used for activities in compact fanout payloads
+        '''
+        return ActivitySerializer(activity_class=self.user_feed_class.activity_class)
+
+    def get_feed_class_key(self, feed_class):
+        '''
+        Returns the key of feed_class in feed_classes (or a tuple of keys)
+        Feed classes which are not part of feed_classes are returned as is
+        '''
+        if isinstance(feed_class, (list, tuple)):
+            return tuple(map(self.get_feed_class_key, feed_class))
+        for key, value in self.feed_classes.items():
+            if value is feed_class:
+                return key
+        return feed_class
+
+    def get_feed_class(self, feed_class_key):
+        '''
+        Reverse of get_feed_class_key
+        '''
+        if isinstance(feed_class_key, (list, tuple)):
+            return tuple(map(self.get_feed_class, feed_class_key))
+        if isinstance(feed_class_key, six.string_types):
+            return self.feed_classes[feed_class_key]
+        return feed_class_key
+
+    def get_fanout_payload(self, feed_class, operation, operation_kwargs):
+        '''
+        Returns the feed_manager, feed_class, operation and operation_kwargs
+        arguments for the fanout tasks
+
+        Registered managers send a compact payload instead of pickling
+        the manager and the activities: the manager name, the feed class
+        keys, the operation code and the activity ids (or the serialized
+        activities) load_fanout_payload rebuilds the original arguments
+        in the worker
+
+        :param feed_class: the feed class (or tuple of feed classes)
+        :param operation: the operation function
+        :param operation_kwargs: kwargs passed to the operation
+        '''
+        operation_codes = dict(
+            (v, k) for k, v in self.fanout_operations.items())
+        compact = is_registered(self.__class__) and operation in operation_codes
+        if not compact or 'activities' not in (operation_kwargs or {}):
+            return self, feed_class, operation, operation_kwargs
+
+        compact_kwargs = dict(operation_kwargs)
+        activities = compact_kwargs.pop('activities')
+        if self.get_fanout_activity_payload() == 'ids':
+            compact_kwargs['activity_ids'] = [
+                a.serialization_id for a in activities]
+        else:
+            serializer = self.get_fanout_serializer()
+            compact_kwargs['serialized_activities'] = [
+                serializer.dumps(a) for a in activities]
+        feed_class_key = self.get_feed_class_key(feed_class)
+        return self.name, feed_class_key, operation_codes[operation], compact_kwargs
+
+    def load_fanout_payload(self, feed_class, operation, operation_kwargs):
+        '''
+        Rebuilds the feed_class, operation and operation_kwargs from
+        a payload created by get_fanout_payload
+        '''
+        feed_class = self.get_feed_class(feed_class)
+        if isinstance(operation, six.string_types):
+            operation = self.fanout_operations[operation]
+        operation_kwargs = dict(operation_kwargs)
+        if 'serialized_activities' in operation_kwargs:
+            serializer = self.get_fanout_serializer()
+            operation_kwargs['activities'] = [
+                serializer.loads(a) for a in operation_kwargs.pop('serialized_activities')]
+        elif 'activity_ids' in operation_kwargs:
+            activity_ids = operation_kwargs.pop('activity_ids')
+            if isinstance(feed_class, (list, tuple)):
+                feed_classes = feed_class
+            else:
+                feed_classes = [feed_class]
+            if all(f is None or f.timeline_stores_ids() for f in feed_classes):
+                # the timelines only store the ids, the coordinator task
+                # (without feed class) only passes them on
+                operation_kwargs['activities'] = [
+                    DehydratedActivity(serialization_id=i) for i in activity_ids]
+                return feed_class, operation, operation_kwargs
+            activity_storage = self.user_feed_class.get_activity_storage()
+            activity_dict = dict(
+                (a.serialization_id, a) for a in activity_storage.get_many(activity_ids))
+            missing = [i for i in activity_ids if i not in activity_dict]
+            if missing:
+                logger.warning('activities %s are missing from the activity storage', missing)
+            operation_kwargs['activities'] = [
+                activity_dict[i] for i in activity_ids if i in activity_dict]
+        return feed_class, operation, operation_kwargs
+
     def create_fanout_tasks(self, follower_ids, feed_class, operation, operation_kwargs=None, fanout_priority=None):
         '''
         Creates the fanout task for the given activities and feed classes
@@ -304,60 +1001,274 @@ class Manager(object):
         It takes the following ids and distributes them per fanout_chunk_size
         into smaller tasks
 
-        :param follower_ids: specify the list of followers
-        :param feed_class: the feed classes to run the operation on
+        :param follower_ids: specify the followers, any iterable works
+            the chunks are streamed without building the full list
+        :param feed_class: the feed class to run the operation on, or a tuple
+            of feed classes handled together in one task
         :param operation: the operation function applied to all follower feeds
         :param operation_kwargs: kwargs passed to the operation
         :param fanout_priority: the priority set to this fanout
         '''
-        fanout_task = self.get_fanout_task(
-            fanout_priority, feed_class=feed_class)
-        if not fanout_task:
-            return []
-        chunk_size = self.fanout_chunk_size
-        user_ids_chunks = list(chunks(follower_ids, chunk_size))
-        msg_format = 'spawning %s subtasks for %s user ids in chunks of %s users'
-        logger.info(
-            msg_format, len(user_ids_chunks), len(follower_ids), chunk_size)
-        tasks = []
-        # now actually create the tasks
-        for ids_chunk in user_ids_chunks:
-            task = fanout_task.delay(
-                feed_manager=self,
+        return self.create_fanout_tasks_for_feed_classes(
+            follower_ids,
+            [feed_class],
+            operation,
+            operation_kwargs=operation_kwargs,
+            fanout_priority=fanout_priority
+        )
+
+    def create_fanout_tasks_for_feed_classes(self, follower_ids, feed_classes, operation,
+                                             operation_kwargs=None, fanout_priority=None,
+                                             checkpoint_key=None, started_at=None, fanout_id=None):
+        '''
+        Creates the fanout tasks for several feed class targets while
+        iterating over follower_ids only once
+
+        At most one chunk per feed class target is kept in memory
+
+        :param follower_ids: an iterable with the follower ids
+        :param feed_classes: the list of feed class targets
+        :param operation: the operation function applied to all follower feeds
+        :param operation_kwargs: kwargs passed to the operation
+        :param fanout_priority: the priority set to this fanout
+        :param checkpoint_key: the key to store the progress with in the
+            fanout_checkpoint, targets resume from their stored offset
+        :param started_at: the timestamp the fanout lag is measured from
+        :param fanout_id: the id of the fanout, a new one by default
+        '''
+        if fanout_id is None:
+            fanout_id = self.create_fanout_id()
+        offsets = {}
+        if checkpoint_key is not None:
+            offsets = self.fanout_checkpoint.get_offsets(checkpoint_key)
+
+        targets = []
+        for feed_class in feed_classes:
+            fanout_task = self.get_fanout_task(
+                fanout_priority, feed_class=feed_class)
+            if not fanout_task:
+                continue
+            name = '%s:%s' % (fanout_priority, self.get_feed_class_key(feed_class))
+            targets.append(dict(
+                name=name,
                 feed_class=feed_class,
+                fanout_task=fanout_task,
+                chunk_size=self.get_fanout_chunk_size(feed_class),
+                payload=self.get_fanout_payload(
+                    feed_class, operation, operation_kwargs),
+                offset=offsets.get(name, 0),
+                chunk=[],
+                tasks=[]
+            ))
+        if not targets:
+            return []
+
+        def enqueue(target):
+            feed_manager, task_feed_class, task_operation, task_kwargs = target['payload']
+            ids_chunk = tuple(target['chunk'])
+            task = self.fanout_executor.submit(
+                target['fanout_task'],
+                feed_manager=feed_manager,
+                feed_class=task_feed_class,
                 user_ids=ids_chunk,
-                operation=operation,
-                operation_kwargs=operation_kwargs
+                operation=task_operation,
+                operation_kwargs=task_kwargs,
+                fanout_priority=fanout_priority,
+                enqueued_at=time.time(),
+                started_at=started_at,
+                fanout_id=fanout_id
             )
-            tasks.append(task)
+            target['tasks'].append(task)
+            target['offset'] += len(ids_chunk)
+            target['chunk'] = []
+            if checkpoint_key is not None:
+                self.fanout_checkpoint.set_offset(
+                    checkpoint_key, target['name'], target['offset'])
+
+        # skip the followers which every target already enqueued
+        position = min(target['offset'] for target in targets)
+        for follower_id in itertools.islice(follower_ids, position, None):
+            for target in targets:
+                if position < target['offset']:
+                    continue
+                target['chunk'].append(follower_id)
+                if len(target['chunk']) >= target['chunk_size']:
+                    enqueue(target)
+            position += 1
+
+        tasks = []
+        msg_format = 'spawned %s subtasks for %s user ids in chunks of %s users for %s'
+        for target in targets:
+            if target['chunk']:
+                enqueue(target)
+            logger.info(msg_format, len(target['tasks']), target['offset'],
+                        target['chunk_size'], target['feed_class'])
+            tasks += target['tasks']
         return tasks
 
-    def fanout(self, user_ids, feed_class, operation, operation_kwargs):
+    def fanout(self, user_ids, feed_class, operation, operation_kwargs,
+               fanout_priority=None, enqueued_at=None, started_at=None, fanout_id=None):
         '''
         This functionality is called from within stream_framework.tasks.fanout_operation
 
         :param user_ids: the list of user ids which feeds we should apply the
             operation against
-        :param feed_class: the feed to run the operation on
+        :param feed_class: the feed to run the operation on, or a tuple of
+            feed classes
         :param operation: the operation to run on the feed
         :param operation_kwargs: kwargs to pass to the operation
+        :param fanout_priority: the priority of the fanout
+        :param enqueued_at: the timestamp of the chunk creation, used
+            for the deadlines of the fanout_scheduler
+        :param started_at: the timestamp of the start of the fanout,
+            the fanout lag is measured from it
+        :param fanout_id: the id of the fanout the chunk belongs to,
+            part of the fanout_idempotency keys
 
         '''
-        with self.metrics.fanout_timer(feed_class):
-            separator = '===' * 10
-            logger.info('%s starting fanout %s', separator, separator)
-            batch_context_manager = feed_class.get_timeline_batch_interface()
-            msg_format = 'starting batch interface for feed %s, fanning out to %s users'
+        feed_class, operation, operation_kwargs = self.load_fanout_payload(
+            feed_class, operation, operation_kwargs)
+        if isinstance(feed_class, (list, tuple)):
+            feed_classes = feed_class
+        else:
+            feed_classes = [feed_class]
+        if enqueued_at is not None:
+            queue_wait = time.time() - enqueued_at
+            for queued_feed_class in feed_classes:
+                self.metrics.on_fanout_queue_wait(queued_feed_class, queue_wait)
+        unit_keys = {}
+        done_keys = set()
+        if self.fanout_idempotency is not None:
+            for unit_feed_class in feed_classes:
+                unit_keys[unit_feed_class] = self.get_fanout_unit_key(
+                    user_ids, unit_feed_class, operation, operation_kwargs,
+                    fanout_id=fanout_id)
+            done_keys = self.fanout_idempotency.get_done(list(unit_keys.values()))
+        if self.active_user_tracker is not None:
+            # inactive users get their feeds rebuilt when they return
+            active_user_ids = self.active_user_tracker.get_active(user_ids)
+            user_ids = [u for u in user_ids if u in active_user_ids]
+        separator = '===' * 10
+        logger.info('%s starting fanout %s', separator, separator)
+        for batch_feed_classes in self.get_fanout_batches(feed_classes):
+            if done_keys:
+                skipped = [f for f in batch_feed_classes if unit_keys[f] in done_keys]
+                if skipped:
+                    logger.info('skipping feeds %s, the fanout already completed', skipped)
+                batch_feed_classes = [
+                    f for f in batch_feed_classes if f not in skipped]
+                if not batch_feed_classes:
+                    continue
+            batch_context_manager = batch_feed_classes[0].get_timeline_batch_interface()
+            msg_format = 'starting batch interface for feeds %s, fanning out to %s users'
+            durations = OrderedDict()
             with batch_context_manager as batch_interface:
-                logger.info(msg_format, feed_class, len(user_ids))
-                operation_kwargs['batch_interface'] = batch_interface
-                for user_id in user_ids:
-                    logger.debug('now handling fanout to user %s', user_id)
-                    feed = feed_class(user_id)
-                    operation(feed, **operation_kwargs)
-            logger.info('finished fanout for feed %s', feed_class)
+                logger.info(msg_format, batch_feed_classes, len(user_ids))
+                kwargs = dict(operation_kwargs, batch_interface=batch_interface)
+                for batch_feed_class in batch_feed_classes:
+                    if not self.schedule_fanout(user_ids, batch_feed_class, operation,
+                                                operation_kwargs, fanout_priority,
+                                                enqueued_at, started_at, fanout_id):
+                        continue
+                    t = timer()
+                    with self.metrics.fanout_timer(batch_feed_class):
+                        for user_id in user_ids:
+                            logger.debug('now handling fanout to user %s', user_id)
+                            feed = batch_feed_class(user_id)
+                            operation(feed, **kwargs)
+                    durations[batch_feed_class] = t.next()
+                t = timer()
+            # the batch interface sends the writes when it exits,
+            # the feed classes of the batch share the time it took
+            write_duration = t.next()
+            for batch_feed_class, duration in durations.items():
+                duration += write_duration / len(durations)
+                self.fanout_cost_tracker.record(
+                    batch_feed_class, len(user_ids), duration)
+                self.metrics.on_fanout_chunk(
+                    batch_feed_class, duration, len(user_ids))
+                if started_at is not None:
+                    self.metrics.on_fanout_lag(
+                        batch_feed_class, time.time() - started_at)
+            if self.fanout_idempotency is not None:
+                # the chunks enqueued again by the scheduler aren't done
+                self.fanout_idempotency.mark_done(
+                    [unit_keys[f] for f in durations])
+            logger.info('finished fanout for feeds %s', batch_feed_classes)
         fanout_count = len(operation_kwargs['activities']) * len(user_ids)
-        self.metrics.on_fanout(feed_class, operation, fanout_count)
+        for fanout_feed_class in feed_classes:
+            self.metrics.on_fanout(fanout_feed_class, operation, fanout_count)
+
+    def schedule_fanout(self, user_ids, feed_class, operation, operation_kwargs,
+                        fanout_priority, enqueued_at, started_at=None, fanout_id=None):
+        '''
+        Checks if the rate limits of the fanout_scheduler allow the fanout
+        of the chunk to feed_class, otherwise the chunk is enqueued again
+        with a countdown instead of blocking the worker
+
+        Chunks adding activities are skipped once they miss the deadline
+        of their priority, their users are marked stale. Removals always run
+
+        :returns bool: False if the chunk should be skipped
+        '''
+        if self.fanout_scheduler is None or not user_ids:
+            return True
+        expired = self.fanout_scheduler.is_expired(fanout_priority, enqueued_at)
+        if expired and operation is add_operation:
+            logger.warning('skipping the %s fanout to %s users for %s, it missed its deadline',
+                           fanout_priority, len(user_ids), feed_class)
+            self.fanout_scheduler.mark_stale(
+                self.name or self.__class__.__name__, user_ids)
+            return False
+        wait = self.fanout_scheduler.take_turn(
+            fanout_priority, get_feed_class_name(feed_class), len(user_ids))
+        if not wait:
+            return True
+        logger.info('retrying the %s fanout to %s users for %s in %.2f seconds',
+                    fanout_priority, len(user_ids), feed_class, wait)
+        feed_manager, task_feed_class, task_operation, task_kwargs = self.get_fanout_payload(
+            feed_class, operation, operation_kwargs)
+        # the chunk keeps its enqueued_at, so it still expires
+        self.fanout_executor.submit_task(
+            self.get_fanout_task(fanout_priority, feed_class=feed_class),
+            countdown=wait,
+            feed_manager=feed_manager,
+            feed_class=task_feed_class,
+            user_ids=tuple(user_ids),
+            operation=task_operation,
+            operation_kwargs=task_kwargs,
+            fanout_priority=fanout_priority,
+            enqueued_at=enqueued_at,
+            started_at=started_at,
+            fanout_id=fanout_id
+        )
+        return False
+
+    def get_fanout_unit_key(self, user_ids, feed_class, operation, operation_kwargs,
+                            fanout_id=None):
+        '''
+        Returns the key identifying the fanout of the activities to the
+        user_ids chunk for one feed class, used by fanout_idempotency
+
+        Adding the same activities again (after removing them) is a new
+        fanout with another fanout_id, so its chunks aren't skipped
+
+        :param user_ids: the chunk of user ids
+        :param feed_class: the feed class
+        :param operation: the operation function
+        :param operation_kwargs: kwargs passed to the operation
+        :param fanout_id: the id of the fanout the chunk belongs to
+        '''
+        activities = operation_kwargs.get('activities', [])
+        unit = '%s:%s:%s:%s:%s' % (
+            fanout_id,
+            getattr(operation, '__name__', operation),
+            get_feed_class_name(feed_class),
+            ','.join(str(getattr(a, 'serialization_id', a)) for a in activities),
+            ','.join(map(str, user_ids))
+        )
+        unit_hash = hashlib.md5(unit.encode('utf-8')).hexdigest()
+        return '%s:%s' % (self.name or self.__class__.__name__, unit_hash)
 
     def batch_import(self, user_id, activities, fanout=True, chunk_size=500):
         '''
@@ -385,6 +1296,14 @@ class Manager(object):
         if activities[0].actor_id != user_id:
             raise ValueError('Send activities for only one user please')
 
+        follower_count = None
+        pull_fanout = False
+        if fanout:
+            follower_count = self.get_fanout_follower_count(user_id)
+            pull_fanout = self.use_pull_fanout(user_id, follower_count=follower_count)
+        if pull_fanout:
+            logger.info('followers pull the activities of user %s', user_id)
+
         activity_chunks = list(chunks(activities, chunk_size))
         logger.info('processing %s items in %s chunks of %s',
                     len(activities), len(activity_chunks), chunk_size)
@@ -401,16 +1320,13 @@ class Manager(object):
             # now start a big fanout task
             if fanout:
                 logger.info('starting task fanout for chunk %s', index)
-                follower_ids_by_prio = self.get_user_follower_ids(
-                    user_id=user_id)
                 # create the fanout tasks
                 operation_kwargs = dict(activities=activity_chunk, trim=False)
-                for feed_class in self.feed_classes.values():
-                    for priority_group, fids in follower_ids_by_prio.items():
-                        self.create_fanout_tasks(
-                            fids,
-                            feed_class,
-                            add_operation,
-                            fanout_priority=priority_group,
-                            operation_kwargs=operation_kwargs
-                        )
+                if pull_fanout:
+                    self.start_pull_user_fanout(
+                        user_id, add_operation, operation_kwargs=operation_kwargs,
+                        follower_count=follower_count)
+                else:
+                    self.start_user_fanout(
+                        user_id, add_operation, operation_kwargs=operation_kwargs,
+                        follower_count=follower_count)
@@ -0,0 +1,75 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+
+
+class FanoutBuffer(object):
+
+    '''
+    Buffers the serialized activities of an author until their
+    fanout is flushed, see Manager.fanout_coalesce_window
+
+    The default implementation keeps the activities in process, it
+    only works when the flush task runs in the same process (for instance
+    with CELERY_ALWAYS_EAGER). Use :class:`RedisFanoutBuffer` otherwise
+    '''
+    #: True when the flush task can run in another process
+    shared = False
+
+    def __init__(self):
+        self.items = {}
+
+    def add(self, key, item):
+        '''
+        Appends item to the buffer, returns the number of buffered items
+
+        :param key: the key of the buffer, for instance the manager name and author id
+        :param item: the serialized activity
+        '''
+        items = self.items.setdefault(key, [])
+        items.append(item)
+        return len(items)
+
+    def pop_all(self, key):
+        '''
+        Empties the buffer and returns its items in insertion order
+
+        :param key: the key of the buffer
+        '''
+        return self.items.pop(key, [])
+
+
+class RedisFanoutBuffer(FanoutBuffer):
+
+    '''
+    Buffers the activities in a redis list per author
+    '''
+    shared = True
+    key_format = 'fanout:buffer:%s'
+    #: buffers which are never flushed expire after ttl seconds
+    ttl = 60 * 60
+
+    def __init__(self, redis_server='default', ttl=None):
+        self.redis_server = redis_server
+        if ttl is not None:
+            self.ttl = ttl
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def add(self, key, item):
+        redis_key = self.key_format % key
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.rpush(redis_key, item)
+        pipe.expire(redis_key, self.ttl)
+        length, _ = pipe.execute()
+        return length
+
+    def pop_all(self, key):
+        redis_key = self.key_format % key
+        # read and delete in one transaction, items added concurrently
+        # end up in the next buffer
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.lrange(redis_key, 0, -1)
+        pipe.delete(redis_key)
+        items, _ = pipe.execute()
+        return items
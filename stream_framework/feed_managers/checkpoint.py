@@ -0,0 +1,66 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+
+
+class FanoutCheckpoint(object):
+
+    '''
+    Stores the progress of a fanout, for every fanout target the number
+    of follower ids which were already enqueued
+
+    The default implementation keeps the progress in process,
+    use :class:`RedisFanoutCheckpoint` to resume fanouts which crashed
+    in another process
+    '''
+
+    def __init__(self):
+        self.offsets = {}
+
+    def get_offsets(self, key):
+        '''
+        Returns a dict mapping the targets of the fanout to their offset
+
+        :param key: the key identifying the fanout
+        '''
+        return dict(self.offsets.get(key, {}))
+
+    def set_offset(self, key, target, offset):
+        '''
+        Stores the number of follower ids enqueued for the target
+        '''
+        self.offsets.setdefault(key, {})[target] = offset
+
+    def delete(self, key):
+        self.offsets.pop(key, None)
+
+
+class RedisFanoutCheckpoint(FanoutCheckpoint):
+
+    '''
+    Stores the fanout progress in a redis hash per fanout
+    '''
+    key_format = 'fanout:checkpoint:%s'
+    #: checkpoints of fanouts which never finish expire after ttl seconds
+    ttl = 24 * 60 * 60
+
+    def __init__(self, redis_server='default', ttl=None):
+        self.redis_server = redis_server
+        if ttl is not None:
+            self.ttl = ttl
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def get_offsets(self, key):
+        offsets = self.redis.hgetall(self.key_format % key)
+        return dict((target, int(offset)) for target, offset in offsets.items())
+
+    def set_offset(self, key, target, offset):
+        redis_key = self.key_format % key
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hset(redis_key, target, offset)
+        pipe.expire(redis_key, self.ttl)
+        pipe.execute()
+
+    def delete(self, key):
+        self.redis.delete(self.key_format % key)
@@ -0,0 +1,85 @@
+from stream_framework.storage.redis.structures.hash import RedisHashCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_feed_class_name(feed_class):
+    return '%s.%s' % (feed_class.__module__, feed_class.__name__)
+
+
+class FanoutCostTracker(object):
+
+    '''
+    Keeps track of the time it takes to run a fanout operation for one user
+    per feed class, using an exponentially weighted moving average
+
+    The costs are stored in process, use the :class:`RedisFanoutCostTracker`
+    to share them between the celery workers measuring the cost and
+    the processes creating the fanout tasks
+
+    **Example** ::
+
+        tracker = FanoutCostTracker()
+        tracker.record(PinFeed, user_count=100, duration=0.5)
+        tracker.get_cost(PinFeed)  # 0.005 seconds per user
+    '''
+    #: the weight of a new measurement in the moving average
+    decay = 0.2
+
+    def __init__(self, decay=None):
+        if decay is not None:
+            self.decay = decay
+        self.costs = {}
+
+    def get_stored_cost(self, name):
+        return self.costs.get(name)
+
+    def set_stored_cost(self, name, cost):
+        self.costs[name] = cost
+
+    def record(self, feed_class, user_count, duration):
+        '''
+        Records the duration of a fanout to user_count feeds of feed_class
+
+        :param feed_class: the feed class
+        :param user_count: the number of feeds the operation ran on
+        :param duration: the duration in seconds
+        '''
+        if not user_count:
+            return
+        name = get_feed_class_name(feed_class)
+        cost = float(duration) / user_count
+        current_cost = self.get_stored_cost(name)
+        if current_cost is not None:
+            cost = self.decay * cost + (1 - self.decay) * current_cost
+        logger.debug('fanout cost for %s is now %s seconds per user', name, cost)
+        self.set_stored_cost(name, cost)
+
+    def get_cost(self, feed_class):
+        '''
+        Returns the average seconds per user for feed_class
+        or None when nothing was recorded yet
+        '''
+        return self.get_stored_cost(get_feed_class_name(feed_class))
+
+
+class RedisFanoutCostTracker(FanoutCostTracker):
+
+    '''
+    Cost tracker which stores the moving averages in a redis hash
+    '''
+    key = 'fanout:cost'
+
+    def __init__(self, decay=None, key=None, redis_server='default'):
+        FanoutCostTracker.__init__(self, decay=decay)
+        self.cache = RedisHashCache(key or self.key, redis_server=redis_server)
+
+    def get_stored_cost(self, name):
+        cost = self.cache.get_many([name])[name]
+        if cost is not None:
+            cost = float(cost)
+        return cost
+
+    def set_stored_cost(self, name, cost):
+        self.cache.set_many([(name, cost)])
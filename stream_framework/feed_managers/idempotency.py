@@ -0,0 +1,69 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.utils import LRUCache, MISSING
+
+
+class FanoutIdempotency(object):
+
+    '''
+    Records the completed units of work of fanout tasks, so a retried
+    task can skip the units which were already written
+
+    The default implementation keeps at most capacity keys in process
+    for ttl seconds, use :class:`RedisFanoutIdempotency` to share them
+    between workers
+    '''
+    #: completed units are forgotten after ttl seconds, this
+    #: should be longer than the time it takes to retry a task
+    ttl = 60 * 60
+
+    def __init__(self, capacity=100000, ttl=None):
+        if ttl is not None:
+            self.ttl = ttl
+        self.done = LRUCache(capacity, ttl=self.ttl)
+
+    def get_done(self, keys):
+        '''
+        Returns the set of keys which were already completed
+
+        :param keys: a list of unit keys
+        '''
+        return set(key for key in keys if self.done.get(key) is not MISSING)
+
+    def mark_done(self, keys):
+        '''
+        Records the keys as completed
+
+        :param keys: a list of unit keys
+        '''
+        for key in keys:
+            self.done.set(key, True)
+
+
+class RedisFanoutIdempotency(FanoutIdempotency):
+
+    '''
+    Stores a small redis key per completed unit
+    '''
+    key_format = 'fanout:done:%s'
+
+    def __init__(self, redis_server='default', ttl=None):
+        self.redis_server = redis_server
+        if ttl is not None:
+            self.ttl = ttl
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def get_done(self, keys):
+        keys = list(keys)
+        if not keys:
+            return set()
+        values = self.redis.mget([self.key_format % key for key in keys])
+        return set(key for key, value in zip(keys, values) if value is not None)
+
+    def mark_done(self, keys):
+        pipe = self.redis.pipeline(transaction=False)
+        for key in keys:
+            pipe.set(self.key_format % key, 1, ex=self.ttl)
+        pipe.execute()
@@ -0,0 +1,40 @@
+MANAGER_DICT = dict()
+
+
+def register(manager_class):
+    '''
+    Registers the given manager class under its name
+
+    Fanout tasks of registered managers only carry the manager name,
+    the workers rebuild the manager from this registry
+
+    **Example** ::
+
+        @register
+        class PinManager(Manager):
+            name = 'pin'
+
+    '''
+    from stream_framework.feed_managers.base import Manager
+    if not issubclass(manager_class, Manager):
+        raise ValueError('%s doesnt subclass Manager' % manager_class)
+    if not manager_class.name:
+        raise ValueError('cant register manager %r without a name' % manager_class)
+    registered_manager = MANAGER_DICT.get(manager_class.name, manager_class)
+    if registered_manager != manager_class:
+        raise ValueError(
+            'cant register manager %r with name %s (clashing with manager %r)' %
+            (manager_class, manager_class.name, registered_manager))
+    MANAGER_DICT[manager_class.name] = manager_class
+    return manager_class
+
+
+def is_registered(manager_class):
+    return MANAGER_DICT.get(manager_class.name) is manager_class
+
+
+def get_manager_by_name(name):
+    '''
+    Returns an instance of the manager registered with the given name
+    '''
+    return MANAGER_DICT[name]()
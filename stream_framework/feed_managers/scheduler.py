@@ -0,0 +1,236 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.utils import LRUCache, MISSING
+import threading
+import time
+
+
+class TokenBucket(object):
+
+    '''
+    A token bucket refilling at rate tokens per second, holding at most burst tokens
+    '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.updated_at = time.time()
+
+    def refill(self):
+        now = time.time()
+        elapsed = max(0, now - self.updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def get_wait(self, tokens):
+        '''
+        Returns the number of seconds until tokens are available, 0 if they are
+        '''
+        self.refill()
+        # chunks larger than the burst only wait for a full bucket
+        tokens = min(tokens, self.burst)
+        if self.tokens >= tokens:
+            return 0
+        return (tokens - self.tokens) / self.rate
+
+    def take(self, tokens):
+        self.tokens -= min(tokens, self.burst)
+
+
+class FanoutScheduler(object):
+
+    '''
+    Rate limits the fanout chunks per priority and per feed class, and
+    sheds the chunks which waited longer than the deadline of their priority
+
+    rate_limits maps a priority, a feed class name (see
+    cost_tracker.get_feed_class_name) or a (priority, feed class name) tuple
+    to a (rate, burst) tuple, rates count the feeds written per second.
+    A chunk takes tokens from every matching bucket, when one of them
+    doesn't have enough the chunk is enqueued again with a countdown
+
+    deadlines maps priorities to the number of seconds after which their
+    chunks expire. Expired chunks adding activities are skipped, with the
+    'rebuild' expired_action their users are marked stale and their feeds
+    are rebuilt on the next read (see Manager.get_read_feeds). Users who
+    don't return within stale_ttl seconds are forgotten
+
+    **Example** ::
+
+        scheduler = FanoutScheduler(
+            rate_limits={FanoutPriority.LOW: (2000, 5000)},
+            deadlines={FanoutPriority.LOW: 30}
+        )
+
+    The default implementation keeps the buckets and the stale users in
+    process, use :class:`RedisFanoutScheduler` to share them between workers
+    '''
+    #: what happens to the users of an expired chunk, 'rebuild' or 'drop'
+    expired_action = 'rebuild'
+    #: the number of seconds the stale users are remembered
+    stale_ttl = 7 * 24 * 60 * 60
+
+    def __init__(self, rate_limits=None, deadlines=None, expired_action=None,
+                 stale_ttl=None, stale_capacity=100000):
+        self.rate_limits = dict(rate_limits or {})
+        self.deadlines = dict(deadlines or {})
+        if expired_action is not None:
+            self.expired_action = expired_action
+        if self.expired_action not in ('rebuild', 'drop'):
+            raise ValueError('unknown expired action %r' % self.expired_action)
+        if stale_ttl is not None:
+            self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.stale_users = LRUCache(stale_capacity, ttl=self.stale_ttl)
+
+    def get_bucket_keys(self, priority, feed_class_name):
+        '''
+        Returns the keys of the rate_limits applying to the chunk
+        '''
+        keys = [priority, feed_class_name, (priority, feed_class_name)]
+        return [key for key in keys if key in self.rate_limits]
+
+    def take(self, keys, tokens):
+        '''
+        Takes tokens from all the buckets or none of them
+
+        :returns: the number of seconds to wait before trying again, 0 when
+            the tokens were taken
+        '''
+        with self.lock:
+            buckets = []
+            for key in keys:
+                if key not in self.buckets:
+                    self.buckets[key] = TokenBucket(*self.rate_limits[key])
+                buckets.append(self.buckets[key])
+            wait = max([bucket.get_wait(tokens) for bucket in buckets] or [0])
+            if not wait:
+                for bucket in buckets:
+                    bucket.take(tokens)
+            return wait
+
+    def is_expired(self, priority, enqueued_at):
+        deadline = self.deadlines.get(priority)
+        if deadline is None or enqueued_at is None:
+            return False
+        return time.time() - enqueued_at > deadline
+
+    def take_turn(self, priority, feed_class_name, tokens):
+        '''
+        Takes the tokens for writing tokens feeds when the rate limits allow it,
+        the worker doesn't wait for them
+
+        :param priority: the priority of the chunk
+        :param feed_class_name: the name of the feed class the chunk writes to
+        :param tokens: the number of feeds the chunk writes
+        :returns: 0 when the chunk can run, otherwise the number of seconds
+            after which the chunk should try again
+        '''
+        keys = self.get_bucket_keys(priority, feed_class_name)
+        if not keys:
+            return 0
+        return self.take(keys, tokens)
+
+    def mark_stale(self, namespace, user_ids):
+        '''
+        Records that the fanout skipped user_ids
+
+        :param namespace: the name of the manager
+        :param user_ids: a list of user ids
+        '''
+        if self.expired_action != 'rebuild':
+            return
+        for user_id in user_ids:
+            self.stale_users.set((namespace, user_id), True)
+
+    def pop_stale(self, namespace, user_id):
+        '''
+        Returns True if user_id was marked stale and forgets about it
+
+        :param namespace: the name of the manager
+        :param user_id: the user id
+        '''
+        with self.lock:
+            if self.stale_users.get((namespace, user_id)) is MISSING:
+                return False
+            self.stale_users.delete((namespace, user_id))
+            return True
+
+
+class RedisFanoutScheduler(FanoutScheduler):
+
+    '''
+    Keeps the token buckets in redis hashes and every stale user in a small
+    redis key, a lua script takes the tokens from all buckets atomically
+    '''
+    key_format = 'fanout:rate:%s'
+    stale_key_format = 'fanout:stale:%s:%s'
+
+    take_script = '''
+    local now = tonumber(ARGV[1])
+    local tokens = tonumber(ARGV[2])
+    local wait = 0
+    local levels = {}
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[1 + i * 2])
+        local burst = tonumber(ARGV[2 + i * 2])
+        local state = redis.call('HMGET', key, 'tokens', 'ts')
+        local level = tonumber(state[1]) or burst
+        local elapsed = math.max(0, now - (tonumber(state[2]) or now))
+        level = math.min(burst, level + elapsed * rate)
+        levels[i] = level
+        local needed = math.min(tokens, burst)
+        if level < needed then
+            wait = math.max(wait, (needed - level) / rate)
+        end
+    end
+    if wait > 0 then
+        return tostring(wait)
+    end
+    for i, key in ipairs(KEYS) do
+        local rate = tonumber(ARGV[1 + i * 2])
+        local burst = tonumber(ARGV[2 + i * 2])
+        redis.call('HMSET', key, 'tokens', tostring(levels[i] - math.min(tokens, burst)), 'ts', tostring(now))
+        redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+    end
+    return '0'
+    '''
+
+    def __init__(self, rate_limits=None, deadlines=None, expired_action=None,
+                 stale_ttl=None, redis_server='default'):
+        super(RedisFanoutScheduler, self).__init__(
+            rate_limits, deadlines, expired_action, stale_ttl)
+        self.redis_server = redis_server
+        self.script = None
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def get_bucket_key(self, key):
+        if isinstance(key, tuple):
+            key = ':'.join(map(str, key))
+        return self.key_format % key
+
+    def take(self, keys, tokens):
+        if self.script is None:
+            self.script = self.redis.register_script(self.take_script)
+        args = [repr(time.time()), tokens]
+        for key in keys:
+            rate, burst = self.rate_limits[key]
+            args += [rate, burst or rate]
+        wait = self.script(
+            keys=[self.get_bucket_key(key) for key in keys], args=args)
+        return float(wait)
+
+    def mark_stale(self, namespace, user_ids):
+        if self.expired_action != 'rebuild' or not user_ids:
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.set(self.stale_key_format % (namespace, user_id), 1, ex=self.stale_ttl)
+        pipe.execute()
+
+    def pop_stale(self, namespace, user_id):
+        return bool(self.redis.delete(self.stale_key_format % (namespace, user_id)))
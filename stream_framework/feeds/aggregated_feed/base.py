@@ -58,6 +58,9 @@ class AggregatedFeed(BaseFeed):
     # : we use a different timeline serializer for aggregated activities
     timeline_serializer = AggregatedActivitySerializer
 
+    # : pulled activities would need to be aggregated at read time
+    pull_merging_supported = False
+
     @classmethod
     def get_timeline_storage_options(cls):
         '''
@@ -97,15 +100,32 @@ class AggregatedFeed(BaseFeed):
         logger.debug('merge took %s', t.next())
 
         # new ones we insert, changed we do a delete and insert
-        new_aggregated = self._update_from_diff(new, changed, deleted)
+        trims_on_write = trim and self.timeline_storage.trims_on_write
+        new_aggregated = self._update_from_diff(
+            new, changed, deleted,
+            max_length=self.max_length if trims_on_write else None)
         new_aggregated = aggregator.rank(new_aggregated)
 
         # trim every now and then
-        if trim and random.random() <= self.trim_chance:
+        if trim and not trims_on_write and random.random() <= self.trim_chance:
             self.timeline_storage.trim(self.key, self.max_length)
 
         return new_aggregated
 
+    def estimate_add_many(self, activities, trim=True):
+        '''
+        Estimates the cost of add_many without writing anything, the
+        aggregated activities are read before they're written
+
+        :param activities: a list of activities
+        :param trim: if add_many would trim the feed
+        :returns tuple: the expected number of storage commands and bytes written
+        '''
+        aggregated = self.get_aggregator().aggregate(activities)
+        commands, bytes_written = super(AggregatedFeed, self).estimate_add_many(
+            aggregated, trim=trim)
+        return commands + 1, bytes_written
+
     def remove_many(self, activities, batch_interface=None, trim=True, *args, **kwargs):
         '''
         Removes many activities from the feed
@@ -143,16 +163,25 @@ class AggregatedFeed(BaseFeed):
 
         # stick the activities to remove in changed or remove
         hydrated_aggregated = activity_remove_dict.keys()
+        # remove the aggregated activities as they are stored, hydrating
+        # leaves out the activities missing from the activity storage
+        stored_dict = dict((a.group, copy.deepcopy(a)) for a in hydrated_aggregated)
         if self.needs_hydration(hydrated_aggregated):
             hydrated_aggregated = self.hydrate_activities(hydrated_aggregated)
         hydrate_dict = dict((a.group, a) for a in hydrated_aggregated)
 
         for aggregated, activity_ids_to_remove in activity_remove_dict.items():
+            original = stored_dict[aggregated.group]
             aggregated = hydrate_dict.get(aggregated.group)
+            if aggregated is None:
+                # all its activities are gone from the activity storage
+                deleted.append(original)
+                continue
+            activity_ids_to_remove = [
+                i for i in activity_ids_to_remove if i in aggregated.activity_ids]
             if len(aggregated) == len(activity_ids_to_remove):
-                deleted.append(aggregated)
+                deleted.append(original)
             else:
-                original = copy.deepcopy(aggregated)
                 activities_to_remove = map(
                     activity_dict.get, activity_ids_to_remove)
                 aggregated.remove_many(activities_to_remove)
@@ -171,6 +200,7 @@ class AggregatedFeed(BaseFeed):
         validate_list_of_strict(
             aggregated, (self.aggregated_activity_class, FakeAggregatedActivity))
         self.timeline_storage.add_many(self.key, aggregated, *args, **kwargs)
+        self.invalidate_head_page(kwargs.get('batch_interface'))
 
     def remove_many_aggregated(self, aggregated, *args, **kwargs):
         '''
@@ -182,6 +212,7 @@ class AggregatedFeed(BaseFeed):
             aggregated, (self.aggregated_activity_class, FakeAggregatedActivity))
         self.timeline_storage.remove_many(
             self.key, aggregated, *args, **kwargs)
+        self.invalidate_head_page(kwargs.get('batch_interface'))
 
     def contains(self, activity):
         '''
@@ -214,7 +245,7 @@ class AggregatedFeed(BaseFeed):
             self.aggregated_activity_class, self.activity_class)
         return aggregator
 
-    def _update_from_diff(self, new, changed, deleted):
+    def _update_from_diff(self, new, changed, deleted, max_length=None):
         '''
         Sends the add and remove commands to the storage layer based on a diff
         of
@@ -222,6 +253,8 @@ class AggregatedFeed(BaseFeed):
         :param new: list of new items
         :param changed: list of tuples (from, to)
         :param deleted: list of things to delete
+        :param max_length: trims the feed to max_length while adding,
+            for timeline storages which trim on write
         '''
         msg_format = 'now updating from diff new: %s changed: %s deleted: %s'
         logger.debug(msg_format, *map(len, [new, changed, deleted]))
@@ -234,10 +267,13 @@ class AggregatedFeed(BaseFeed):
                     to_remove, batch_interface=batch_interface)
 
         # now add the new ones
+        add_kwargs = {}
+        if max_length is not None:
+            add_kwargs['max_length'] = max_length
         with self.get_timeline_batch_interface() as batch_interface:
             if to_add:
                 self.add_many_aggregated(
-                    to_add, batch_interface=batch_interface)
+                    to_add, batch_interface=batch_interface, **add_kwargs)
 
         logger.debug(
             'removed %s, added %s items from feed %s', len(to_remove), len(to_add), self)
@@ -1,11 +1,16 @@
 import copy
+import itertools
 import random
+from collections import OrderedDict
 
 from stream_framework.serializers.base import BaseSerializer
 from stream_framework.serializers.simple_timeline_serializer import \
     SimpleTimelineSerializer
 from stream_framework.storage.base import BaseActivityStorage, BaseTimelineStorage
-from stream_framework.activity import Activity
+from stream_framework.storage.head_page_cache import defer_invalidation, deferred_invalidations
+from stream_framework.activity import Activity, DehydratedActivity
+from stream_framework.utils import merge_sorted
+from stream_framework.utils.five import long_t
 from stream_framework.utils.validate import validate_list_of_strict
 from stream_framework.tests.utils import FakeActivity
 
@@ -50,6 +55,16 @@ class BaseFeed(object):
         feed.filter(activity_id__lt=1)[:10]
 
 
+    **Pull feeds**
+
+    The activities of other feeds, for instance the user feeds of users with
+    many followers, can be merged in at read time instead of being written
+    to this feed during the fanout ::
+
+        feed = feed.with_pull_feeds([UserBaseFeed(celebrity_id)])
+        feed.filter(activity_id__lt=1)[:10]
+
+
     **Activity storage and Timeline storage**
 
     To keep reduce timelines memory utilization the BaseFeed supports
@@ -98,6 +113,11 @@ class BaseFeed(object):
     # : the timeline storage class to use (Redis, Cassandra etc)
     timeline_storage_class = BaseTimelineStorage
 
+    # : keeps the hydrated activities in process, for example a RedisHydrationCache
+    # : None reads them from the activity storage every time
+    hydration_cache = None
+    # : keeps the first page of every feed, for example a RedisHeadPageCache
+    head_page_cache = None
     # : the class the activity storage should use for serialization
     activity_serializer = BaseSerializer
     # : the class the timline storage should use for serialization
@@ -105,11 +125,14 @@ class BaseFeed(object):
 
     # : the chance that we trim the feed, the goal is not to keep the feed
     # : at exactly max length, but make sure we don't grow to infinite size :)
+    # : timeline storages which trim on write keep the feed at max length instead
     trim_chance = 0.01
 
     # : if we can use .filter calls to filter on things like activity id
     filtering_supported = False
     ordering_supported = False
+    # : if the activities of pull feeds can be merged in at read time
+    pull_merging_supported = True
 
     def __init__(self, user_id):
         '''
@@ -121,11 +144,15 @@ class BaseFeed(object):
 
         self.timeline_storage = self.get_timeline_storage()
         self.activity_storage = self.get_activity_storage()
+        if self.head_page_cache is not None:
+            self.head_page_cache.check_feed(self)
 
         # ability to filter and change ordering (not supported for all
         # backends)
         self._filter_kwargs = dict()
         self._ordering_args = tuple()
+        # feeds merged into this feed at read time
+        self._pull_feeds = tuple()
 
     @classmethod
     def get_timeline_storage_options(cls):
@@ -147,13 +174,23 @@ class BaseFeed(object):
         return timeline_storage
 
     @classmethod
-    def get_activity_storage(cls):
+    def get_activity_storage_options(cls):
         '''
-        Returns an instance of the activity storage
+        Returns the options for the activity storage
         '''
         options = {}
         options['serializer_class'] = cls.activity_serializer
         options['activity_class'] = cls.activity_class
+        if cls.hydration_cache is not None:
+            options['hydration_cache'] = cls.hydration_cache
+        return options
+
+    @classmethod
+    def get_activity_storage(cls):
+        '''
+        Returns an instance of the activity storage
+        '''
+        options = cls.get_activity_storage_options()
         if cls.activity_storage_class is not None:
             activity_storage = cls.activity_storage_class(**options)
             return activity_storage
@@ -191,7 +228,24 @@ class BaseFeed(object):
     @classmethod
     def get_timeline_batch_interface(cls):
         timeline_storage = cls.get_timeline_storage()
-        return timeline_storage.get_batch_interface()
+        return deferred_invalidations(timeline_storage.get_batch_interface())
+
+    @classmethod
+    def get_timeline_batch_interface_key(cls):
+        '''
+        Returns the key of the timeline batch interface, feed classes with
+        the same (not None) key can share one batch interface
+        '''
+        timeline_storage = cls.get_timeline_storage()
+        return timeline_storage.get_batch_interface_key()
+
+    @classmethod
+    def timeline_stores_ids(cls):
+        '''
+        Returns True if the timeline only stores activity ids, activities
+        read from another feed can then be added without hydrating them
+        '''
+        return issubclass(cls.timeline_serializer, SimpleTimelineSerializer)
 
     def add(self, activity, *args, **kwargs):
         return self.add_many([activity], *args, **kwargs)
@@ -203,14 +257,20 @@ class BaseFeed(object):
         :param activities: a list of activities
         :param batch_interface: the batch interface
         '''
-        validate_list_of_strict(
-            activities, (self.activity_class, FakeActivity))
+        activity_classes = (self.activity_class, FakeActivity)
+        if self.timeline_stores_ids():
+            activity_classes += (DehydratedActivity,)
+        validate_list_of_strict(activities, activity_classes)
 
+        if trim and self.timeline_storage.trims_on_write:
+            # the timeline is capped to max_length by the same write
+            kwargs['max_length'] = self.max_length
         add_count = self.timeline_storage.add_many(
             self.key, activities, batch_interface=batch_interface, *args, **kwargs)
+        self.invalidate_head_page(batch_interface)
 
         # trim the feed sometimes
-        if trim and random.random() <= self.trim_chance:
+        if trim and not self.timeline_storage.trims_on_write and random.random() <= self.trim_chance:
             self.trim()
         self.on_update_feed(new=activities, deleted=[])
         return add_count
@@ -226,12 +286,33 @@ class BaseFeed(object):
         '''
         del_count = self.timeline_storage.remove_many(
             self.key, activity_ids, batch_interface=None, *args, **kwargs)
+        self.invalidate_head_page()
         # trim the feed sometimes
         if trim and random.random() <= self.trim_chance:
             self.trim()
         self.on_update_feed(new=[], deleted=activity_ids)
         return del_count
 
+    def estimate_add_many(self, activities, trim=True):
+        '''
+        Estimates the cost of add_many without writing anything
+
+        :param activities: a list of activities
+        :param trim: if add_many would trim the feed
+        :returns tuple: the expected number of storage commands and bytes written
+        '''
+        serialized_activities = self.timeline_storage.serialize_activities(activities)
+        commands = self.timeline_storage.get_add_command_count(
+            len(serialized_activities))
+        if trim and self.timeline_storage.trims_on_write:
+            commands += 1
+        elif trim:
+            commands += self.trim_chance
+        bytes_written = sum(
+            len(six.text_type(activity_id)) + len(six.text_type(serialized))
+            for activity_id, serialized in serialized_activities.items())
+        return commands, bytes_written
+
     def on_update_feed(self, new, deleted):
         '''
         A hook called when activities area created or removed from the feed
@@ -246,6 +327,7 @@ class BaseFeed(object):
         '''
         length = length or self.max_length
         self.timeline_storage.trim(self.key, length)
+        self.invalidate_head_page()
 
     def count(self):
         '''
@@ -259,6 +341,7 @@ class BaseFeed(object):
         '''
         Delete the entire feed
         '''
+        self.invalidate_head_page()
         return self.timeline_storage.delete(self.key)
 
     @classmethod
@@ -267,6 +350,8 @@ class BaseFeed(object):
         timeline_storage = cls.get_timeline_storage()
         activity_storage.flush()
         timeline_storage.flush()
+        if cls.head_page_cache is not None:
+            cls.head_page_cache.flush()
 
     def __iter__(self):
         raise TypeError('Iteration over non sliced feeds is not supported')
@@ -326,7 +411,23 @@ class BaseFeed(object):
             activity_ids += activity._activity_ids
         activity_list = self.activity_storage.get_many(activity_ids)
         activity_data = {a.serialization_id: a for a in activity_list}
-        return [activity.get_hydrated(activity_data) for activity in activities]
+        return self.get_hydrated_activities(activities, activity_data)
+
+    def get_hydrated_activities(self, activities, activity_data):
+        '''
+        hydrates the activities with activity_data, leaving out the
+        activities missing from the activity storage
+
+        :param activities: the list of dehydrated activities
+        :param activity_data: a dict {activity_id: Activity}
+        '''
+        hydrated = []
+        for activity in activities:
+            activity = activity.get_hydrated(activity_data)
+            # the timeline still references a removed activity
+            if activity is not None:
+                hydrated.append(activity)
+        return hydrated
 
     def needs_hydration(self, activities):
         '''
@@ -342,13 +443,101 @@ class BaseFeed(object):
         Gets activity_ids from timeline_storage and then loads the
         actual data querying the activity_storage
         '''
-        activities = self.timeline_storage.get_slice(
-            self.key, start, stop, filter_kwargs=self._filter_kwargs,
-            ordering_args=self._ordering_args)
+        if rehydrate and self.use_head_page(start, stop):
+            activities = self.get_head_page()[:stop]
+        else:
+            activities = self.read_activity_slice(start, stop, rehydrate)
+        return self.annotate_activities(activities)
+
+    def read_activity_slice(self, start=None, stop=None, rehydrate=True):
+        '''
+        Reads a slice from the storages
+        '''
+        if self._pull_feeds:
+            activities = self.get_merged_activity_slice(start, stop)
+        else:
+            activities = self.timeline_storage.get_slice(
+                self.key, start, stop, filter_kwargs=self._filter_kwargs,
+                ordering_args=self._ordering_args)
         if self.needs_hydration(activities) and rehydrate:
             activities = self.hydrate_activities(activities)
         return activities
 
+    def use_head_page(self, start, stop):
+        '''
+        Returns True if the slice can be read from the head_page_cache
+        '''
+        return (self.head_page_cache is not None
+                and not start and stop is not None
+                and stop <= self.head_page_cache.size
+                and not self._filter_kwargs and not self._ordering_args
+                and not self._pull_feeds)
+
+    def get_head_page(self):
+        '''
+        Returns the first head_page_cache.size activities, reading them
+        from the storages if they aren't cached
+        '''
+        activities, version = self.head_page_cache.get_with_version(self)
+        if activities is None:
+            activities = self.read_activity_slice(0, self.head_page_cache.size)
+            # skipped when the feed changed while reading
+            self.head_page_cache.set(self, activities, version=version)
+        return activities
+
+    def invalidate_head_page(self, batch_interface=None):
+        '''
+        Removes the cached head page after the timeline changed, changes
+        queued on a batch interface invalidate it once the batch executed
+        '''
+        head_page_cache = self.head_page_cache
+        if head_page_cache is None:
+            return
+        if batch_interface is not None and not head_page_cache.joins_batch(self, batch_interface):
+            if defer_invalidation(batch_interface, head_page_cache, self):
+                return
+            batch_interface = None
+        head_page_cache.invalidate(self, batch_interface=batch_interface)
+
+    def annotate_activities(self, activities):
+        '''
+        Called with the activities of every slice read from the feed,
+        subclasses can add data to them (like the notification feeds)
+        '''
+        return activities
+
+    def get_merged_activity_slice(self, start=None, stop=None):
+        '''
+        Gets the slice of this feed merged with the pull feeds
+
+        Every feed is read from the top until stop with the same filters
+        and ordering, the results are merged by serialization_id. Activities
+        present in more than one feed are returned once. Without a stop
+        the slice ends at max_length
+
+        The pull feeds are expected to share the activity storage of this feed
+        '''
+        start = start or 0
+        if stop is None:
+            stop = self.max_length
+        reverse = 'activity_id' not in self._ordering_args
+        slices = []
+        for feed in (self,) + self._pull_feeds:
+            slices.append(feed.timeline_storage.get_slice(
+                feed.key, 0, stop, filter_kwargs=copy.copy(self._filter_kwargs),
+                ordering_args=self._ordering_args))
+        merged = merge_sorted(
+            slices, key=lambda a: long_t(a.serialization_id), reverse=reverse)
+
+        def unique(activities):
+            last_id = None
+            for activity in activities:
+                activity_id = long_t(activity.serialization_id)
+                if activity_id != last_id:
+                    yield activity
+                last_id = activity_id
+        return list(itertools.islice(unique(merged), start, stop))
+
     def _clone(self):
         '''
         Copy the feed instance
@@ -383,6 +572,108 @@ class BaseFeed(object):
         new._ordering_args = ordering_args
         return new
 
+    def with_pull_feeds(self, feeds):
+        '''
+        Returns a copy of the feed which merges in the activities of
+        the given feeds at read time
+
+        **Example** ::
+            feed = feed.with_pull_feeds([UserBaseFeed(13), UserBaseFeed(14)])
+            feed.filter(activity_id__lt=100)[:10]
+
+        :param feeds: the feeds to merge in
+        '''
+        if not self.pull_merging_supported:
+            raise ValueError(
+                '%s does not support pull feeds' % self.__class__.__name__)
+        new = self._clone()
+        new._pull_feeds = tuple(feeds)
+        return new
+
+
+def get_feed_slices(feed_slices, rehydrate=True):
+    '''
+    Reads slices of several feeds at once, for instance the feeds shown on
+    one page
+
+    The timelines of feeds sharing a timeline storage class and a batch
+    interface key (like the same redis server) are read in one round trip,
+    the activities of all slices
+    are then hydrated with one get_many per activity storage
+
+    **Example** ::
+
+        feed_slices = [(PinFeed(13), 0, 25), (AggregatedPinFeed(13), 0, 10)]
+        feed_slices += [(UserPinFeed(friend_id), 0, 5) for friend_id in friend_ids]
+        slices = get_feed_slices(feed_slices)
+        activities, aggregated, friend_slices = slices[0], slices[1], slices[2:]
+
+    :param feed_slices: a list of (feed, start, stop) tuples
+    :param rehydrate: if the activities should be hydrated
+    :returns list: the list of activities of every slice
+    '''
+    results = [None] * len(feed_slices)
+    groups = {}
+    for index, (feed, start, stop) in enumerate(feed_slices):
+        if None not in (start, stop) and start == stop:
+            results[index] = []
+            continue
+        if feed._pull_feeds:
+            results[index] = feed.get_merged_activity_slice(start, stop)
+            continue
+        group_key = feed.get_timeline_batch_interface_key()
+        if group_key is None:
+            group_key = ('feed', index)
+        # storages sharing a connection can still store their timelines
+        # differently (sorted sets, lists, ...), one read per storage class
+        group_key = (type(feed.timeline_storage), group_key)
+        groups.setdefault(group_key, []).append(index)
+
+    for indexes in groups.values():
+        requests = []
+        for index in indexes:
+            feed, start, stop = feed_slices[index]
+            requests.append((feed.key, start, stop,
+                             feed._filter_kwargs, feed._ordering_args))
+        # the storages of a group share their class and connection, any of them can read the keys
+        group_storage = feed_slices[indexes[0]][0].timeline_storage
+        slices = group_storage.get_many_slices_from_storage(requests)
+        for index, activities_data in zip(indexes, slices):
+            timeline_storage = feed_slices[index][0].timeline_storage
+            activities = timeline_storage.deserialize_slice(activities_data)
+            timeline_storage.metrics.on_feed_read(
+                timeline_storage.__class__, len(activities))
+            results[index] = activities
+
+    if rehydrate:
+        # group the slices to hydrate per activity storage
+        hydration_groups = []
+        for index, (feed, _, _) in enumerate(feed_slices):
+            if not feed.needs_hydration(results[index]):
+                continue
+            storage = feed.activity_storage
+            for group_storage, indexes in hydration_groups:
+                if type(group_storage) is type(storage) and group_storage.options == storage.options:
+                    indexes.append(index)
+                    break
+            else:
+                hydration_groups.append((storage, [index]))
+        for storage, indexes in hydration_groups:
+            activity_ids = []
+            for index in indexes:
+                for activity in results[index]:
+                    activity_ids += activity._activity_ids
+            activity_ids = list(OrderedDict.fromkeys(activity_ids))
+            activity_data = dict(
+                (a.serialization_id, a) for a in storage.get_many(activity_ids))
+            for index in indexes:
+                feed = feed_slices[index][0]
+                results[index] = feed.get_hydrated_activities(
+                    results[index], activity_data)
+
+    return [feed.annotate_activities(activities)
+            for (feed, _, _), activities in zip(feed_slices, results)]
+
 
 class UserBaseFeed(BaseFeed):
 
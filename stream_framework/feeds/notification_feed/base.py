@@ -111,11 +111,10 @@ class BaseNotificationFeed(AggregatedFeed):
 
             # TODO use a real-time transport layer to notify for these updates
 
-    def get_activity_slice(self, start=None, stop=None, rehydrate=True):
+    def annotate_activities(self, activities):
         '''
-        Retrieves a slice of aggregated activities and annotates them as read and/or seen.
+        Annotates the slices of aggregated activities as read and/or seen.
         '''
-        activities = super(BaseNotificationFeed, self).get_activity_slice(start, stop, rehydrate)
         if activities and self.markers_storage_class is not None:
 
             if self.track_unseen and self.track_unread:
@@ -1,7 +1,11 @@
 from stream_framework.feeds.base import BaseFeed
 from stream_framework.storage.redis.activity_storage import RedisActivityStorage
+from stream_framework.storage.redis.cluster import ClusterActivityStorage, ClusterTimelineStorage
+from stream_framework.storage.redis.compact_timeline_storage import CompactRedisTimelineStorage
+from stream_framework.storage.redis.list_timeline_storage import RedisListTimelineStorage
 from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage
 from stream_framework.serializers.activity_serializer import ActivitySerializer
+from stream_framework.serializers.simple_timeline_serializer import SimpleTimelineSerializer
 
 
 class RedisFeed(BaseFeed):
@@ -26,3 +30,78 @@ class RedisFeed(BaseFeed):
     # : clarify that this feed supports filtering and ordering
     filtering_supported = True
     ordering_supported = True
+
+    # : read the slices and their activities in one round trip with a lua
+    # : script, see RedisTimelineStorage.get_hydrated_slice
+    server_side_hydration = False
+
+    def use_server_side_hydration(self):
+        '''
+        Returns True if redis can hydrate the slices of this feed: the
+        timeline stores activity ids and both storages use the same redis server
+        '''
+        return (self.server_side_hydration
+                and not self._pull_feeds
+                and self.hydration_cache is None
+                and self.timeline_storage.hydrated_slice_supported
+                and issubclass(self.timeline_serializer, SimpleTimelineSerializer)
+                and isinstance(self.activity_storage, RedisActivityStorage)
+                and self.activity_storage.get_redis_server() == self.redis_server)
+
+    def read_activity_slice(self, start=None, stop=None, rehydrate=True):
+        if not (rehydrate and self.use_server_side_hydration()):
+            return super(RedisFeed, self).read_activity_slice(start, stop, rehydrate)
+        return self.timeline_storage.get_hydrated_slice(
+            self.key, start, stop, self.activity_storage,
+            filter_kwargs=self._filter_kwargs, ordering_args=self._ordering_args)
+
+
+class RedisClusterFeed(RedisFeed):
+
+    '''
+    Spreads the timelines and the activities over several redis servers
+    with a consistent hashing ring, without a proxy in between
+
+    **Example** ::
+
+        class PinFeed(RedisClusterFeed):
+            redis_servers = ('redis1', 'redis2', 'redis3')
+    '''
+    timeline_storage_class = ClusterTimelineStorage
+    activity_storage_class = ClusterActivityStorage
+
+    # : the names of the servers (see settings.STREAM_REDIS_CONFIG)
+    redis_servers = ('default',)
+    # : the number of hashes holding the activities
+    activity_shard_count = 64
+
+    @classmethod
+    def get_timeline_storage_options(cls):
+        options = super(RedisClusterFeed, cls).get_timeline_storage_options()
+        options['redis_servers'] = cls.redis_servers
+        return options
+
+    @classmethod
+    def get_activity_storage_options(cls):
+        options = super(RedisClusterFeed, cls).get_activity_storage_options()
+        options['redis_servers'] = cls.redis_servers
+        options['shard_count'] = cls.activity_shard_count
+        return options
+
+
+class CompactRedisFeed(RedisFeed):
+
+    '''
+    Stores the activity ids of the timelines as compact members,
+    see CompactRedisTimelineStorage
+    '''
+    timeline_storage_class = CompactRedisTimelineStorage
+
+
+class RedisListFeed(RedisFeed):
+
+    '''
+    Stores the timelines as redis lists, for feeds where activities
+    are added in chronological order, see RedisListTimelineStorage
+    '''
+    timeline_storage_class = RedisListTimelineStorage
@@ -30,6 +30,38 @@ class Metrics(object):
     def on_fanout(self, feed_class, operation, activities_count=1):
         pass
 
+    def on_fanout_queue_wait(self, feed_class, seconds):
+        '''
+        The time a fanout chunk waited between its creation and its execution
+        '''
+        pass
+
+    def on_fanout_chunk(self, feed_class, seconds, users_count):
+        '''
+        The time a fanout chunk took to write to the feeds of users_count users
+        '''
+        pass
+
+    def on_fanout_lag(self, feed_class, seconds):
+        '''
+        The time between the start of a fanout and the last write of one of
+        its chunks, the largest value per fanout is the lag of the activity
+        '''
+        pass
+
+    def on_fanout_amplification(self, feed_class, activities_count, feeds_count):
+        '''
+        A fanout of activities_count activities to feeds_count feeds,
+        the write amplification is the number of feed writes per activity
+        '''
+        pass
+
+    def on_hydration_cache(self, storage_class, hits, misses):
+        '''
+        The activities found in and missing from the hydration cache
+        '''
+        pass
+
     def on_activity_published(self):
         pass
 
@@ -0,0 +1,116 @@
+from stream_framework.metrics.base import Metrics
+from collections import defaultdict
+import threading
+import time
+
+
+class Timer(object):
+
+    def __init__(self, metrics, metric_name):
+        self.metrics = metrics
+        self.metric_name = metric_name
+
+    def __enter__(self):
+        self.started_at = time.time()
+
+    def __exit__(self, *args, **kwds):
+        self.metrics.observe(self.metric_name, time.time() - self.started_at)
+
+
+class InMemoryMetrics(Metrics):
+
+    '''
+    Collects the metrics in process, for tests and benchmarks
+
+    Counters are summed, the values of histograms (durations in seconds)
+    are kept in a list per metric. The metric names follow the statsd backends
+
+    **Example** ::
+
+        metrics = InMemoryMetrics()
+        manager.metrics = metrics
+        manager.add_user_activity(user_id, activity)
+        metrics.get_histogram('PinFeed.fanout_lag')
+        metrics.get_write_amplification(PinFeed)
+
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = defaultdict(int)
+            self.histograms = defaultdict(list)
+
+    def incr(self, metric_name, value=1):
+        with self.lock:
+            self.counters[metric_name] += value
+
+    def observe(self, metric_name, value):
+        with self.lock:
+            self.histograms[metric_name].append(value)
+
+    def get_counter(self, metric_name):
+        return self.counters.get(metric_name, 0)
+
+    def get_histogram(self, metric_name):
+        return list(self.histograms.get(metric_name, []))
+
+    def get_write_amplification(self, feed_class):
+        '''
+        Returns the number of feed writes per activity fanned out to
+        feed_class, None before the first fanout
+        '''
+        activities = self.get_counter('%s.fanout.activities' % feed_class.__name__)
+        if not activities:
+            return None
+        feed_writes = self.get_counter('%s.fanout.feed_writes' % feed_class.__name__)
+        return float(feed_writes) / activities
+
+    def fanout_timer(self, feed_class):
+        return Timer(self, '%s.fanout_latency' % feed_class.__name__)
+
+    def feed_reads_timer(self, feed_class):
+        return Timer(self, '%s.read_latency' % feed_class.__name__)
+
+    def on_feed_read(self, feed_class, activities_count):
+        self.incr('%s.reads' % feed_class.__name__, activities_count)
+
+    def on_feed_write(self, feed_class, activities_count):
+        self.incr('%s.writes' % feed_class.__name__, activities_count)
+
+    def on_feed_remove(self, feed_class, activities_count):
+        self.incr('%s.deletes' % feed_class.__name__, activities_count)
+
+    def on_fanout(self, feed_class, operation, activities_count=1):
+        metric = (feed_class.__name__, operation.__name__)
+        self.incr('%s.fanout.%s' % metric, activities_count)
+
+    def on_fanout_queue_wait(self, feed_class, seconds):
+        self.observe('%s.fanout_queue_wait' % feed_class.__name__, seconds)
+
+    def on_fanout_chunk(self, feed_class, seconds, users_count):
+        self.observe('%s.fanout_chunk_latency' % feed_class.__name__, seconds)
+        if users_count:
+            self.observe('%s.fanout_user_latency' % feed_class.__name__,
+                         seconds / users_count)
+
+    def on_fanout_lag(self, feed_class, seconds):
+        self.observe('%s.fanout_lag' % feed_class.__name__, seconds)
+
+    def on_fanout_amplification(self, feed_class, activities_count, feeds_count):
+        self.incr('%s.fanout.activities' % feed_class.__name__, activities_count)
+        self.incr('%s.fanout.feed_writes' % feed_class.__name__,
+                  activities_count * feeds_count)
+
+    def on_hydration_cache(self, storage_class, hits, misses):
+        self.incr('%s.hydration_cache.hits' % storage_class.__name__, hits)
+        self.incr('%s.hydration_cache.misses' % storage_class.__name__, misses)
+
+    def on_activity_published(self):
+        self.incr('activities.published')
+
+    def on_activity_removed(self):
+        self.incr('activities.removed')
@@ -48,6 +48,32 @@ class StatsdMetrics(Metrics):
         counter = statsd.Counter('%s.%s.fanout.%s' % metric)
         counter += activities_count
 
+    def on_fanout_queue_wait(self, feed_class, seconds):
+        timer = statsd.Timer('%s.%s' % (self.prefix, feed_class.__name__))
+        timer.send('fanout_queue_wait', seconds)
+
+    def on_fanout_chunk(self, feed_class, seconds, users_count):
+        timer = statsd.Timer('%s.%s' % (self.prefix, feed_class.__name__))
+        timer.send('fanout_chunk_latency', seconds)
+        if users_count:
+            timer.send('fanout_user_latency', seconds / users_count)
+
+    def on_fanout_lag(self, feed_class, seconds):
+        timer = statsd.Timer('%s.%s' % (self.prefix, feed_class.__name__))
+        timer.send('fanout_lag', seconds)
+
+    def on_fanout_amplification(self, feed_class, activities_count, feeds_count):
+        counter = statsd.Counter(
+            '%s.%s.fanout' % (self.prefix, feed_class.__name__))
+        counter.increment('activities', activities_count)
+        counter.increment('feed_writes', activities_count * feeds_count)
+
+    def on_hydration_cache(self, storage_class, hits, misses):
+        counter = statsd.Counter(
+            '%s.%s.hydration_cache' % (self.prefix, storage_class.__name__))
+        counter.increment('hits', hits)
+        counter.increment('misses', misses)
+
     def on_activity_published(self):
         counter = statsd.Counter('%s.activities.published' % self.prefix)
         counter += 1
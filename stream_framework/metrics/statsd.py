@@ -27,6 +27,27 @@ class StatsdMetrics(Metrics):
         metric = (feed_class.__name__, operation.__name__)
         self.statsd.incr('%s.fanout.%s' % metric, activities_count)
 
+    def on_fanout_queue_wait(self, feed_class, seconds):
+        self.statsd.timing('%s.fanout_queue_wait' % feed_class.__name__, seconds * 1000)
+
+    def on_fanout_chunk(self, feed_class, seconds, users_count):
+        self.statsd.timing('%s.fanout_chunk_latency' % feed_class.__name__, seconds * 1000)
+        if users_count:
+            self.statsd.timing('%s.fanout_user_latency' % feed_class.__name__,
+                               seconds * 1000 / users_count)
+
+    def on_fanout_lag(self, feed_class, seconds):
+        self.statsd.timing('%s.fanout_lag' % feed_class.__name__, seconds * 1000)
+
+    def on_fanout_amplification(self, feed_class, activities_count, feeds_count):
+        self.statsd.incr('%s.fanout.activities' % feed_class.__name__, activities_count)
+        self.statsd.incr('%s.fanout.feed_writes' % feed_class.__name__,
+                         activities_count * feeds_count)
+
+    def on_hydration_cache(self, storage_class, hits, misses):
+        self.statsd.incr('%s.hydration_cache.hits' % storage_class.__name__, hits)
+        self.statsd.incr('%s.hydration_cache.misses' % storage_class.__name__, misses)
+
     def on_activity_published(self):
         self.statsd.incr('activities.published')
 
@@ -145,8 +145,16 @@ class BaseActivityStorage(BaseStorage):
     - add_to_storage
     - get_from_storage
     - remove_from_storage
+
+    Pass a hydration_cache (see storage.hydration_cache) to keep the
+    deserialized activities in process
     '''
 
+    def __init__(self, serializer_class=None, activity_class=None, hydration_cache=None, **options):
+        super(BaseActivityStorage, self).__init__(
+            serializer_class=serializer_class, activity_class=activity_class, **options)
+        self.hydration_cache = hydration_cache
+
     def add_to_storage(self, serialized_activities, *args, **kwargs):
         '''
         Adds the serialized activities to the storage layer
@@ -178,10 +186,34 @@ class BaseActivityStorage(BaseStorage):
 
         :param activity_ids: the list of activity ids
         '''
+        if self.hydration_cache is not None:
+            return self.get_many_cached(activity_ids, *args, **kwargs)
         self.metrics.on_feed_read(self.__class__, len(activity_ids))
         activities_data = self.get_from_storage(activity_ids, *args, **kwargs)
         return self.deserialize_activities(activities_data)
 
+    def get_many_cached(self, activity_ids, *args, **kwargs):
+        '''
+        Gets many activities, only the ones missing from the
+        hydration_cache are read from the storage
+
+        :param activity_ids: the list of activity ids
+        '''
+        cached = self.hydration_cache.get_many(activity_ids)
+        missing_ids = [i for i in activity_ids if i not in cached]
+        self.metrics.on_hydration_cache(
+            self.__class__, len(activity_ids) - len(missing_ids), len(missing_ids))
+        # activities known to be missing from the storage are cached as None
+        activities = [a for a in cached.values() if a is not None]
+        if missing_ids:
+            def load(activity_ids):
+                self.metrics.on_feed_read(self.__class__, len(activity_ids))
+                activities_data = self.get_from_storage(activity_ids, *args, **kwargs)
+                return self.deserialize_activities(activities_data)
+            loaded = self.hydration_cache.load_many(missing_ids, load)
+            activities += [a for a in loaded.values() if a is not None]
+        return activities
+
     def get(self, activity_id, *args, **kwargs):
         results = self.get_many([activity_id], *args, **kwargs)
         if not results:
@@ -201,7 +233,12 @@ class BaseActivityStorage(BaseStorage):
         '''
         self.metrics.on_feed_write(self.__class__, len(activities))
         serialized_activities = self.serialize_activities(activities)
-        return self.add_to_storage(serialized_activities, *args, **kwargs)
+        insert_count = self.add_to_storage(serialized_activities, *args, **kwargs)
+        if self.hydration_cache is not None:
+            # updated activities are added again, new activities might
+            # be cached as missing
+            self.hydration_cache.invalidate(list(serialized_activities.keys()))
+        return insert_count
 
     def remove(self, activity, *args, **kwargs):
         return self.remove_many([activity], *args, **kwargs)
@@ -219,7 +256,10 @@ class BaseActivityStorage(BaseStorage):
             activity_ids = activities
         else:
             activity_ids = list(self.serialize_activities(activities).keys())
-        return self.remove_from_storage(activity_ids, *args, **kwargs)
+        removed = self.remove_from_storage(activity_ids, *args, **kwargs)
+        if self.hydration_cache is not None:
+            self.hydration_cache.invalidate(activity_ids)
+        return removed
 
 
 class BaseTimelineStorage(BaseStorage):
@@ -240,6 +280,9 @@ class BaseTimelineStorage(BaseStorage):
     '''
 
     default_serializer_class = SimpleTimelineSerializer
+    #: True if add_many accepts a max_length kwarg and trims the timeline
+    #: in the same write, feeds then don't need to trim it separately
+    trims_on_write = False
 
     def add(self, key, activity, *args, **kwargs):
         return self.add_many(key, [activity], *args, **kwargs)
@@ -309,11 +352,57 @@ class BaseTimelineStorage(BaseStorage):
         '''
         activities_data = self.get_slice_from_storage(
             key, start, stop, filter_kwargs=filter_kwargs, ordering_args=ordering_args)
+        activities = self.deserialize_slice(activities_data)
+        self.metrics.on_feed_read(self.__class__, len(activities))
+        return activities
+
+    def get_slices_from_storage(self, keys, start, stop, filter_kwargs=None, ordering_args=None):
+        '''
+        Returns the slices of several keys
+
+        :param keys: the keys at which the feeds are stored
+        :returns list: Returns a list of slices as returned by get_slice_from_storage
+        '''
+        requests = [(key, start, stop, filter_kwargs, ordering_args) for key in keys]
+        return self.get_many_slices_from_storage(requests)
+
+    def get_many_slices_from_storage(self, requests):
+        '''
+        Returns the slices for a list of (key, start, stop, filter_kwargs,
+        ordering_args) requests, storages which can read them in one round
+        trip override this
+
+        The raw slices don't depend on the serializer, timeline storages
+        sharing a batch interface key can read each others keys
+
+        :param requests: the list of slice requests
+        :returns list: Returns a list of slices as returned by get_slice_from_storage
+        '''
+        return [self.get_slice_from_storage(key, start, stop,
+                                            filter_kwargs=dict(filter_kwargs or {}),
+                                            ordering_args=ordering_args)
+                for key, start, stop, filter_kwargs, ordering_args in requests]
+
+    def get_slices(self, keys, start, stop, filter_kwargs=None, ordering_args=None):
+        '''
+        Returns a sorted slice for each of the keys
+
+        :param keys: the keys at which the feeds are stored
+        '''
+        slices = [self.deserialize_slice(activities_data) for activities_data in
+                  self.get_slices_from_storage(keys, start, stop, filter_kwargs=filter_kwargs,
+                                               ordering_args=ordering_args)]
+        self.metrics.on_feed_read(self.__class__, sum(map(len, slices)))
+        return slices
+
+    def deserialize_slice(self, activities_data):
+        '''
+        Deserializes the (score, serialized activity) pairs of a slice
+        '''
         activities = []
         if activities_data:
             serialized_activities = list(zip(*activities_data))[1]
             activities = self.deserialize_activities(serialized_activities)
-        self.metrics.on_feed_read(self.__class__, len(activities))
         return activities
 
     def get_batch_interface(self):
@@ -325,6 +414,25 @@ class BaseTimelineStorage(BaseStorage):
         '''
         raise NotImplementedError()
 
+    def get_batch_interface_key(self):
+        '''
+        Returns a key identifying the connection used by the batch interface.
+        Timeline storages returning the same key can share one batch interface,
+        None means the batch interface can't be shared
+
+        An example is the name of the redis server
+        '''
+        return None
+
+    def get_add_command_count(self, activities_count):
+        '''
+        Returns the number of storage commands add_many sends to
+        add activities_count activities to one timeline
+
+        :param activities_count: the number of activities
+        '''
+        return 1
+
     def trim(self, key, length):
         '''
         Trims the feed to the given length
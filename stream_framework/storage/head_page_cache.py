@@ -0,0 +1,252 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.utils import LRUCache, MISSING
+from contextlib import contextmanager
+import copy
+import itertools
+import json
+import threading
+import uuid
+
+
+#: the batches running in this thread with the head pages to
+#: invalidate once they executed, see deferred_invalidations
+local = threading.local()
+
+
+@contextmanager
+def deferred_invalidations(batch_context_manager):
+    '''
+    Wraps the batch interface of a timeline storage, the head pages
+    invalidated during the batch are removed after its writes executed
+    (see defer_invalidation)
+
+    :param batch_context_manager: the context manager of the batch interface
+    '''
+    if not hasattr(local, 'batches'):
+        local.batches = []
+    pending = []
+    try:
+        with batch_context_manager as batch_interface:
+            local.batches.append((batch_interface, pending))
+            try:
+                yield batch_interface
+            finally:
+                local.batches.pop()
+    finally:
+        for head_page_cache, feed in pending:
+            head_page_cache.invalidate(feed)
+
+
+def defer_invalidation(batch_interface, head_page_cache, feed):
+    '''
+    Invalidates the head page of feed after the batch executed
+
+    :returns bool: False when batch_interface isn't a running batch
+        of this thread, the caller invalidates right away then
+    '''
+    for running, pending in reversed(getattr(local, 'batches', [])):
+        if running is batch_interface:
+            pending.append((head_page_cache, feed))
+            return True
+    return False
+
+
+class HeadPageCache(object):
+
+    '''
+    Keeps the first size activities of every feed, hydrated, so reading
+    the first page of a feed is a single lookup
+
+    **Example** ::
+
+        class PinFeed(RedisFeed):
+            head_page_cache = RedisHeadPageCache(size=25)
+
+    The feeds invalidate their head page when they add, remove or trim
+    activities, batched writes invalidate it once the batch executed.
+    Changes to the activities themselves are only picked up when the
+    head page is invalidated or expires after ttl seconds
+
+    Every invalidation gives the feed a new version, a head page read
+    before an invalidation isn't stored (see set)
+
+    The default implementation keeps at most capacity head pages in
+    process, use :class:`RedisHeadPageCache` to share them between processes
+    '''
+
+    def __init__(self, size=25, capacity=10000, ttl=60 * 5):
+        self.size = size
+        #: head pages expire after ttl seconds, which bounds how long
+        #: changes to the activities themselves take to show up
+        self.ttl = ttl
+        self.pages = LRUCache(capacity, ttl=ttl)
+        self.versions = LRUCache(capacity, ttl=ttl)
+        self.version_counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def get(self, feed):
+        '''
+        Returns the head page of feed, None if it isn't cached
+
+        :param feed: the feed
+        '''
+        return self.get_with_version(feed)[0]
+
+    def get_with_version(self, feed):
+        '''
+        Returns the head page of feed (None if it isn't cached) and
+        the version to pass to set when the page is read from the storages
+
+        :param feed: the feed
+        '''
+        with self.lock:
+            activities = self.pages.get(feed.key)
+            version = self.versions.get(feed.key)
+        if version is MISSING:
+            version = 0
+        if activities is MISSING:
+            return None, version
+        return [copy.copy(activity) for activity in activities], version
+
+    def check_feed(self, feed):
+        '''
+        Called when a feed using the cache is created, raises
+        ValueError if the cache can't store the head pages of feed
+        '''
+        pass
+
+    def set(self, feed, activities, version=None):
+        '''
+        Caches the head page of feed, unless the feed was invalidated
+        since version was read
+
+        :param feed: the feed
+        :param activities: the first size activities of the feed
+        :param version: the version returned by get_with_version
+        '''
+        activities = [copy.copy(activity) for activity in activities]
+        with self.lock:
+            current_version = self.versions.get(feed.key)
+            if current_version is MISSING:
+                current_version = 0
+            if version is not None and version != current_version:
+                return
+            self.pages.set(feed.key, activities)
+
+    def joins_batch(self, feed, batch_interface):
+        '''
+        Returns True if the invalidation can be queued on the batch
+        interface of the timeline writes, otherwise it's deferred until
+        the batch executed
+        '''
+        return False
+
+    def invalidate(self, feed, batch_interface=None):
+        '''
+        Removes the head page of feed
+
+        :param feed: the feed
+        :param batch_interface: the batch interface of the change,
+            only passed when joins_batch is True
+        '''
+        with self.lock:
+            # the counter never repeats, so versions which were
+            # evicted meanwhile don't match either
+            self.versions.set(feed.key, next(self.version_counter))
+            self.pages.delete(feed.key)
+
+    def flush(self):
+        with self.lock:
+            self.pages.clear()
+            self.versions.clear()
+
+
+class RedisHeadPageCache(HeadPageCache):
+
+    '''
+    Stores the head page of a feed as one json list of serialized
+    activities, reading it takes a GET and a single decode
+
+    The activities are serialized with the serializer of the activity
+    storage, this only works for feeds of activities (not aggregated feeds)
+    with an activity storage
+
+    The version of a feed is a random token stored next to its head page,
+    a lua script only stores a head page when the token didn't change
+
+    The keys are prefixed with the namespace, flush only removes the
+    head pages and versions of its namespace
+    '''
+    key_format = 'feed:head:%s:page:%s'
+    version_key_format = 'feed:head:%s:version:%s'
+
+    set_script = '''
+    local version = redis.call('GET', KEYS[2]) or ''
+    if version ~= ARGV[2] then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+    return 1
+    '''
+
+    def __init__(self, size=25, ttl=60 * 5, redis_server='default', namespace='default'):
+        super(RedisHeadPageCache, self).__init__(size, ttl=ttl)
+        self.redis_server = redis_server
+        self.namespace = namespace
+        self.script = None
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def get_key(self, feed):
+        return self.key_format % (self.namespace, feed.key)
+
+    def get_version_key(self, feed):
+        return self.version_key_format % (self.namespace, feed.key)
+
+    def get_with_version(self, feed):
+        blob, version = self.redis.mget(
+            [self.get_key(feed), self.get_version_key(feed)])
+        if blob is None:
+            return None, version or ''
+        serializer = feed.activity_storage.serializer
+        activities = [serializer.loads(serialized) for serialized in json.loads(blob)]
+        return activities, version or ''
+
+    def check_feed(self, feed):
+        if feed.activity_storage is None:
+            raise ValueError(
+                '%s serializes the activities with the activity storage, %s has none'
+                % (self.__class__.__name__, feed.__class__.__name__))
+
+    def set(self, feed, activities, version=None):
+        serializer = feed.activity_storage.serializer
+        blob = json.dumps([serializer.dumps(activity) for activity in activities])
+        if version is None:
+            self.redis.set(self.get_key(feed), blob, ex=self.ttl)
+            return
+        if self.script is None:
+            self.script = self.redis.register_script(self.set_script)
+        self.script(keys=[self.get_key(feed), self.get_version_key(feed)],
+                    args=[blob, version, self.ttl])
+
+    def joins_batch(self, feed, batch_interface):
+        # the batched writes go to the same server
+        return feed.get_timeline_batch_interface_key() == ('redis', self.redis_server)
+
+    def invalidate(self, feed, batch_interface=None):
+        pipe = batch_interface
+        if pipe is None:
+            pipe = self.redis.pipeline(transaction=False)
+        pipe.set(self.get_version_key(feed), uuid.uuid4().hex, ex=self.ttl)
+        pipe.delete(self.get_key(feed))
+        if batch_interface is None:
+            pipe.execute()
+
+    def flush(self):
+        keys = []
+        for key_format in (self.key_format, self.version_key_format):
+            keys += self.redis.scan_iter(key_format % (self.namespace, '*'))
+        if keys:
+            self.redis.delete(*keys)
@@ -0,0 +1,298 @@
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.utils import LRUCache, MISSING
+import copy
+import itertools
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class Flight(object):
+
+    '''
+    A load in progress, the concurrent readers wait for its event
+    '''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+
+    '''
+    Coalesces the concurrent loads of the same keys in a process,
+    the first reader loads a key and the concurrent readers
+    wait for its result instead of loading it again
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def load_many(self, keys, load):
+        '''
+        Returns a dict with the value of every key, None for the keys
+        load didn't find
+
+        :param keys: the list of keys
+        :param load: a function returning a dict with the values of a list of keys
+        '''
+        owned = []
+        flights = []
+        with self.lock:
+            for key in keys:
+                flight = self.flights.get(key)
+                if flight is None:
+                    flight = self.flights[key] = Flight()
+                    owned.append(key)
+                flights.append((key, flight))
+        if owned:
+            try:
+                values = load(owned)
+            except Exception as e:
+                self.land(owned, {}, e)
+                raise
+            self.land(owned, values)
+        results = {}
+        for key, flight in flights:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            results[key] = flight.value
+        return results
+
+    def land(self, keys, values, error=None):
+        with self.lock:
+            for key in keys:
+                flight = self.flights.pop(key)
+                flight.value = values.get(key)
+                flight.error = error
+                flight.event.set()
+
+
+class HydrationCache(object):
+
+    '''
+    Keeps deserialized activities in process, keyed by serialization_id,
+    so reading hot activities doesn't go to the activity storage
+
+    The cache holds at most capacity activities, for at most ttl seconds.
+    Readers get a shallow copy of the cached activities
+
+    **Example** ::
+
+        class PinFeed(RedisFeed):
+            hydration_cache = HydrationCache(capacity=100000, ttl=60)
+
+    Activities missing from the activity storage are remembered for
+    missing_ttl seconds, concurrent reads of the same activities in a
+    process are coalesced into one read (see :class:`SingleFlight`)
+
+    Every invalidation bumps a version of the activity, a load which
+    started before the invalidation returns its activities without
+    caching them
+
+    The default implementation only invalidates the activities removed or
+    updated in this process, use :class:`RedisHydrationCache` to invalidate
+    them in all processes
+    '''
+
+    def __init__(self, capacity=10000, ttl=60, missing_ttl=5):
+        self.cache = LRUCache(capacity, ttl=ttl)
+        self.missing = LRUCache(capacity, ttl=missing_ttl)
+        self.missing_ttl = missing_ttl
+        #: the counter value of the last invalidation of every activity
+        self.versions = LRUCache(capacity, ttl=ttl)
+        self.version_counter = itertools.count(1)
+        self.version_lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_key(self, activity_id):
+        # timelines return the ids as strings
+        return int(activity_id)
+
+    def get_many(self, activity_ids):
+        '''
+        Returns a dict with the cached activities among activity_ids,
+        the activities known to be missing from the storage map to None
+
+        :param activity_ids: the list of activity ids
+        '''
+        activities = {}
+        for activity_id in activity_ids:
+            key = self.get_key(activity_id)
+            activity = self.cache.get(key)
+            if activity is not MISSING:
+                activities[activity_id] = copy.copy(activity)
+            elif self.missing.get(key) is not MISSING:
+                activities[activity_id] = None
+        with self.lock:
+            self.hits += len(activities)
+            self.misses += len(activity_ids) - len(activities)
+        return activities
+
+    def load_many(self, activity_ids, load):
+        '''
+        Loads and caches activities which aren't cached, returns a dict
+        like get_many
+
+        :param activity_ids: the list of activity ids
+        :param load: a function returning the list of activities of a list of ids
+        '''
+        def load_and_cache(activity_ids):
+            with self.version_lock:
+                started = next(self.version_counter)
+            loaded = dict((self.get_key(a.serialization_id), a)
+                          for a in load(activity_ids) if a is not None)
+            activities = {}
+            missing_ids = []
+            for activity_id in activity_ids:
+                activity = loaded.get(self.get_key(activity_id))
+                if activity is None:
+                    missing_ids.append(activity_id)
+                else:
+                    activities[activity_id] = activity
+            # skip the activities invalidated while they were loaded
+            with self.version_lock:
+                self.set_many([activity for activity_id, activity in activities.items()
+                               if not self.invalidated_since(activity_id, started)])
+                self.set_missing([activity_id for activity_id in missing_ids
+                                  if not self.invalidated_since(activity_id, started)])
+            return activities
+
+        activities = self.flights.load_many(activity_ids, load_and_cache)
+        # the concurrent readers get their own copy
+        return dict((activity_id, copy.copy(activity))
+                    for activity_id, activity in activities.items())
+
+    def invalidated_since(self, activity_id, version):
+        '''
+        Returns True if activity_id was invalidated after
+        version was taken from the version_counter
+        '''
+        invalidated = self.versions.get(self.get_key(activity_id))
+        return invalidated is not MISSING and invalidated > version
+
+    def set_many(self, activities):
+        '''
+        Caches the activities
+
+        :param activities: the list of activities
+        '''
+        for activity in activities:
+            if activity is None:
+                continue
+            self.cache.set(self.get_key(activity.serialization_id), copy.copy(activity))
+
+    def set_missing(self, activity_ids):
+        '''
+        Remembers that activity_ids are missing from the activity storage
+
+        :param activity_ids: the list of activity ids
+        '''
+        if not self.missing_ttl:
+            return
+        for activity_id in activity_ids:
+            self.missing.set(self.get_key(activity_id), True)
+
+    def delete_many(self, activity_ids):
+        '''
+        Removes activity_ids from the cache of this process
+        '''
+        with self.version_lock:
+            for activity_id in activity_ids:
+                key = self.get_key(activity_id)
+                self.versions.set(key, next(self.version_counter))
+                self.cache.delete(key)
+                self.missing.delete(key)
+
+    def invalidate(self, activity_ids):
+        '''
+        Removes activity_ids from the cache, called when the
+        activities are removed or updated
+
+        :param activity_ids: the list of activity ids
+        '''
+        self.delete_many(activity_ids)
+
+    def get_stats(self):
+        '''
+        Returns the number of hits, misses and cached activities
+        '''
+        return dict(hits=self.hits, misses=self.misses, size=len(self.cache))
+
+
+class RedisHydrationCache(HydrationCache):
+
+    '''
+    Publishes the invalidations on a redis channel, every process listens
+    to the channel in a background thread and removes the invalidated
+    activities from its cache
+
+    Invalidations sent while a process isn't listening (for instance
+    during a reconnect) are lost, the ttl bounds how long such a process
+    serves stale activities
+    '''
+    channel = 'activity:cache:invalidate'
+
+    def __init__(self, capacity=10000, ttl=60, missing_ttl=5, redis_server='default'):
+        super(RedisHydrationCache, self).__init__(capacity, ttl, missing_ttl)
+        self.redis_server = redis_server
+        self.listener_pid = None
+
+    @property
+    def redis(self):
+        return get_redis_connection(server_name=self.redis_server)
+
+    def start_listener(self):
+        '''
+        Starts the thread listening to the invalidations, once per process
+        '''
+        with self.lock:
+            if self.listener_pid == os.getpid():
+                return
+            # activities cached before a fork missed the invalidations since
+            self.cache.clear()
+            self.missing.clear()
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(self.channel)
+            thread = threading.Thread(target=self.listen, args=(pubsub,))
+            thread.daemon = True
+            thread.start()
+            self.listener_pid = os.getpid()
+
+    def listen(self, pubsub):
+        try:
+            for message in pubsub.listen():
+                if message['type'] != 'message':
+                    continue
+                data = message['data']
+                if isinstance(data, bytes):
+                    data = data.decode('utf-8')
+                self.delete_many(data.split(','))
+        except Exception:
+            logger.exception('stopped listening to the activity cache invalidations')
+            # the next read starts a new listener with an empty cache
+            with self.lock:
+                self.listener_pid = None
+
+    def get_many(self, activity_ids):
+        self.start_listener()
+        return super(RedisHydrationCache, self).get_many(activity_ids)
+
+    def set_many(self, activities):
+        self.start_listener()
+        super(RedisHydrationCache, self).set_many(activities)
+
+    def invalidate(self, activity_ids):
+        self.delete_many(activity_ids)
+        if activity_ids:
+            self.redis.publish(self.channel, ','.join(map(str, activity_ids)))
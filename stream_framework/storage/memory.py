@@ -29,7 +29,8 @@ def reverse_bisect_left(a, x, lo=0, hi=None):
 class InMemoryActivityStorage(BaseActivityStorage):
 
     def get_from_storage(self, activity_ids, *args, **kwargs):
-        return {_id: activity_store.get(_id) for _id in activity_ids}
+        # like the other storages, leave out the missing activities
+        return {_id: activity_store[_id] for _id in activity_ids if _id in activity_store}
 
     def add_to_storage(self, activities, *args, **kwargs):
         insert_count = 0
@@ -52,6 +53,7 @@ class InMemoryActivityStorage(BaseActivityStorage):
 
 
 class InMemoryTimelineStorage(BaseTimelineStorage):
+    trims_on_write = True
 
     def contains(self, key, activity_id):
         return activity_id in timeline_store[key]
@@ -64,7 +66,7 @@ class InMemoryTimelineStorage(BaseTimelineStorage):
         score_value_pairs = list(zip(results, results))
         return score_value_pairs
 
-    def add_to_storage(self, key, activities, *args, **kwargs):
+    def add_to_storage(self, key, activities, max_length=None, *args, **kwargs):
         timeline = timeline_store[key]
         initial_count = len(timeline)
         for activity_id, activity_data in six.iteritems(activities):
@@ -72,7 +74,10 @@ class InMemoryTimelineStorage(BaseTimelineStorage):
                 continue
             timeline.insert(reverse_bisect_left(
                 timeline, activity_id), activity_data)
-        return len(timeline) - initial_count
+        insert_count = len(timeline) - initial_count
+        if max_length is not None:
+            del timeline[max_length:]
+        return insert_count
 
     def remove_from_storage(self, key, activities, *args, **kwargs):
         timeline = timeline_store[key]
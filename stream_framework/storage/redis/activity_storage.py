@@ -14,9 +14,12 @@ class RedisActivityStorage(BaseActivityStorage):
     def get_key(self):
         return self.options.get('key', 'global')
 
+    def get_redis_server(self):
+        return self.options.get('redis_server', 'default')
+
     def get_cache(self):
         key = self.get_key()
-        return ActivityCache(key)
+        return ActivityCache(key, redis_server=self.get_redis_server())
 
     def get_from_storage(self, activity_ids, *args, **kwargs):
         cache = self.get_cache()
@@ -0,0 +1,316 @@
+from __future__ import absolute_import
+from stream_framework.storage.redis.activity_storage import ActivityCache, RedisActivityStorage
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.storage.redis.structures.hash import ShardedHashCache
+from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage, TimelineCache
+from collections import OrderedDict
+from contextlib import contextmanager
+import binascii
+import bisect
+import concurrent.futures
+import hashlib
+import os
+import six
+import threading
+
+
+#: the number of hash slots, like redis cluster
+SLOT_COUNT = 16384
+
+
+def get_hash_tag(key):
+    '''
+    Returns the part of the key used to compute its slot, keys sharing
+    a {hash tag} end up on the same server (same rules as redis cluster)
+    '''
+    start = key.find('{')
+    if start != -1:
+        end = key.find('}', start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def get_slot(key):
+    '''
+    Returns the hash slot of the key, the CRC16 used by redis cluster
+    '''
+    key = six.text_type(get_hash_tag(six.text_type(key))).encode('utf-8')
+    return binascii.crc_hqx(key, 0) % SLOT_COUNT
+
+
+class HashRing(object):
+
+    '''
+    Assigns the hash slots to redis servers (names from STREAM_REDIS_CONFIG)
+    with consistent hashing, every server owns replicas points on the ring.
+    Adding a server only moves the slots it takes over
+
+    **Example** ::
+
+        ring = HashRing(['redis1', 'redis2', 'redis3'])
+        ring.get_server('feed_13')
+    '''
+
+    def __init__(self, servers, replicas=160):
+        if not servers:
+            raise ValueError('a hash ring needs at least one server')
+        self.servers = tuple(servers)
+        self.replicas = replicas
+        points = sorted(
+            (self.hash('%s:%s' % (server, i)), server)
+            for server in self.servers for i in range(replicas))
+        hashes = [h for h, _ in points]
+        # precompute the owner of every slot
+        self.slots = []
+        for slot in range(SLOT_COUNT):
+            index = bisect.bisect(hashes, self.hash(slot)) % len(points)
+            self.slots.append(points[index][1])
+
+    @staticmethod
+    def hash(value):
+        value = six.text_type(value).encode('utf-8')
+        return int(hashlib.md5(value).hexdigest()[:8], 16)
+
+    def get_server(self, key):
+        '''
+        Returns the name of the server owning key
+        '''
+        return self.slots[get_slot(key)]
+
+
+rings = {}
+
+
+def get_hash_ring(servers, replicas=160):
+    '''
+    Returns the ring of servers, rings are built once per process
+    '''
+    ring_key = (tuple(servers), replicas)
+    if ring_key not in rings:
+        rings[ring_key] = HashRing(servers, replicas)
+    return rings[ring_key]
+
+
+#: the threads sending the pipelines of the servers, shared by all the
+#: ClusterPipelines of the process
+MAX_WORKERS = 16
+
+executor = None
+executor_pid = None
+executor_lock = threading.Lock()
+
+
+def get_executor():
+    '''
+    Returns the thread pool of the process, it's created on first use and
+    again in a forked child, the threads of the parent don't exist there
+    '''
+    global executor, executor_pid
+    with executor_lock:
+        if executor is None or executor_pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(MAX_WORKERS)
+            executor_pid = os.getpid()
+        return executor
+
+
+class ClusterPipeline(object):
+
+    '''
+    Keeps a pipeline per server, pipeline(key) returns the one of the server
+    owning key. execute runs the pipelines of all servers concurrently
+    '''
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.pipelines = OrderedDict()
+
+    def pipeline(self, key):
+        server = self.ring.get_server(key)
+        if server not in self.pipelines:
+            self.pipelines[server] = get_redis_connection(
+                server_name=server).pipeline(transaction=False)
+        return self.pipelines[server]
+
+    def execute(self):
+        '''
+        Returns a dict with the results of the pipeline of every server
+        '''
+        pipelines = list(self.pipelines.items())
+        self.pipelines = OrderedDict()
+        if len(pipelines) <= 1:
+            return dict((server, pipe.execute()) for server, pipe in pipelines)
+        futures = [(server, get_executor().submit(pipe.execute))
+                   for server, pipe in pipelines]
+        return dict((server, future.result()) for server, future in futures)
+
+    def run(self, keys, command):
+        '''
+        Runs command(pipeline, key, index) for every key on the server owning
+        it, returns the results in the order of keys
+
+        command should queue exactly one command
+        '''
+        servers = []
+        for index, key in enumerate(keys):
+            command(self.pipeline(key), key, index)
+            servers.append(self.ring.get_server(key))
+        results = dict(
+            (server, iter(values)) for server, values in self.execute().items())
+        return [next(results[server]) for server in servers]
+
+
+class ClusterHashCache(ShardedHashCache):
+
+    '''
+    A sharded hash spreading its number_of_keys hashes over the servers
+    of the ring, the commands are grouped per server
+    '''
+
+    def __init__(self, key, ring, number_of_keys=None):
+        super(ClusterHashCache, self).__init__(key)
+        self.ring = ring
+        if number_of_keys is not None:
+            self.number_of_keys = number_of_keys
+
+    def get_many(self, fields):
+        field_groups = self.group_fields(fields)
+
+        def _get_many(redis, key, index):
+            redis.hmget(key, field_groups[index][1])
+
+        values = ClusterPipeline(self.ring).run(
+            [key for key, _ in field_groups], _get_many)
+        results = {}
+        for (key, key_fields), key_values in zip(field_groups, values):
+            results.update(zip(key_fields, key_values))
+        return results
+
+    def set_many(self, key_value_pairs):
+        values = dict(key_value_pairs)
+        field_groups = self.group_fields(values.keys())
+
+        def _set_many(redis, key, index):
+            key_fields = field_groups[index][1]
+            redis.hmset(key, dict((field, values[field]) for field in key_fields))
+
+        return ClusterPipeline(self.ring).run(
+            [key for key, _ in field_groups], _set_many)
+
+    def delete_many(self, fields):
+        field_groups = self.group_fields(fields)
+
+        def _delete_many(redis, key, index):
+            redis.hdel(key, *field_groups[index][1])
+
+        return ClusterPipeline(self.ring).run(
+            [key for key, _ in field_groups], _delete_many)
+
+    def count(self):
+        def _count(redis, key, index):
+            redis.hlen(key)
+
+        return sum(map(int, ClusterPipeline(self.ring).run(self.get_keys(), _count)))
+
+    def delete(self):
+        def _delete(redis, key, index):
+            redis.delete(key)
+
+        ClusterPipeline(self.ring).run(self.get_keys(), _delete)
+
+    def keys(self):
+        def _keys(redis, key, index):
+            redis.hkeys(key)
+
+        fields = []
+        for more_fields in ClusterPipeline(self.ring).run(self.get_keys(), _keys):
+            fields += more_fields
+        return fields
+
+
+class ClusterActivityCache(ClusterHashCache):
+    key_format = ActivityCache.key_format
+
+
+class ClusterActivityStorage(RedisActivityStorage):
+
+    '''
+    Spreads the activities over the redis servers of the redis_servers
+    option, shard_count hashes are distributed over the servers with
+    a consistent hashing ring
+
+    **Example** ::
+
+        ClusterActivityStorage(redis_servers=['redis1', 'redis2'], shard_count=64)
+    '''
+
+    def get_ring(self):
+        return get_hash_ring(
+            self.options.get('redis_servers', ['default']),
+            self.options.get('replicas', 160))
+
+    def get_redis_server(self):
+        # the activities don't live on a single server
+        return None
+
+    def get_cache(self):
+        return ClusterActivityCache(
+            self.get_key(), self.get_ring(), self.options.get('shard_count', 64))
+
+
+class ClusterTimelineStorage(RedisTimelineStorage):
+
+    '''
+    Stores every timeline on the server owning its key in the ring of the
+    redis_servers option. Reading several slices and the batch interface
+    send one pipeline per server, concurrently
+    '''
+    hydrated_slice_supported = False
+
+    def get_ring(self):
+        return get_hash_ring(
+            self.options.get('redis_servers', ['default']),
+            self.options.get('replicas', 160))
+
+    def get_cache(self, key, redis=None):
+        '''
+        :param redis: the connection to use, pass a pipeline or a
+            ClusterPipeline to batch commands
+        '''
+        if isinstance(redis, ClusterPipeline):
+            redis = redis.pipeline(key)
+        elif redis is None:
+            redis = get_redis_connection(server_name=self.get_ring().get_server(key))
+        return TimelineCache(key, redis=redis)
+
+    def get_many_slices_from_storage(self, requests):
+        '''
+        Reads the slices of all requests with one pipeline per server
+        '''
+        def _get_results(redis, key, index):
+            _, start, stop, filter_kwargs, ordering_args = requests[index]
+            cache, result_kwargs = self.get_slice_cache(
+                key, filter_kwargs, ordering_args, redis=redis)
+            cache.get_results(start, stop, **result_kwargs)
+
+        results = ClusterPipeline(self.get_ring()).run(
+            [request[0] for request in requests], _get_results)
+        return list(map(self.parse_slice, results))
+
+    def get_hydrated_slice_from_storage(self, *args, **kwargs):
+        raise NotImplementedError(
+            'the timeline and the activities live on different servers')
+
+    @contextmanager
+    def get_batch_interface(self):
+        '''
+        Yields a ClusterPipeline, the commands queued on it are sent
+        with one pipeline per server when the block exits
+        '''
+        cluster = ClusterPipeline(self.get_ring())
+        yield cluster
+        cluster.execute()
+
+    def get_batch_interface_key(self):
+        ring = self.get_ring()
+        return ('redis_cluster', ring.servers, ring.replicas)
@@ -0,0 +1,159 @@
+from stream_framework.serializers.simple_timeline_serializer import SimpleTimelineSerializer
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage, TimelineCache
+from stream_framework.utils import chunks
+import decimal
+import logging
+import six
+
+
+logger = logging.getLogger(__name__)
+
+
+#: the digits of the member encoding, in ascii order so that the
+#: byte order of the members matches the order of the ids
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+#: the width of the members, 62 ** 15 fits ids of 26 decimal digits
+MEMBER_WIDTH = 15
+
+
+def encode_id(activity_id):
+    '''
+    Encodes a serialization id as a fixed width base62 string
+
+    **Example** ::
+
+        encode_id(1373266755000000000042008) == '06reQ79CsaBgEQq'
+    '''
+    if isinstance(activity_id, six.string_types):
+        activity_id = decimal.Decimal(activity_id)
+    activity_id = int(activity_id)
+    if not 0 <= activity_id < len(ALPHABET) ** MEMBER_WIDTH:
+        raise ValueError('Cant encode activity id %s' % activity_id)
+    digits = []
+    while activity_id:
+        activity_id, digit = divmod(activity_id, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+    return ''.join(reversed(digits)).rjust(MEMBER_WIDTH, ALPHABET[0])
+
+
+def decode_id(member):
+    '''
+    Returns the serialization id of a member written by encode_id
+    '''
+    activity_id = 0
+    for char in member:
+        activity_id = activity_id * len(ALPHABET) + ALPHABET.index(char)
+    return activity_id
+
+
+class CompactTimelineCache(TimelineCache):
+
+    '''
+    A timeline where every member has score 0 and is the encoded id.
+    Members with the same score are sorted by their bytes, so the
+    timeline is read with ZREVRANGEBYLEX and ordered by the exact id
+    '''
+
+    def get_lex_bound(self, score, unbounded):
+        '''
+        Turns a score bound of get_results, like 10 or '(10',
+        into a lex bound
+        '''
+        if score is None:
+            return unbounded
+        if isinstance(score, six.string_types) and score.startswith('('):
+            return '(' + encode_id(score[1:])
+        return '[' + encode_id(score)
+
+    def get_results(self, start=None, stop=None, min_score=None, max_score=None):
+        '''
+        Returns the members between min_score and max_score,
+        the scores are ids like the ones of TimelineCache.get_results
+        '''
+        start = start or 0
+        limit = -1 if stop is None or stop == -1 else stop - start
+        key = self.get_key()
+        min_lex = self.get_lex_bound(min_score, '-')
+        max_lex = self.get_lex_bound(max_score, '+')
+        if self.sort_asc:
+            return self.redis.zrangebylex(key, min_lex, max_lex, start, limit)
+        return self.redis.zrevrangebylex(key, max_lex, min_lex, start, limit)
+
+
+class CompactRedisTimelineStorage(RedisTimelineStorage):
+
+    '''
+    Stores the activity ids as 15 byte base62 members with score 0,
+    instead of their 26 digits as member and a float score. The
+    timelines take less memory and large ids keep their exact order
+
+    The timeline serializer must store ids, like SimpleTimelineSerializer.
+    Use migrate to convert the timelines written by RedisTimelineStorage
+    '''
+    hydrated_slice_supported = False
+
+    def __init__(self, *args, **kwargs):
+        super(CompactRedisTimelineStorage, self).__init__(*args, **kwargs)
+        if not issubclass(self.serializer_class, SimpleTimelineSerializer):
+            raise ValueError(
+                'CompactRedisTimelineStorage only stores ids, got serializer %s' % self.serializer_class)
+
+    def get_cache(self, key, redis=None):
+        redis_server = self.options.get('redis_server', 'default')
+        return CompactTimelineCache(key, redis=redis, redis_server=redis_server)
+
+    def get_score_value_pairs(self, activities):
+        return [(0, encode_id(activity_id)) for activity_id in activities.keys()]
+
+    def parse_slice(self, results):
+        activity_ids = [decode_id(member) for member in results]
+        return [(activity_id, six.text_type(activity_id)) for activity_id in activity_ids]
+
+    def contains(self, key, activity_id):
+        return self.get_cache(key).contains(encode_id(activity_id))
+
+    def get_index_of(self, key, activity_id):
+        return self.get_cache(key).index_of(encode_id(activity_id))
+
+    def remove_from_storage(self, key, activities, batch_interface=None):
+        cache = self.get_cache(key, redis=batch_interface)
+        return cache.remove_many([encode_id(activity_id) for activity_id in activities.keys()])
+
+    def get_hydrated_slice_from_storage(self, *args, **kwargs):
+        raise NotImplementedError(
+            'the activity storage is keyed by the decimal ids')
+
+    def migrate(self, key, chunk_size=500):
+        '''
+        Converts a timeline written by RedisTimelineStorage in place, in a
+        transaction retried when the timeline changes meanwhile. The members
+        already converted have score 0 and are left alone, so running it
+        twice is safe
+
+        **Example** ::
+
+            storage = CompactRedisTimelineStorage()
+            for key in redis.scan_iter('feed_*'):
+                storage.migrate(key)
+
+        :param key: the redis key of the timeline
+        :returns int: the number of converted members
+        '''
+        redis = get_redis_connection(
+            server_name=self.options.get('redis_server', 'default'))
+        key = self.get_cache(key).get_key()
+
+        def _migrate(pipe):
+            # the legacy members are the decimal ids, their scores may be rounded
+            members = pipe.zrangebyscore(key, '(0', '+inf')
+            pipe.multi()
+            for members_chunk in chunks(members, chunk_size):
+                pipe.zrem(key, *members_chunk)
+                pairs = sum([[0, encode_id(member)] for member in members_chunk], [])
+                pipe.zadd(key, *pairs)
+            return len(members)
+
+        converted = redis.transaction(_migrate, key, value_from_callable=True)
+        logger.info('converted %s members of %s', converted, key)
+        return converted
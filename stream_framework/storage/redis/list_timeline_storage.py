@@ -0,0 +1,286 @@
+from stream_framework.serializers.simple_timeline_serializer import SimpleTimelineSerializer
+from stream_framework.storage.redis.structures.list import BaseRedisListCache
+from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage
+from stream_framework.utils import chunks
+from stream_framework.utils.five import long_t
+import decimal
+import logging
+import math
+import six
+
+
+logger = logging.getLogger(__name__)
+
+
+#: compares two decimal ids without converting them to lua numbers,
+#: which would round them
+NEWER_FUNCTION = '''
+local function newer(a, b)
+    if #a ~= #b then
+        return #a > #b
+    end
+    return a > b
+end
+'''
+
+
+class ListTimelineCache(BaseRedisListCache):
+
+    '''
+    A timeline stored as a redis list of activity ids, newest first
+
+    Adding ids newer than the head of the list is a LPUSH, the ids are
+    merged into the list when they arrive out of order. Both run in a
+    lua script so concurrent writers keep the list sorted
+    '''
+    key_format = 'redis:list_timeline_cache:%s'
+    sort_asc = False
+    #: the number of ids sent per script call
+    add_many_chunk_size = 1000
+    #: the number of values removed per script call
+    remove_many_chunk_size = 500
+
+    add_many_script = NEWER_FUNCTION + '''
+    local key = KEYS[1]
+    local head = redis.call('LINDEX', key, 0)
+    local added = #ARGV - 1
+    if not head or newer(ARGV[2], head) then
+        -- in order, every id is newer than the head
+        redis.call('LPUSH', key, unpack(ARGV, 2))
+    else
+        local items = redis.call('LRANGE', key, 0, -1)
+        local seen = {}
+        for _, item in ipairs(items) do
+            seen[item] = true
+        end
+        local new = {}
+        for i = #ARGV, 2, -1 do
+            if not seen[ARGV[i]] then
+                new[#new + 1] = ARGV[i]
+                seen[ARGV[i]] = true
+            end
+        end
+        added = #new
+        local merged = {}
+        local i, j = 1, 1
+        while i <= #items or j <= #new do
+            if j > #new or (i <= #items and newer(items[i], new[j])) then
+                merged[#merged + 1] = items[i]
+                i = i + 1
+            else
+                merged[#merged + 1] = new[j]
+                j = j + 1
+            end
+        end
+        redis.call('DEL', key)
+        for offset = 1, #merged, 1000 do
+            redis.call('RPUSH', key, unpack(merged, offset, math.min(offset + 999, #merged)))
+        end
+    end
+    local max_length = tonumber(ARGV[1])
+    if max_length > 0 then
+        redis.call('LTRIM', key, 0, max_length - 1)
+    end
+    return added
+    '''
+
+    #: rewrites the list without the ids in ARGV, in a single pass
+    remove_many_script = '''
+    local key = KEYS[1]
+    local removed = {}
+    for i = 1, #ARGV do
+        removed[ARGV[i]] = true
+    end
+    local items = redis.call('LRANGE', key, 0, -1)
+    local kept = {}
+    for _, item in ipairs(items) do
+        if not removed[item] then
+            kept[#kept + 1] = item
+        end
+    end
+    if #kept < #items then
+        redis.call('DEL', key)
+        for offset = 1, #kept, 1000 do
+            redis.call('RPUSH', key, unpack(kept, offset, math.min(offset + 999, #kept)))
+        end
+    end
+    return #items - #kept
+    '''
+
+    #: ARGV holds the min and max id ('' when unbounded), if they are
+    #: exclusive, the order and the offset and limit of the slice
+    get_results_script = NEWER_FUNCTION + '''
+    local function matches(item)
+        if ARGV[1] ~= '' then
+            if ARGV[2] == '1' then
+                if not newer(item, ARGV[1]) then return false end
+            elseif newer(ARGV[1], item) then
+                return false
+            end
+        end
+        if ARGV[3] ~= '' then
+            if ARGV[4] == '1' then
+                if not newer(ARGV[3], item) then return false end
+            elseif newer(item, ARGV[3]) then
+                return false
+            end
+        end
+        return true
+    end
+    local items = redis.call('LRANGE', KEYS[1], 0, -1)
+    local first, last, step = 1, #items, 1
+    if ARGV[5] == '1' then
+        first, last, step = #items, 1, -1
+    end
+    local skip = tonumber(ARGV[6])
+    local limit = tonumber(ARGV[7])
+    local results = {}
+    for i = first, last, step do
+        if limit >= 0 and #results >= limit then
+            break
+        end
+        if matches(items[i]) then
+            if skip > 0 then
+                skip = skip - 1
+            else
+                results[#results + 1] = items[i]
+            end
+        end
+    end
+    return results
+    '''
+
+    def count(self):
+        key = self.get_key()
+        return int(self.redis.llen(key))
+
+    def contains(self, value):
+        key = self.get_key()
+        return six.text_type(value) in self.redis.lrange(key, 0, -1)
+
+    def index_of(self, value):
+        key = self.get_key()
+        try:
+            return self.redis.lrange(key, 0, -1).index(six.text_type(value))
+        except ValueError:
+            raise ValueError(
+                'Couldnt find item with value %s in key %s' % (value, key))
+
+    def add_many(self, score_value_pairs, max_length=None):
+        '''
+        Adds the values, sorted by their scores
+
+        :param max_length: trims the list to max_length items in the same script
+        '''
+        key = self.get_key()
+        values = [value for _, value in sorted(score_value_pairs)]
+
+        def _add_many(redis, values):
+            script = redis.register_script(self.add_many_script)
+            results = []
+            for values_chunk in chunks(values, self.add_many_chunk_size):
+                logger.debug('adding %s values to %s', len(values_chunk), key)
+                results.append(script(
+                    keys=[key], args=[max_length or 0] + list(values_chunk)))
+            return results
+
+        # start a new map redis or go with the given one
+        return self._pipeline_if_needed(_add_many, values)
+
+    def remove_many(self, values):
+        '''
+        Removes the values with one script call per chunk of
+        remove_many_chunk_size, instead of a LREM scanning the list per value
+        '''
+        key = self.get_key()
+
+        def _remove_many(redis, values):
+            script = redis.register_script(self.remove_many_script)
+            results = []
+            for values_chunk in chunks(values, self.remove_many_chunk_size):
+                logger.debug('removing %s values from %s', len(values_chunk), key)
+                results.append(script(
+                    keys=[key], args=[six.text_type(value) for value in values_chunk]))
+            return results
+
+        # start a new map redis or go with the given one
+        return self._pipeline_if_needed(_remove_many, values)
+
+    def trim(self, max_length=None):
+        key = self.get_key()
+        if max_length is None:
+            max_length = self.max_length
+        self.redis.ltrim(key, 0, max_length - 1)
+        logger.info('cleaning up the list %s to a max of %s items' %
+                    (key, max_length))
+
+    def get_bound(self, score):
+        '''
+        Turns a score bound of get_results, like 10 or '(10',
+        into the id and exclusive flag of the script
+        '''
+        if score is None:
+            return ['', 0]
+        exclusive = isinstance(score, six.string_types) and score.startswith('(')
+        if exclusive:
+            score = decimal.Decimal(score[1:])
+        return [six.text_type(long_t(score)), int(exclusive)]
+
+    def get_results(self, start=None, stop=None, min_score=None, max_score=None):
+        '''
+        Returns the ids between min_score and max_score, a plain
+        LRANGE when the slice isn't filtered
+        '''
+        key = self.get_key()
+        start = start or 0
+        if stop == -1:
+            stop = None
+        plain = min_score is None and max_score is None and not self.sort_asc
+        if plain and (stop is None or stop > start):
+            end = -1 if stop is None else stop - 1
+            return self.redis.lrange(key, start, end)
+        limit = -1 if stop is None else max(stop - start, 0)
+        script = self.redis.register_script(self.get_results_script)
+        args = self.get_bound(min_score) + self.get_bound(max_score)
+        args += [int(self.sort_asc), start, limit]
+        return script(keys=[key], args=args)
+
+
+class RedisListTimelineStorage(RedisTimelineStorage):
+
+    '''
+    Stores the timelines as redis lists of activity ids, for feeds where
+    new activities are almost always the newest. A list takes less memory
+    than a sorted set and reading a page is a LRANGE
+
+    Out of order adds rewrite the list, filtered and ascending slices scan
+    it. Keep max_length small and use a timeline serializer storing ids,
+    like SimpleTimelineSerializer
+    '''
+    hydrated_slice_supported = False
+
+    def __init__(self, *args, **kwargs):
+        super(RedisListTimelineStorage, self).__init__(*args, **kwargs)
+        if not issubclass(self.serializer_class, SimpleTimelineSerializer):
+            raise ValueError(
+                'RedisListTimelineStorage only stores ids, got serializer %s' % self.serializer_class)
+
+    def get_cache(self, key, redis=None):
+        redis_server = self.options.get('redis_server', 'default')
+        return ListTimelineCache(key, redis=redis, redis_server=redis_server)
+
+    def get_score_value_pairs(self, activities):
+        return [(long_t(activity_id), six.text_type(activity_id))
+                for activity_id in activities.keys()]
+
+    def get_add_command_count(self, activities_count):
+        # add_many runs the script once per chunk of ids
+        chunk_size = ListTimelineCache.add_many_chunk_size
+        return int(math.ceil(activities_count * 1.0 / chunk_size))
+
+    def parse_slice(self, results):
+        return [(long_t(activity_id), activity_id) for activity_id in results]
+
+    def get_hydrated_slice_from_storage(self, *args, **kwargs):
+        raise NotImplementedError(
+            'the hydrated slice script reads sorted sets')
@@ -1,4 +1,6 @@
 from stream_framework.storage.redis.structures.base import RedisCache
+from stream_framework.utils import chunks
+from collections import OrderedDict
 import logging
 logger = logging.getLogger(__name__)
 
@@ -9,10 +11,26 @@ class BaseRedisHashCache(RedisCache):
 
 class RedisHashCache(BaseRedisHashCache):
     key_format = 'redis:hash_cache:%s'
+    # : the number of fields sent per HMGET, HMSET or HDEL
+    fields_chunk_size = 500
 
     def get_key(self, *args, **kwargs):
         return self.key
 
+    def group_fields(self, fields):
+        '''
+        Groups the fields per key in chunks of at most fields_chunk_size,
+        so they can be sent with one variadic command per chunk
+
+        :returns: a list of (key, fields) tuples
+        '''
+        grouped = OrderedDict()
+        for field in fields:
+            grouped.setdefault(self.get_key(field), []).append(field)
+        return [(key, list(chunk))
+                for key, key_fields in grouped.items()
+                for chunk in chunks(key_fields, self.fields_chunk_size)]
+
     def count(self):
         '''
         Returns the number of elements in the sorted set
@@ -43,29 +61,42 @@ class RedisHashCache(BaseRedisHashCache):
         return keys
 
     def delete_many(self, fields):
-        results = {}
+        '''
+        Removes the fields with one HDEL per key and chunk
+
+        :returns: the list of HDEL results
+        '''
+        field_groups = self.group_fields(fields)
 
-        def _delete_many(redis, fields):
-            for field in fields:
-                key = self.get_key(field)
-                logger.debug('removing field %s from %s', field, key)
-                result = redis.hdel(key, field)
-                results[field] = result
+        def _delete_many(redis, field_groups):
+            results = []
+            for key, key_fields in field_groups:
+                logger.debug('removing %s fields from %s', len(key_fields), key)
+                results.append(redis.hdel(key, *key_fields))
             return results
 
         # start a new map redis or go with the given one
-        results = self._pipeline_if_needed(_delete_many, fields)
+        results = self._pipeline_if_needed(_delete_many, field_groups)
 
         return results
 
     def get_many(self, fields):
-        key = self.get_key()
-        results = {}
-        values = list(self.redis.hmget(key, fields))
-        for field, result in zip(fields, values):
-            logger.debug('getting field %s from %s', field, key)
-            results[field] = result
+        '''
+        Reads the fields with one HMGET per key and chunk
+
+        :returns: a dict with the value of every field, None if it's missing
+        '''
+        field_groups = self.group_fields(fields)
+        # always use a new pipeline, the results are needed here
+        pipe = self.redis.pipeline(transaction=False)
+        for key, key_fields in field_groups:
+            logger.debug('getting %s fields from %s', len(key_fields), key)
+            pipe.hmget(key, key_fields)
+        values = pipe.execute() if field_groups else []
 
+        results = {}
+        for (key, key_fields), key_values in zip(field_groups, values):
+            results.update(zip(key_fields, key_values))
         return results
 
     def set(self, key, value):
@@ -75,19 +106,22 @@ class RedisHashCache(BaseRedisHashCache):
         return result
 
     def set_many(self, key_value_pairs):
-        results = []
-
-        def _set_many(redis, key_value_pairs):
-            for field, value in key_value_pairs:
-                key = self.get_key(field)
-                logger.debug(
-                    'writing hash(%s) field %s to %s', key, field, value)
-                result = redis.hmset(key, {field: value})
-                results.append(result)
+        '''
+        Writes the fields with one HMSET per key and chunk
+        '''
+        values = dict(key_value_pairs)
+        field_groups = self.group_fields(values.keys())
+
+        def _set_many(redis, field_groups):
+            results = []
+            for key, key_fields in field_groups:
+                logger.debug('writing %s fields to hash(%s)', len(key_fields), key)
+                mapping = dict((field, values[field]) for field in key_fields)
+                results.append(redis.hmset(key, mapping))
             return results
 
         # start a new map redis or go with the given one
-        results = self._pipeline_if_needed(_set_many, key_value_pairs)
+        results = self._pipeline_if_needed(_set_many, field_groups)
 
         return results
 
@@ -100,20 +134,7 @@ class FallbackHashCache(RedisHashCache):
     key_format = 'redis:db_hash_cache:%s'
 
     def get_many(self, fields, database_fallback=True):
-        results = {}
-
-        def _get_many(redis, fields):
-            for field in fields:
-                # allow for easy sharding
-                key = self.get_key(field)
-                logger.debug('getting field %s from %s', field, key)
-                result = redis.hget(key, field)
-                results[field] = result
-            return results
-
-        # start a new map redis or go with the given one
-        results = self._pipeline_if_needed(_get_many, fields)
-        results = dict(zip(fields, results))
+        results = super(FallbackHashCache, self).get_many(fields)
 
         # query missing results from the database and store them
         if database_fallback:
@@ -163,41 +184,8 @@ class ShardedHashCache(RedisHashCache):
         return self.key + ':%s' % position
 
     def get_many(self, fields):
-        results = {}
-
-        def _get_many(redis, fields):
-            for field in fields:
-                # allow for easy sharding
-                key = self.get_key(field)
-                logger.debug('getting field %s from %s', field, key)
-                result = redis.hget(key, field)
-                results[field] = result
-            return results
-
-        # start a new map redis or go with the given one
-        results = self._pipeline_if_needed(_get_many, fields)
-        results = dict(zip(fields, results))
-
-        return results
-
-    def delete_many(self, fields):
-        results = {}
-
-        def _get_many(redis, fields):
-            for field in fields:
-                # allow for easy sharding
-                key = self.get_key(field)
-                logger.debug('getting field %s from %s', field, key)
-                result = redis.hdel(key, field)
-                results[field] = result
-            return results
-
-        # start a new map redis or go with the given one
-        results = self._pipeline_if_needed(_get_many, fields)
-        results = dict(zip(fields, results))
-        # results = dict((k, v) for k, v in results.items() if v)
-
-        return results
+        # skip the database fallback of ShardedDatabaseFallbackHashCache
+        return RedisHashCache.get_many(self, fields)
 
     def count(self):
         '''
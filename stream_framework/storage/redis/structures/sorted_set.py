@@ -9,6 +9,18 @@ logger = logging.getLogger(__name__)
 
 class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
     sort_asc = False
+    # : the number of arguments (scores and values) sent per ZADD
+    add_many_chunk_size = 200
+    # : the number of values or scores removed per command
+    remove_many_chunk_size = 500
+
+    remove_by_scores_script = '''
+    local removed = 0
+    for i, score in ipairs(ARGV) do
+        removed = removed + redis.call('ZREMRANGEBYSCORE', KEYS[1], score, score)
+    end
+    return removed
+    '''
 
     def count(self):
         '''
@@ -46,9 +58,12 @@ class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
         result = results[0]
         return result
 
-    def add_many(self, score_value_pairs):
+    def add_many(self, score_value_pairs, max_length=None):
         '''
         StrictRedis so it expects score1, name1
+
+        :param max_length: trims the sorted set to max_length items in the
+            same pipeline as the ZADD commands
         '''
         key = self.get_key()
         scores = list(zip(*score_value_pairs))[0]
@@ -60,13 +75,16 @@ class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
 
         def _add_many(redis, score_value_pairs):
             score_value_list = sum(map(list, score_value_pairs), [])
-            score_value_chunks = chunks(score_value_list, 200)
+            score_value_chunks = chunks(score_value_list, self.add_many_chunk_size)
 
             for score_value_chunk in score_value_chunks:
                 result = redis.zadd(key, *score_value_chunk)
                 logger.debug('adding to %s with score_value_chunk %s',
                              key, score_value_chunk)
                 results.append(result)
+            if max_length is not None:
+                begin, end = self.get_trim_range(max_length)
+                results.append(redis.zremrangebyrank(key, begin, end))
             return results
 
         # start a new map redis or go with the given one
@@ -76,16 +94,15 @@ class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
 
     def remove_many(self, values):
         '''
-        values
+        Removes the values with one ZREM per chunk of remove_many_chunk_size
         '''
         key = self.get_key()
-        results = []
 
         def _remove_many(redis, values):
-            for value in values:
-                logger.debug('removing value %s from %s', value, key)
-                result = redis.zrem(key, value)
-                results.append(result)
+            results = []
+            for values_chunk in chunks(values, self.remove_many_chunk_size):
+                logger.debug('removing %s values from %s', len(values_chunk), key)
+                results.append(redis.zrem(key, *values_chunk))
             return results
 
         # start a new map redis or go with the given one
@@ -94,14 +111,18 @@ class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
         return results
 
     def remove_by_scores(self, scores):
+        '''
+        Removes the values with the given scores, ZREMRANGEBYSCORE isn't
+        variadic so a lua script runs it for a chunk of scores at a time
+        '''
         key = self.get_key()
-        results = []
 
         def _remove_many(redis, scores):
-            for score in scores:
-                logger.debug('removing score %s from %s', score, key)
-                result = redis.zremrangebyscore(key, score, score)
-                results.append(result)
+            script = redis.register_script(self.remove_by_scores_script)
+            results = []
+            for scores_chunk in chunks(scores, self.remove_many_chunk_size):
+                logger.debug('removing %s scores from %s', len(scores_chunk), key)
+                results.append(script(keys=[key], args=scores_chunk))
             return results
 
         # start a new map redis or go with the given one
@@ -127,19 +148,21 @@ class RedisSortedSetCache(BaseRedisListCache, BaseRedisHashCache):
         if max_length is None:
             max_length = self.max_length
 
-        # map things to the funny redis syntax
-        if self.sort_asc:
-            begin = max_length
-            end = -1
-        else:
-            begin = 0
-            end = (max_length * -1) - 1
-
+        begin, end = self.get_trim_range(max_length)
         removed = self.redis.zremrangebyrank(key, begin, end)
         logger.info('cleaning up the sorted set %s to a max of %s items' %
                     (key, max_length))
         return removed
 
+    def get_trim_range(self, max_length):
+        '''
+        Returns the ranks ZREMRANGEBYRANK removes to keep max_length items
+        '''
+        # map things to the funny redis syntax
+        if self.sort_asc:
+            return max_length, -1
+        return 0, (max_length * -1) - 1
+
     def get_results(self, start=None, stop=None, min_score=None, max_score=None):
         '''
         Retrieve results from redis using zrevrange
@@ -2,19 +2,26 @@ from stream_framework.storage.base import BaseTimelineStorage
 from stream_framework.storage.redis.structures.sorted_set import RedisSortedSetCache
 from stream_framework.storage.redis.connection import get_redis_connection
 from stream_framework.utils.five import long_t
+from contextlib import contextmanager
+import math
 import six
 
 
-
 class TimelineCache(RedisSortedSetCache):
     sort_asc = False
 
 
 class RedisTimelineStorage(BaseTimelineStorage):
+    trims_on_write = True
+    #: if get_hydrated_slice can read the activities with the slice
+    hydrated_slice_supported = True
 
-    def get_cache(self, key):
+    def get_cache(self, key, redis=None):
+        '''
+        :param redis: the connection to use, pass a pipeline to batch commands
+        '''
         redis_server = self.options.get('redis_server', 'default')
-        cache = TimelineCache(key, redis_server=redis_server)
+        cache = TimelineCache(key, redis=redis, redis_server=redis_server)
         return cache
 
     def contains(self, key, activity_id):
@@ -22,19 +29,17 @@ class RedisTimelineStorage(BaseTimelineStorage):
         contains = cache.contains(activity_id)
         return contains
 
-    def get_slice_from_storage(self, key, start, stop, filter_kwargs=None, ordering_args=None):
+    def get_slice_cache(self, key, filter_kwargs=None, ordering_args=None, redis=None):
         '''
-        Returns a slice from the storage
+        Returns the cache for key and the get_results kwargs
+        matching the filter kwargs and the ordering
+
         :param key: the redis key at which the sorted set is located
-        :param start: the start
-        :param stop: the stop
         :param filter_kwargs: a dict of filter kwargs
         :param ordering_args: a list of fields used for sorting
-
-        **Example**::
-           get_slice_from_storage('feed:13', 0, 10, {activity_id__lte=10})
+        :param redis: the connection to use, pass a pipeline to batch commands
         '''
-        cache = self.get_cache(key)
+        cache = self.get_cache(key, redis=redis)
 
         # parse the filter kwargs and translate them to min max
         # as used by the get results function
@@ -42,7 +47,7 @@ class RedisTimelineStorage(BaseTimelineStorage):
             'activity_id__gte', 'activity_id__lte',
             'activity_id__gt', 'activity_id__lt',
         ]
-        filter_kwargs = filter_kwargs or {}
+        filter_kwargs = dict(filter_kwargs or {})
         result_kwargs = {}
         for k in valid_kwargs:
             v = filter_kwargs.pop(k, None)
@@ -80,28 +85,163 @@ class RedisTimelineStorage(BaseTimelineStorage):
             else:
                 raise ValueError('Unrecognized order kwargs %s' % ordering_args)
 
+        return cache, result_kwargs
+
+    def get_slice_from_storage(self, key, start, stop, filter_kwargs=None, ordering_args=None):
+        '''
+        Returns a slice from the storage
+        :param key: the redis key at which the sorted set is located
+        :param start: the start
+        :param stop: the stop
+        :param filter_kwargs: a dict of filter kwargs
+        :param ordering_args: a list of fields used for sorting
+
+        **Example**::
+           get_slice_from_storage('feed:13', 0, 10, {activity_id__lte=10})
+        '''
+        cache, result_kwargs = self.get_slice_cache(
+            key, filter_kwargs, ordering_args)
+
         # get the actual results
-        key_score_pairs = cache.get_results(start, stop, **result_kwargs)
-        score_key_pairs = [(score, data) for data, score in key_score_pairs]
+        results = cache.get_results(start, stop, **result_kwargs)
+        return self.parse_slice(results)
+
+    def parse_slice(self, results):
+        '''
+        Turns the results of TimelineCache.get_results into
+        (score, serialized activity) pairs
+        '''
+        return [(score, data) for data, score in results]
+
+    def get_many_slices_from_storage(self, requests):
+        '''
+        Reads the slices of all requests in one round trip
+        '''
+        pipe = get_redis_connection(
+            server_name=self.options.get('redis_server', 'default')
+        ).pipeline(transaction=False)
+        for key, start, stop, filter_kwargs, ordering_args in requests:
+            cache, result_kwargs = self.get_slice_cache(
+                key, filter_kwargs, ordering_args, redis=pipe)
+            cache.get_results(start, stop, **result_kwargs)
+        results = pipe.execute() if requests else []
+        return list(map(self.parse_slice, results))
+
+    #: reads a slice of the timeline and the serialized activities it
+    #: references, trying every hash shard of the activity storage
+    #: since lua can't compute their md5 based position
+    hydrated_slice_script = '''
+    local slice = redis.call(ARGV[1], KEYS[1], ARGV[2], ARGV[3], 'WITHSCORES', 'LIMIT', ARGV[4], ARGV[5])
+    local ids = {}
+    local results = {}
+    for i = 1, #slice, 2 do
+        ids[#ids + 1] = slice[i]
+        results[#results + 1] = slice[i]
+        results[#results + 1] = slice[i + 1]
+        results[#results + 1] = false
+    end
+    for offset = 0, #ids - 1, 1000 do
+        local fields = {}
+        for i = offset + 1, math.min(offset + 1000, #ids) do
+            fields[#fields + 1] = ids[i]
+        end
+        for k = 2, #KEYS do
+            local values = redis.call('HMGET', KEYS[k], unpack(fields))
+            for i = 1, #fields do
+                if values[i] then
+                    results[(offset + i) * 3] = values[i]
+                end
+            end
+        end
+    end
+    return results
+    '''
+
+    def get_hydrated_slice_from_storage(self, key, start, stop, activity_storage,
+                                        filter_kwargs=None, ordering_args=None):
+        '''
+        Reads a slice and the serialized activities it references in one
+        round trip. The timeline must store activity ids and activity_storage
+        must be a RedisActivityStorage on the same redis server
+
+        :param key: the redis key at which the sorted set is located
+        :param start: the start
+        :param stop: the stop
+        :param activity_storage: the activity storage holding the activities
+        :param filter_kwargs: a dict of filter kwargs
+        :param ordering_args: a list of fields used for sorting
+        :returns: a list of (score, activity_id, serialized_activity) tuples,
+            serialized_activity is None when the activity is missing from
+            the activity storage
+        '''
+        cache, result_kwargs = self.get_slice_cache(
+            key, filter_kwargs, ordering_args)
+        min_score = result_kwargs.get('min_score', '-inf')
+        max_score = result_kwargs.get('max_score', '+inf')
+        if cache.sort_asc:
+            range_args = ['ZRANGEBYSCORE', min_score, max_score]
+        else:
+            range_args = ['ZREVRANGEBYSCORE', max_score, min_score]
+        # same limits as TimelineCache.get_results
+        start = start or 0
+        limit = -1 if stop is None or stop == -1 else stop - start
+
+        redis = get_redis_connection(
+            server_name=self.options.get('redis_server', 'default'))
+        script = redis.register_script(self.hydrated_slice_script)
+        keys = [cache.get_key()] + activity_storage.get_cache().get_keys()
+        values = script(keys=keys, args=range_args + [start, limit])
+        return [(float(values[i + 1]), values[i], values[i + 2])
+                for i in range(0, len(values), 3)]
 
-        return score_key_pairs
+    def get_hydrated_slice(self, key, start, stop, activity_storage,
+                           filter_kwargs=None, ordering_args=None):
+        '''
+        Returns the hydrated activities of a slice, read with
+        get_hydrated_slice_from_storage. The activities missing from
+        the activity storage are left out
+        '''
+        results = self.get_hydrated_slice_from_storage(
+            key, start, stop, activity_storage, filter_kwargs, ordering_args)
+        self.metrics.on_feed_read(self.__class__, len(results))
+        serialized_activities = [
+            serialized for _, _, serialized in results if serialized is not None]
+        activity_storage.metrics.on_feed_read(
+            activity_storage.__class__, len(serialized_activities))
+        return activity_storage.deserialize_activities(serialized_activities)
 
+    @contextmanager
     def get_batch_interface(self):
-        return get_redis_connection(
+        '''
+        Yields a redis pipeline, the commands queued on it are sent
+        in one round trip when the block exits
+        '''
+        pipe = get_redis_connection(
             server_name=self.options.get('redis_server', 'default')
         ).pipeline(transaction=False)
+        with pipe:
+            yield pipe
+            pipe.execute()
+
+    def get_batch_interface_key(self):
+        return ('redis', self.options.get('redis_server', 'default'))
 
     def get_index_of(self, key, activity_id):
         cache = self.get_cache(key)
         index = cache.index_of(activity_id)
         return index
 
-    def add_to_storage(self, key, activities, batch_interface=None, *args, **kwargs):
-        cache = self.get_cache(key)
-        # turn it into key value pairs
-        scores = map(long_t, activities.keys())
-        score_value_pairs = list(zip(scores, activities.values()))
-        result = cache.add_many(score_value_pairs)
+    def add_to_storage(self, key, activities, batch_interface=None, max_length=None, *args, **kwargs):
+        '''
+        Adds the activities with ZADD, when max_length is given the
+        timeline is trimmed with ZREMRANGEBYRANK in the same pipeline
+        '''
+        cache = self.get_cache(key, redis=batch_interface)
+        score_value_pairs = self.get_score_value_pairs(activities)
+        result = cache.add_many(score_value_pairs, max_length=max_length)
+        if batch_interface is not None:
+            # the commands are queued, they run when the batch is executed
+            return result
         for r in result:
             # errors in strings?
             # anyhow raise them here :)
@@ -109,8 +249,22 @@ class RedisTimelineStorage(BaseTimelineStorage):
                 raise ValueError('got error %s in results %s' % (r, result))
         return result
 
+    def get_score_value_pairs(self, activities):
+        '''
+        Returns the (score, member) pairs to add for a dict of
+        serialized activities
+        '''
+        # turn it into key value pairs
+        scores = map(long_t, activities.keys())
+        return list(zip(scores, activities.values()))
+
+    def get_add_command_count(self, activities_count):
+        # add_many sends one ZADD per chunk of score value pairs
+        chunk_size = TimelineCache.add_many_chunk_size
+        return int(math.ceil(activities_count * 2.0 / chunk_size))
+
     def remove_from_storage(self, key, activities, batch_interface=None):
-        cache = self.get_cache(key)
+        cache = self.get_cache(key, redis=batch_interface)
         results = cache.remove_many(activities.values())
         return results
 
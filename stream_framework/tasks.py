@@ -1,40 +1,97 @@
 from celery import shared_task
 from stream_framework.activity import Activity, AggregatedActivity
+from stream_framework.executors.base import run_fanout
+from stream_framework.feed_managers.registry import get_manager_by_name
+from stream_framework.utils.five import long_t
+import six
 
 
 @shared_task
-def fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs):
+def fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+                     fanout_priority=None, enqueued_at=None, started_at=None, fanout_id=None):
     '''
     Simple task wrapper for _fanout task
     Just making sure code is where you expect it :)
+
+    feed_manager is either the manager or the name of a registered manager
     '''
-    feed_manager.fanout(user_ids, feed_class, operation, operation_kwargs)
+    run_fanout(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+               fanout_priority=fanout_priority, enqueued_at=enqueued_at,
+               started_at=started_at, fanout_id=fanout_id)
     return "%d user_ids, %r, %r (%r)" % (len(user_ids), feed_class, operation, operation_kwargs)
 
 
 @shared_task
-def fanout_operation_hi_priority(feed_manager, feed_class, user_ids, operation, operation_kwargs):
-    return fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs)
+def fanout_operation_hi_priority(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+                                 fanout_priority=None, enqueued_at=None, started_at=None,
+                                 fanout_id=None):
+    return fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+                            fanout_priority=fanout_priority, enqueued_at=enqueued_at,
+                            started_at=started_at, fanout_id=fanout_id)
+
+
+@shared_task
+def fanout_operation_low_priority(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+                                  fanout_priority=None, enqueued_at=None, started_at=None,
+                                  fanout_id=None):
+    return fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs,
+                            fanout_priority=fanout_priority, enqueued_at=enqueued_at,
+                            started_at=started_at, fanout_id=fanout_id)
+
+
+@shared_task
+def fanout_coordinator(feed_manager, user_id, operation, operation_kwargs, started_at=None,
+                       fanout_id=None, feed_class_keys=None):
+    '''
+    Creates the fanout tasks for all followers of user_id,
+    used for the hierarchical fanout of users with many followers
+
+    feed_manager is either the manager or the name of a registered manager
+    '''
+    if isinstance(feed_manager, six.string_types):
+        feed_manager = get_manager_by_name(feed_manager)
+    _, operation, operation_kwargs = feed_manager.load_fanout_payload(
+        None, operation, operation_kwargs)
+    tasks = feed_manager.create_user_fanout_tasks(
+        user_id, operation, operation_kwargs, started_at=started_at,
+        fanout_id=fanout_id, feed_class_keys=feed_class_keys)
+    return "%d fanout tasks for user %r, %r" % (len(tasks), user_id, operation)
 
 
 @shared_task
-def fanout_operation_low_priority(feed_manager, feed_class, user_ids, operation, operation_kwargs):
-    return fanout_operation(feed_manager, feed_class, user_ids, operation, operation_kwargs)
+def fanout_flush(feed_manager, user_id):
+    '''
+    Runs a single fanout for the activities buffered for user_id,
+    see Manager.fanout_coalesce_window
+
+    feed_manager is either the manager or the name of a registered manager
+    '''
+    if isinstance(feed_manager, six.string_types):
+        feed_manager = get_manager_by_name(feed_manager)
+    activities = feed_manager.flush_fanout_buffer(user_id)
+    return "flushed %d activities for user %r" % (len(activities), user_id)
 
 
 @shared_task
 def follow_many(feed_manager, user_id, target_ids, follow_limit):
     feeds = feed_manager.get_feeds(user_id).values()
-    target_feeds = map(feed_manager.get_user_feed, target_ids)
-
+    # read the timelines of all targets at once, without hydrating them
     activities = []
-    for target_feed in target_feeds:
-        activities += target_feed[:follow_limit]
+    for target_activities in feed_manager.get_user_feed_slices(target_ids, 0, follow_limit):
+        activities += target_activities
 
     if activities:
+        user_feed = feed_manager.get_user_feed(user_id)
+        hydrated_activities = None
         for feed in feeds:
+            feed_activities = activities
+            if not feed.timeline_stores_ids() and user_feed.needs_hydration(activities):
+                # feeds storing the activity data need the full activities
+                if hydrated_activities is None:
+                    hydrated_activities = user_feed.hydrate_activities(activities)
+                feed_activities = hydrated_activities
             with feed.get_timeline_batch_interface() as batch_interface:
-                feed.add_many(activities, batch_interface=batch_interface)
+                feed.add_many(feed_activities, batch_interface=batch_interface)
 
 
 @shared_task
@@ -42,13 +99,32 @@ def unfollow_many(feed_manager, user_id, source_ids):
     for feed in feed_manager.get_feeds(user_id).values():
         activities = []
         feed.trim()
-        for item in feed[:feed.max_length]:
-            if isinstance(item, Activity):
-                if item.actor_id in source_ids:
-                    activities.append(item)
-            elif isinstance(item, AggregatedActivity):
-                activities.extend(
-                    [activity for activity in item.activities if activity.actor_id in source_ids])
+        if feed_manager.user_feed_actor_index and feed.timeline_stores_ids():
+            # the user feeds of the sources tell which activity ids to remove
+            # so the feed is read without hydrating the activities
+            feed_activities = feed.timeline_storage.get_slice(
+                feed.key, 0, feed.max_length)
+            if not feed_activities:
+                continue
+            filter_kwargs = None
+            if feed_manager.user_feed_class.filtering_supported:
+                oldest_id = min(long_t(a.serialization_id) for a in feed_activities)
+                filter_kwargs = dict(activity_id__gte=oldest_id)
+            source_activity_ids = set()
+            for source_activities in feed_manager.get_user_feed_slices(
+                    source_ids, 0, None, filter_kwargs=filter_kwargs):
+                source_activity_ids.update(
+                    long_t(a.serialization_id) for a in source_activities)
+            activities = [a for a in feed_activities
+                          if long_t(a.serialization_id) in source_activity_ids]
+        else:
+            for item in feed[:feed.max_length]:
+                if isinstance(item, Activity):
+                    if item.actor_id in source_ids:
+                        activities.append(item)
+                elif isinstance(item, AggregatedActivity):
+                    activities.extend(
+                        [activity for activity in item.activities if activity.actor_id in source_ids])
 
         if activities:
             feed.remove_many(activities)
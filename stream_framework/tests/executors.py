@@ -0,0 +1,176 @@
+from stream_framework.executors.celery import CeleryFanoutExecutor
+from stream_framework.executors.process import ProcessPoolFanoutExecutor
+from stream_framework.feed_managers.registry import register
+from stream_framework.tests.managers.memory import InMemoryManager
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+from mock import Mock, patch
+import datetime
+import multiprocessing
+import sys
+import threading
+import time
+import unittest
+
+try:
+    from stream_framework.executors.asyncio import AsyncioFanoutExecutor
+except SyntaxError:
+    # async def needs python 3.5
+    AsyncioFanoutExecutor = None
+
+
+@register
+class ProcessTestManager(InMemoryManager):
+    name = 'process_test'
+
+
+@register
+class FailingProcessTestManager(InMemoryManager):
+    name = 'process_test_failing'
+
+    def fanout(self, *args, **kwargs):
+        raise RuntimeError('boom')
+
+
+class CeleryFanoutExecutorTest(unittest.TestCase):
+
+    def test_submit(self):
+        task = Mock()
+        CeleryFanoutExecutor().submit(task, user_ids=(1, 2))
+        task.delay.assert_called_once_with(user_ids=(1, 2))
+
+    def test_submit_task(self):
+        task = Mock()
+        CeleryFanoutExecutor().submit_task(task, countdown=1, user_id=1)
+        task.apply_async.assert_called_once_with(kwargs=dict(user_id=1), countdown=1)
+
+
+@unittest.skipIf(AsyncioFanoutExecutor is None, 'needs python 3.5')
+class AsyncioFanoutExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = AsyncioFanoutExecutor(concurrency=4, max_pending=2)
+        self.manager = InMemoryManager()
+        self.manager.fanout_executor = self.executor
+        self.manager.fanout_chunk_size = 2
+        self.follower_ids = list(range(100, 110))
+        pin = Pin(id=1, created_at=datetime.datetime.now())
+        self.activity = FakeActivity(42, LoveVerb, pin, 1, datetime.datetime.now(), {})
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.manager.get_user_feed(42).delete()
+        for user_id in self.follower_ids:
+            for feed in self.manager.get_feeds(user_id).values():
+                feed.delete()
+
+    def test_fanout(self):
+        with patch.object(self.manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            self.manager.add_user_activity(42, self.activity)
+        self.executor.wait()
+        for user_id in self.follower_ids:
+            for feed in self.manager.get_feeds(user_id).values():
+                self.assertEqual(feed[:], [self.activity])
+        # 5 chunks for both feed classes
+        self.assertEqual(self.executor.chunk_count, 10)
+        self.assertEqual(self.executor.write_count, 20)
+        self.assertTrue(self.executor.get_throughput() > 0)
+
+    def test_failed_chunk(self):
+        with patch.object(self.manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            with patch.object(self.manager, 'fanout', side_effect=RuntimeError('boom')):
+                self.manager.add_user_activity(42, self.activity)
+                self.assertRaises(RuntimeError, self.executor.wait)
+        # the errors are only raised once
+        self.executor.wait()
+
+    def test_hierarchical_fanout(self):
+        self.manager.hierarchical_fanout_threshold = 2
+        with patch.object(self.manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            with patch.object(self.manager, 'get_user_follower_count',
+                              return_value=len(self.follower_ids)):
+                self.manager.add_user_activity(42, self.activity)
+        self.executor.wait()
+        # the coordinator ran in process
+        for user_id in self.follower_ids:
+            for feed in self.manager.get_feeds(user_id).values():
+                self.assertEqual(feed[:], [self.activity])
+
+    def test_flush_task(self):
+        self.manager.fanout_coalesce_window = 0.01
+        with patch.object(self.manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            self.manager.add_user_activity(42, self.activity)
+            # the flush runs in a timer thread
+            self.executor.wait()
+        for user_id in self.follower_ids:
+            for feed in self.manager.get_feeds(user_id).values():
+                self.assertEqual(feed[:], [self.activity])
+
+    def test_concurrency(self):
+        executor = AsyncioFanoutExecutor(concurrency=2, max_pending=10)
+        self.addCleanup(executor.shutdown)
+        lock = threading.Lock()
+        running = []
+        counts = []
+
+        def run_fanout(**kwargs):
+            with lock:
+                running.append(kwargs)
+                counts.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(kwargs)
+
+        with patch('stream_framework.executors.asyncio.run_fanout', side_effect=run_fanout):
+            for user_id in range(8):
+                executor.submit(None, feed_class=None, user_ids=[user_id])
+            executor.wait()
+        # the thread pool limits the running chunks
+        self.assertEqual(len(counts), 8)
+        self.assertEqual(max(counts), 2)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'needs python 3.7')
+class ProcessPoolFanoutExecutorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = ProcessPoolFanoutExecutor(
+            processes=2, mp_context=multiprocessing.get_context('fork'))
+        self.follower_ids = list(range(100, 110))
+        pin = Pin(id=1, created_at=datetime.datetime.now())
+        self.activity = FakeActivity(42, LoveVerb, pin, 1, datetime.datetime.now(), {})
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def get_manager(self, manager_class):
+        manager = manager_class()
+        manager.fanout_executor = self.executor
+        manager.fanout_chunk_size = 2
+        return manager
+
+    def test_batch_import(self):
+        manager = self.get_manager(ProcessTestManager)
+        with patch.object(manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            manager.batch_import(42, [self.activity])
+        self.executor.wait()
+        # the workers write to their own in memory storage,
+        # 5 chunks for both feed classes
+        stats = self.executor.get_stats()
+        self.assertEqual(stats['chunks'], 10)
+        self.assertEqual(stats['writes'], 20)
+        self.assertTrue(stats['writes_per_second'] > 0)
+        manager.get_user_feed(42).delete()
+
+    def test_failed_chunk(self):
+        manager = self.get_manager(FailingProcessTestManager)
+        with patch.object(manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            manager.add_user_activity(42, self.activity)
+        self.assertRaises(RuntimeError, self.executor.wait)
+        manager.get_user_feed(42).delete()
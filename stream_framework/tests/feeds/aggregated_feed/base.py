@@ -150,6 +150,25 @@ class TestAggregatedFeed(unittest.TestCase):
         assert len(self.test_feed[:10]) == 1
         assert len(self.test_feed[:10][0].activities) == 1
 
+    @implementation
+    def test_dangling_activity(self):
+        if self.test_feed.activity_storage is None:
+            self.skipTest('%s stores the activities in the timeline' %
+                          self.test_feed.__class__.__name__)
+        activities = self.activities[:2]
+        for activity in activities:
+            self.test_feed.insert_activity(activity)
+            self.test_feed.add(activity)
+        # the activity is gone from the activity storage, not from the timeline
+        self.test_feed.remove_activity(activities[0])
+        assert len(self.test_feed[:10]) == 1
+        assert self.test_feed[:10][0].activities == [activities[1]]
+        self.test_feed.remove_activity(activities[1])
+        assert len(self.test_feed[:10]) == 0
+        # removing the dangling activities cleans up the timeline
+        self.test_feed.remove(activities[0])
+        self.assertEqual(self.test_feed.count(), 0)
+
     @implementation
     def test_large_remove_activity(self):
         # first built a large feed
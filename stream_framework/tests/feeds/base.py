@@ -1,4 +1,4 @@
-from stream_framework.feeds.base import BaseFeed
+from stream_framework.feeds.base import BaseFeed, get_feed_slices
 from stream_framework.tests.utils import FakeActivity
 from stream_framework.tests.utils import Pin
 from stream_framework.verbs.base import Love as LoveVerb
@@ -188,6 +188,24 @@ class TestBaseFeed(unittest.TestCase):
         self.test_feed.trim(10)
         self.assertEqual(self.test_feed.count(), 10)
 
+    @implementation
+    def test_add_many_trims_on_write(self):
+        if not self.test_feed.timeline_storage.trims_on_write:
+            self.skipTest('%s does not trim on write' %
+                          self.test_feed.timeline_storage.__class__.__name__)
+        now = datetime.datetime.now()
+        activities = [self.activity_class(
+            i, LoveVerb, i, i, now - datetime.timedelta(seconds=i), {})
+            for i in range(15)]
+        self.test_feed.insert_activities(activities)
+        self.test_feed.max_length = 10
+        self.test_feed.add_many(activities)
+        # the feed is capped by the write itself, the newest activities stay
+        self.assertEqual(self.test_feed.count(), 10)
+        self.assertEqual(self.test_feed[:10], activities[:10])
+        self.test_feed.add_many(activities[10:], trim=False)
+        self.assertEqual(self.test_feed.count(), 15)
+
     def _check_order(self, activities):
         serialization_id = [a.serialization_id for a in activities]
         assert serialization_id == sorted(serialization_id, reverse=True)
@@ -240,6 +258,20 @@ class TestBaseFeed(unittest.TestCase):
         activity_read = self.test_feed[0][0]
         self.assertEqual(activity_read, activity)
 
+    @implementation
+    def test_feed_dangling_activity(self):
+        now = datetime.datetime.now()
+        activities = [
+            self.activity_class(1, LoveVerb, x, x, now - datetime.timedelta(seconds=x))
+            for x in range(3)]
+        self.test_feed.insert_activities(activities)
+        self.test_feed.add_many(activities)
+        # the activity is gone from the activity storage, not from the timeline
+        self.test_feed.remove_activity(activities[1])
+        results = self.test_feed[:10]
+        self.assertEqual(len(results), 2)
+        self.assertNotIn(activities[1], results)
+
     @implementation
     def test_feed_slice(self):
         activity_dict = {}
@@ -311,6 +343,49 @@ class TestBaseFeed(unittest.TestCase):
         filtered_results = feed[:]
         self.assertEquals(filtered_results, self.test_feed[:4])
 
+    @implementation
+    def test_feed_pull_feeds(self):
+        if not self.test_feed.pull_merging_supported:
+            self.skipTest('%s does not support pull feeds' %
+                          self.test_feed.__class__.__name__)
+        pull_feed = self.feed_cls(self.user_id + 1)
+        self.addCleanup(pull_feed.delete)
+        activities = []
+        for i in range(10):
+            activities.append(self.activity_class(
+                i, LoveVerb, i, i, time=datetime.datetime.now() - datetime.timedelta(seconds=i))
+            )
+        self.test_feed.insert_activities(activities)
+        self.test_feed.add_many(activities[::2])
+        # activities present in both feeds are returned once
+        pull_feed.add_many(activities[1::2] + activities[:1])
+        feed = self.test_feed.with_pull_feeds([pull_feed])
+        self.assertEqual(feed[:], activities)
+        self.assertEqual(feed[3:6], activities[3:6])
+        self.assertEqual(self.test_feed.count(), 5)
+        if feed.filtering_supported:
+            offset = activities[4].serialization_id
+            self.assertEqual(
+                feed.filter(activity_id__lt=offset)[:3], activities[5:8])
+
+    @implementation
+    def test_get_feed_slices(self):
+        other_feed = self.feed_cls(self.user_id + 1)
+        self.addCleanup(other_feed.delete)
+        self.test_feed.insert_activities(self.activities)
+        self.test_feed.add_many(self.activities)
+        other_feed.add_many(self.activities[:4])
+        expected = [self.test_feed[:5], other_feed[2:], self.test_feed[:0]]
+        activity_storage = self.test_feed.activity_storage
+        with patch.object(activity_storage.__class__, 'get_many',
+                          autospec=True, side_effect=activity_storage.__class__.get_many) as get_many:
+            slices = get_feed_slices([
+                (self.test_feed, 0, 5), (other_feed, 2, None), (self.test_feed, 0, 0)])
+            self.assertEqual(slices, expected)
+            if self.test_feed.needs_hydration(other_feed.timeline_storage.get_slice(other_feed.key, 0, 1)):
+                # the slices were hydrated at once
+                self.assertEqual(get_many.call_count, 1)
+
     def setup_ordering(self):
         if not self.test_feed.ordering_supported:
             self.skipTest('%s does not support ordering' %
@@ -1,6 +1,70 @@
 from stream_framework.tests.feeds.base import TestBaseFeed
 from stream_framework.feeds.memory import Feed
+from stream_framework.storage.head_page_cache import HeadPageCache
+from stream_framework.verbs.base import Love as LoveVerb
+from mock import patch
+import datetime
 
 
 class InMemoryBaseFeed(TestBaseFeed):
     feed_cls = Feed
+
+
+class HeadPageFeed(Feed):
+    head_page_cache = HeadPageCache(size=5)
+
+
+class InMemoryHeadPageFeed(TestBaseFeed):
+    feed_cls = HeadPageFeed
+
+    def test_head_page(self):
+        now = datetime.datetime.now()
+        activities = [
+            self.activity_class(1, LoveVerb, x, x, now - datetime.timedelta(seconds=x))
+            for x in range(6)]
+        self.test_feed.insert_activities(activities)
+        self.test_feed.add_many(activities[:3])
+        self.assertEqual(len(self.test_feed[:5]), 3)
+        timeline_storage = self.test_feed.timeline_storage
+        # the first page is cached, the slices further down aren't
+        with patch.object(timeline_storage, 'get_slice', wraps=timeline_storage.get_slice) as get_slice:
+            self.assertEqual(self.test_feed[:2], self.test_feed[:5][:2])
+            self.assertFalse(get_slice.called)
+            self.test_feed[2:4]
+            self.assertTrue(get_slice.called)
+        # adding activities invalidates it
+        self.test_feed.add_many(activities[3:])
+        self.assertEqual(len(self.test_feed[:5]), 5)
+        self.test_feed.remove_many(activities[3:])
+        self.assertEqual(len(self.test_feed[:5]), 3)
+
+    def test_head_page_version(self):
+        head_page_cache = self.feed_cls.head_page_cache
+        activities, version = head_page_cache.get_with_version(self.test_feed)
+        self.assertEqual(activities, None)
+        # a page read before the feed changed isn't cached
+        self.test_feed.invalidate_head_page()
+        head_page_cache.set(self.test_feed, [], version=version)
+        self.assertEqual(head_page_cache.get(self.test_feed), None)
+        activities, version = head_page_cache.get_with_version(self.test_feed)
+        head_page_cache.set(self.test_feed, [], version=version)
+        self.assertEqual(head_page_cache.get(self.test_feed), [])
+
+    def test_head_page_batch(self):
+        activity = self.activity_class(1, LoveVerb, 1, 1, datetime.datetime.now())
+        self.test_feed.insert_activities([activity])
+        head_page_cache = self.feed_cls.head_page_cache
+        with self.test_feed.get_timeline_batch_interface() as batch_interface:
+            self.test_feed.add_many([activity], batch_interface=batch_interface)
+            self.test_feed[:5]
+            self.assertNotEqual(head_page_cache.get(self.test_feed), None)
+        # invalidated once the batch executed
+        self.assertEqual(head_page_cache.get(self.test_feed), None)
+
+    def test_head_page_capacity(self):
+        head_page_cache = HeadPageCache(size=5, capacity=1)
+        other_feed = self.feed_cls(self.test_feed.user_id + 1)
+        head_page_cache.set(self.test_feed, [])
+        head_page_cache.set(other_feed, [])
+        self.assertEqual(head_page_cache.get(self.test_feed), None)
+        self.assertEqual(head_page_cache.get(other_feed), [])
@@ -1,7 +1,17 @@
 from stream_framework.tests.feeds.base import TestBaseFeed, implementation
-from stream_framework.feeds.redis import RedisFeed
+from stream_framework.feeds.redis import CompactRedisFeed, RedisClusterFeed, RedisFeed, \
+    RedisListFeed
+from stream_framework.feeds.base import get_feed_slices
+from stream_framework.feeds.aggregated_feed.notification_feed import RedisNotificationFeed
+from stream_framework.storage.head_page_cache import RedisHeadPageCache, deferred_invalidations
+from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage
+from stream_framework.storage.redis.connection import get_redis_connection
 from stream_framework.activity import Activity
 from stream_framework.utils import datetime_to_epoch
+from contextlib import contextmanager
+from mock import patch
+import pytest
+import unittest
 
 
 class CustomActivity(Activity):
@@ -52,3 +62,128 @@ class TestCustomRedisFeed(TestBaseFeed):
         assert self.activity == self.test_feed[:10][0]
         assert type(self.activity) == type(self.test_feed[0][0])
         # make sure nothing is wrong with the activity storage
+
+
+class ServerSideHydrationRedisFeed(RedisFeed):
+    server_side_hydration = True
+
+
+class TestServerSideHydrationRedisFeed(TestBaseFeed):
+
+    '''
+    Runs the feed tests with the slices hydrated by the lua script
+    '''
+    feed_cls = ServerSideHydrationRedisFeed
+
+    def test_use_server_side_hydration(self):
+        assert self.test_feed.use_server_side_hydration()
+        assert not RedisFeed(self.user_id).use_server_side_hydration()
+
+
+class HeadPageRedisFeed(RedisFeed):
+    head_page_cache = RedisHeadPageCache(size=5)
+
+
+class TestHeadPageRedisFeed(TestBaseFeed):
+
+    '''
+    Runs the feed tests with the first pages read from the head page cache
+    '''
+    feed_cls = HeadPageRedisFeed
+
+
+class HeadPageInvalidationTest(unittest.TestCase):
+
+    def test_join_batch(self):
+        feed = HeadPageRedisFeed(13)
+        pipe = get_redis_connection().pipeline(transaction=False)
+        self.assertTrue(feed.head_page_cache.joins_batch(feed, pipe))
+        feed.invalidate_head_page(batch_interface=pipe)
+        commands = [args[:2] for args, options in pipe.command_stack]
+        self.assertEqual(commands, [
+            ('SET', feed.head_page_cache.get_version_key(feed)),
+            ('DEL', feed.head_page_cache.get_key(feed))])
+
+    def test_defer_to_other_server(self):
+        feed = HeadPageRedisFeed(13)
+        pipe = get_redis_connection().pipeline(transaction=False)
+        with patch.object(feed, 'get_timeline_batch_interface_key', return_value=('redis', 'other')):
+            with patch('stream_framework.storage.head_page_cache.RedisHeadPageCache.invalidate') as invalidate:
+                with deferred_invalidations(contextmanager(lambda: iter([pipe]))()):
+                    feed.invalidate_head_page(batch_interface=pipe)
+                    self.assertFalse(invalidate.called)
+                # after the batch
+                invalidate.assert_called_once_with(feed)
+
+    def test_flush_namespace(self):
+        feed = HeadPageRedisFeed(13)
+        caches = [RedisHeadPageCache(size=5, namespace=namespace)
+                  for namespace in ('flush_a', 'flush_b')]
+        for cache in caches:
+            self.addCleanup(cache.flush)
+            cache.invalidate(feed)
+            cache.set(feed, [])
+        redis = get_redis_connection()
+        caches[0].flush()
+        # only the keys of the namespace are removed
+        self.assertEqual(redis.exists(caches[0].get_key(feed)), 0)
+        self.assertEqual(redis.exists(caches[0].get_version_key(feed)), 0)
+        self.assertEqual(caches[1].get(feed), [])
+        self.assertEqual(redis.exists(caches[1].get_version_key(feed)), 1)
+
+    def test_feed_without_activity_storage(self):
+        feed_class = type('HeadPageNotificationFeed', (RedisNotificationFeed,), dict(
+            head_page_cache=RedisHeadPageCache(size=5)))
+        with self.assertRaises(ValueError):
+            feed_class(13)
+
+
+class ClusterRedisFeed(RedisClusterFeed):
+    redis_servers = ('cluster_1', 'cluster_2')
+
+
+@pytest.mark.usefixtures("redis_cluster")
+class TestRedisClusterFeed(TestBaseFeed):
+
+    '''
+    Runs the feed tests with the keys spread over two servers
+    '''
+    feed_cls = ClusterRedisFeed
+
+
+class TestCompactRedisFeed(TestBaseFeed):
+
+    '''
+    Runs the feed tests with the ids stored as compact members
+    '''
+    feed_cls = CompactRedisFeed
+
+
+class TestRedisListFeed(TestBaseFeed):
+
+    '''
+    Runs the feed tests with the timelines stored as lists
+    '''
+    feed_cls = RedisListFeed
+
+
+class FeedSlicesTest(unittest.TestCase):
+
+    def test_mixed_storages(self):
+        feeds = [RedisFeed(13), CompactRedisFeed(14), RedisListFeed(15), RedisFeed(16)]
+        reads = []
+
+        def get_many_slices_from_storage(storage, requests):
+            reads.append((type(storage), [request[0] for request in requests]))
+            return [[] for request in requests]
+
+        with patch.object(RedisTimelineStorage, 'get_many_slices_from_storage',
+                          autospec=True, side_effect=get_many_slices_from_storage):
+            slices = get_feed_slices([(feed, 0, 5) for feed in feeds], rehydrate=False)
+        self.assertEqual(slices, [[]] * 4)
+        # every storage class reads its own timelines
+        self.assertEqual(sorted(reads, key=lambda read: read[1]), sorted([
+            (RedisTimelineStorage, [feeds[0].key, feeds[3].key]),
+            (type(feeds[1].timeline_storage), [feeds[1].key]),
+            (type(feeds[2].timeline_storage), [feeds[2].key]),
+        ], key=lambda read: read[1]))
@@ -0,0 +1,42 @@
+from stream_framework.feed_managers.active_users import ActiveUserTracker
+from mock import patch
+import unittest
+
+
+class ActiveUserTrackerTest(unittest.TestCase):
+
+    def test_mark_active(self):
+        tracker = ActiveUserTracker(period=10, periods=2)
+        with patch('time.time', return_value=100):
+            # users without history count as active
+            self.assertTrue(tracker.is_active(1))
+            self.assertTrue(tracker.mark_active(1))
+            self.assertEqual(tracker.get_active([1, 2]), set([1, 2]))
+        with patch('time.time', return_value=120):
+            self.assertEqual(tracker.get_active([1, 2]), set([2]))
+            self.assertFalse(tracker.mark_active(1))
+            self.assertTrue(tracker.mark_active(1))
+
+    def test_inactive_after_periods(self):
+        tracker = ActiveUserTracker(period=10, periods=2)
+        with patch('time.time', return_value=100):
+            tracker.mark_active(1)
+        with patch('time.time', return_value=119):
+            self.assertTrue(tracker.is_active(1))
+        with patch('time.time', return_value=120):
+            self.assertFalse(tracker.is_active(1))
+
+    def test_capacity(self):
+        tracker = ActiveUserTracker(period=10, periods=2, capacity=2, ttl=100)
+        with patch('time.time', return_value=100):
+            tracker.mark_active(1)
+            tracker.mark_active(2)
+        with patch('time.time', return_value=120):
+            self.assertEqual(tracker.get_active([1, 2]), set())
+            tracker.mark_active(3)
+            # the least recently used user is forgotten and has no history
+            self.assertEqual(tracker.get_active([1, 2]), set([1]))
+            self.assertEqual(len(tracker.last_periods), 2)
+        with patch('time.time', return_value=300):
+            # so is a user after the ttl
+            self.assertTrue(tracker.is_active(2))
@@ -1,11 +1,18 @@
 import datetime
-from stream_framework.feed_managers.base import Manager
+from stream_framework.feed_managers.active_users import ActiveUserTracker
+from stream_framework.feed_managers.base import FanoutPriority, Manager, add_operation
+from stream_framework.feed_managers.cost_tracker import FanoutCostTracker
+from stream_framework.feed_managers.registry import register
+from stream_framework.feed_managers.scheduler import FanoutScheduler
+from stream_framework.feeds.base import BaseFeed
 from stream_framework.tests.utils import Pin
 from stream_framework.tests.utils import FakeActivity
 from stream_framework.verbs.base import Love as LoveVerb
 from mock import patch
 import unittest
 import copy
+import pickle
+import time
 from functools import partial
 
 
@@ -19,6 +26,7 @@ def implementation(meth):
 
 class BaseManagerTest(unittest.TestCase):
     manager_class = Manager
+    aggregated_feed_class = None
 
     def setUp(self):
         self.manager = self.manager_class()
@@ -113,6 +121,315 @@ class BaseManagerTest(unittest.TestCase):
             for f in self.manager.get_feeds(follower).values():
                 assert f.count() == 1
 
+    @implementation
+    def test_add_user_activity_combined_fanout(self):
+        self.manager.combined_feed_fanout = True
+        followers = {None: [1, 2, 3]}
+
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=followers):
+            with patch.object(self.manager, 'fanout', wraps=self.manager.fanout) as fanout:
+                self.manager.add_user_activity(self.actor_id, self.activity)
+
+        # one task handles all the feed classes for the chunk of followers
+        self.assertEqual(fanout.call_count, 1)
+        feed_classes = fanout.call_args[0][1]
+        self.assertEqual(
+            set(feed_classes), set(self.manager.feed_classes.values()))
+        for follower in followers[None]:
+            for f in self.manager.get_feeds(follower).values():
+                self.assertEqual(f.count(), 1)
+
+    @implementation
+    def test_fanout_batches(self):
+        feed_classes = list(self.manager.feed_classes.values())
+        batches = self.manager.get_fanout_batches(feed_classes)
+        self.assertEqual(sum(batches, []), feed_classes)
+
+    def get_registered_manager(self, **attrs):
+        attrs.setdefault('name', 'test_%s' % self.manager_class.__name__)
+        manager_class = type(
+            'Registered%s' % self.manager_class.__name__, (self.manager_class,), attrs)
+        return register(manager_class)()
+
+    @implementation
+    def test_compact_fanout_payload(self):
+        manager = self.get_registered_manager()
+        feed_class = list(manager.feed_classes.values())[0]
+        operation_kwargs = dict(activities=[self.activity], trim=True)
+        payload = manager.get_fanout_payload(
+            feed_class, add_operation, operation_kwargs)
+        feed_manager, feed_class_key, operation, compact_kwargs = payload
+        self.assertEqual(feed_manager, manager.name)
+        self.assertEqual(manager.feed_classes[feed_class_key], feed_class)
+        self.assertEqual(operation, 'add')
+        self.assertNotIn('activities', compact_kwargs)
+        # the compact payload is cheaper to send to the broker
+        full_payload = (self.manager, feed_class, add_operation, operation_kwargs)
+        self.assertLess(
+            len(pickle.dumps(payload)), len(pickle.dumps(full_payload)))
+
+        # the user feed stores ids, so only the ids are sent
+        self.assertEqual(
+            compact_kwargs['activity_ids'], [self.activity.serialization_id])
+        self.assertLess(len(pickle.dumps(payload)) * 4, len(pickle.dumps(full_payload)))
+
+        loaded = manager.load_fanout_payload(
+            feed_class_key, operation, compact_kwargs)
+        self.assertEqual(loaded[0], feed_class)
+        self.assertEqual(loaded[1], add_operation)
+        self.assertEqual(
+            [a.serialization_id for a in loaded[2]['activities']],
+            [self.activity.serialization_id])
+
+    @implementation
+    def test_serialized_fanout_payload(self):
+        manager = self.get_registered_manager(
+            fanout_activity_payload='serialized',
+            name='test_%s_serialized_payload' % self.manager_class.__name__)
+        feed_class = list(manager.feed_classes.values())[0]
+        operation_kwargs = dict(activities=[self.activity], trim=True)
+        payload = manager.get_fanout_payload(
+            feed_class, add_operation, operation_kwargs)
+        loaded = manager.load_fanout_payload(*payload[1:])
+        self.assertEqual(loaded[2]['activities'], [self.activity])
+
+    @implementation
+    def test_add_user_activity_compact_fanout(self):
+        for activity_payload in ('serialized', 'ids', None):
+            self.manager = self.get_registered_manager(
+                fanout_activity_payload=activity_payload,
+                name='test_%s_%s' % (self.manager_class.__name__, activity_payload))
+            followers = {None: [1, 2, 3]}
+            with patch.object(self.manager, 'get_user_follower_ids', return_value=followers):
+                self.manager.add_user_activity(self.actor_id, self.activity)
+            for follower in followers[None]:
+                for f in self.manager.get_feeds(follower).values():
+                    self.assertEqual(f.count(), 1)
+                    self.assertEqual(f[:1], [self.activity])
+                    f.delete()
+
+    @implementation
+    def test_hierarchical_fanout(self):
+        self.manager.hierarchical_fanout_threshold = 2
+        followers = {None: [1, 2, 3]}
+
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=followers) as get_user_follower_ids:
+            with patch.object(self.manager, 'get_user_follower_count', return_value=3):
+                with patch.object(self.manager, 'fanout_coordinator_task',
+                                  wraps=self.manager.fanout_coordinator_task) as coordinator:
+                    self.manager.add_user_activity(self.actor_id, self.activity)
+                    # the tasks were created by the coordinator
+                    self.assertEqual(coordinator.apply_async.call_count, 1)
+            # the follower ids are only loaded to create the fanout tasks
+            self.assertEqual(get_user_follower_ids.call_count, 1)
+
+        for follower in followers[None]:
+            for f in self.manager.get_feeds(follower).values():
+                self.assertEqual(f.count(), 1)
+
+    @implementation
+    def test_use_hierarchical_fanout(self):
+        with patch.object(self.manager, 'get_user_follower_count', return_value=3):
+            self.assertFalse(self.manager.use_hierarchical_fanout(self.actor_id))
+            self.manager.hierarchical_fanout_threshold = 3
+            self.assertFalse(self.manager.use_hierarchical_fanout(self.actor_id))
+            self.manager.hierarchical_fanout_threshold = 2
+            self.assertTrue(self.manager.use_hierarchical_fanout(self.actor_id))
+        # the follower count needs a cheap query, not the follower ids
+        with self.assertRaises(NotImplementedError):
+            self.manager.use_hierarchical_fanout(self.actor_id)
+
+    @implementation
+    def test_follower_count_once(self):
+        self.manager.hierarchical_fanout_threshold = 2
+        self.manager.pull_fanout_threshold = 10
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1, 2, 3]}):
+            with patch.object(self.manager, 'get_user_follower_count', return_value=3) as get_user_follower_count:
+                self.manager.add_user_activity(self.actor_id, self.activity)
+                # both fanout decisions use the same count
+                self.assertEqual(get_user_follower_count.call_count, 1)
+        for f in self.manager.get_feeds(1).values():
+            self.assertEqual(f.count(), 1)
+
+    @implementation
+    def test_pull_fanout(self):
+        self.manager.pull_fanout_threshold = 2
+        # aggregated feeds can't merge the pulled user feeds
+        self.manager.feed_classes = dict(
+            self.manager.feed_classes, aggregated=self.aggregated_feed_class)
+        aggregated_feed = self.aggregated_feed_class(1)
+        aggregated_feed.delete()
+        self.addCleanup(aggregated_feed.delete)
+        pushed_activity = FakeActivity(
+            17, LoveVerb, self.pin, 2, datetime.datetime.now() - datetime.timedelta(hours=1), {})
+
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            with patch.object(self.manager, 'get_user_follower_count', return_value=3):
+                self.manager.add_user_activity(self.actor_id, self.activity)
+            with patch.object(self.manager, 'get_user_follower_count', return_value=1):
+                self.manager.add_user_activity(17, pushed_activity)
+
+        feeds = self.manager.get_feeds(1)
+        # the author has too many followers for a fanout to the other feeds
+        for name, f in feeds.items():
+            if name != 'aggregated':
+                self.assertEqual(f[:], [pushed_activity])
+        # the aggregated feed still gets the activities
+        self.assertTrue(feeds['aggregated'].contains(self.activity))
+        self.assertTrue(feeds['aggregated'].contains(pushed_activity))
+        with patch.object(self.manager, 'get_user_pull_ids', return_value=[self.actor_id]):
+            read_feeds = self.manager.get_read_feeds(1)
+            for name, f in read_feeds.items():
+                if name != 'aggregated':
+                    self.assertEqual(f[:], [self.activity, pushed_activity])
+                    self.assertEqual(f[1:2], [pushed_activity])
+
+    @implementation
+    def test_pull_fanout_batch_import(self):
+        self.manager.pull_fanout_threshold = 2
+        self.manager.feed_classes = dict(
+            self.manager.feed_classes, aggregated=self.aggregated_feed_class)
+        aggregated_feed = self.aggregated_feed_class(1)
+        aggregated_feed.delete()
+        self.addCleanup(aggregated_feed.delete)
+
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            with patch.object(self.manager, 'get_user_follower_count', return_value=3):
+                self.manager.batch_import(self.actor_id, [self.activity], 10)
+        feeds = self.manager.get_feeds(1)
+        for name, f in feeds.items():
+            if name != 'aggregated':
+                self.assertEqual(f.count(), 0)
+        self.assertTrue(feeds['aggregated'].contains(self.activity))
+
+    @implementation
+    def test_inactive_followers(self):
+        tracker = ActiveUserTracker()
+        self.manager.active_user_tracker = tracker
+        tracker.mark_active(1)
+        # user 2 was last seen before the last periods, user 3 was never seen
+        with patch('time.time', return_value=time.time() - tracker.period * tracker.periods):
+            tracker.mark_active(2)
+
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1, 2, 3]}):
+            self.manager.add_user_activity(self.actor_id, self.activity)
+        for user_id in [1, 3]:
+            for f in self.manager.get_feeds(user_id).values():
+                self.assertEqual(f.count(), 1)
+        # the fanout skipped the inactive users
+        for f in self.manager.get_feeds(2).values():
+            self.assertEqual(f.count(), 0)
+
+        # users without history don't get their feeds rebuilt
+        with patch.object(self.manager, 'rebuild_feeds') as rebuild_feeds:
+            self.manager.get_read_feeds(3)
+            self.assertFalse(rebuild_feeds.called)
+
+        with patch.object(self.manager, 'get_user_following_ids', return_value=[self.actor_id]):
+            # returning users get their feeds rebuilt on the first read
+            for f in self.manager.get_read_feeds(2).values():
+                self.assertEqual(f.count(), 1)
+            self.assertTrue(self.manager.active_user_tracker.is_active(2))
+            with patch.object(self.manager, 'rebuild_feeds') as rebuild_feeds:
+                self.manager.get_read_feeds(2)
+                self.assertFalse(rebuild_feeds.called)
+
+    @implementation
+    def test_estimate_fanout(self):
+        self.manager.fanout_chunk_size = 2
+        follower_ids = {FanoutPriority.HIGH: [1, 2, 3], FanoutPriority.LOW: [4]}
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=follower_ids):
+            estimates = self.manager.estimate_fanout(self.actor_id, [self.activity])
+        self.assertEqual(set(estimates.keys()), set(self.manager.feed_classes.keys()))
+        for name, feed_class in self.manager.feed_classes.items():
+            estimate = estimates[name]
+            self.assertEqual(estimate['followers'], 4)
+            self.assertEqual(estimate['tasks'], 3)
+            self.assertTrue(estimate['commands'] >= 4)
+            self.assertTrue(estimate['bytes'] > 0)
+            # nothing was written
+            for user_id in range(1, 4):
+                self.assertEqual(feed_class(user_id).count(), 0)
+
+        self.manager.fanout_cost_tracker = FanoutCostTracker()
+        feed_class = list(self.manager.feed_classes.values())[0]
+        self.manager.fanout_cost_tracker.record(feed_class, 10, 1.0)
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=follower_ids):
+            estimates = self.manager.estimate_fanout(
+                self.actor_id, [self.activity] * 3, workers=2, chunk_size=2)
+        estimate = estimates[self.manager.get_feed_class_key(feed_class)]
+        # two batch import chunks
+        self.assertEqual(estimate['tasks'], 6)
+        self.assertAlmostEqual(estimate['seconds'], 0.4)
+
+    @implementation
+    def test_estimate_fanout_iterators(self):
+        follower_ids = {None: iter([1, 2, 3])}
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=follower_ids):
+            with patch.object(self.manager, 'get_user_follower_count', return_value=3):
+                estimates = self.manager.estimate_fanout(self.actor_id, [self.activity])
+        for estimate in estimates.values():
+            self.assertEqual(estimate['followers'], 3)
+        # the follower ids weren't consumed
+        self.assertEqual(list(follower_ids[None]), [1, 2, 3])
+
+    @implementation
+    def test_estimate_combined_fanout(self):
+        self.manager.fanout_chunk_size = 2
+        self.manager.combined_feed_fanout = True
+        follower_ids = {None: [1, 2, 3]}
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=follower_ids):
+            estimates = self.manager.estimate_fanout(self.actor_id, [self.activity])
+        # the combined tasks are only counted once
+        self.assertEqual(sum(e['tasks'] for e in estimates.values()), 2)
+
+    @implementation
+    def test_fanout_deadline(self):
+        self.manager.fanout_scheduler = FanoutScheduler(
+            deadlines={FanoutPriority.LOW: 10})
+        self.manager.user_feed_class.insert_activity(self.activity)
+        self.manager.get_user_feed(self.actor_id).add(self.activity)
+        operation_kwargs = dict(activities=[self.activity], trim=True)
+        enqueued_at = time.time() - 60
+        for feed_class in self.manager.feed_classes.values():
+            self.manager.fanout([1], feed_class, add_operation, operation_kwargs,
+                                fanout_priority=FanoutPriority.HIGH, enqueued_at=enqueued_at)
+            self.manager.fanout([2], feed_class, add_operation, operation_kwargs,
+                                fanout_priority=FanoutPriority.LOW, enqueued_at=enqueued_at)
+        for f in self.manager.get_feeds(1).values():
+            self.assertEqual(f.count(), 1)
+        # the low priority chunk missed its deadline
+        for f in self.manager.get_feeds(2).values():
+            self.assertEqual(f.count(), 0)
+
+        with patch.object(self.manager, 'get_user_following_ids', return_value=[self.actor_id]):
+            # the skipped users get their feeds rebuilt on the first read
+            for f in self.manager.get_read_feeds(2).values():
+                self.assertEqual(f.count(), 1)
+            with patch.object(self.manager, 'rebuild_feeds') as rebuild_feeds:
+                self.manager.get_read_feeds(2)
+                self.assertFalse(rebuild_feeds.called)
+
+    @implementation
+    def test_fanout_rate_limit(self):
+        self.manager.fanout_scheduler = FanoutScheduler(
+            rate_limits={FanoutPriority.LOW: (1, 1)})
+        feed_class = list(self.manager.feed_classes.values())[0]
+        operation_kwargs = dict(activities=[self.activity], trim=True)
+        self.manager.fanout([1], feed_class, add_operation, operation_kwargs,
+                            fanout_priority=FanoutPriority.LOW)
+        with patch.object(self.manager, 'fanout_executor') as executor:
+            self.manager.fanout([2], feed_class, add_operation, operation_kwargs,
+                                fanout_priority=FanoutPriority.LOW, fanout_id='a')
+            # the chunk is enqueued again instead of blocking the worker
+            self.assertEqual(executor.submit_task.call_count, 1)
+            args, kwargs = executor.submit_task.call_args
+            self.assertTrue(0 < kwargs['countdown'] <= 1)
+            self.assertEqual(kwargs['user_ids'], (2,))
+            self.assertEqual(kwargs['fanout_id'], 'a')
+        self.assertEqual(feed_class(1).count(), 1)
+        self.assertEqual(feed_class(2).count(), 0)
+
     @implementation
     def test_follow_unfollow_user(self):
         target_user_id = 17
@@ -146,10 +463,36 @@ class BaseManagerTest(unittest.TestCase):
             self.assertEqual(f.count(), 2)
 
         self.manager.unfollow_user(
-            follower_user_id, target_user_id, async=False)
+            follower_user_id, target_user_id, async_=False)
 
         # make sure only one activity was removed
         for f in self.manager.get_feeds(follower_user_id).values():
             self.assertEqual(f.count(), 1)
             activity = f[:][0]
             assert activity.object_id == self.pin.id
+
+    @implementation
+    def test_bulk_follow_unfollow_users(self):
+        self.manager.user_feed_actor_index = True
+        follower_user_id = 42
+        target_activities = {}
+        for target_user_id in (17, 44):
+            pin = Pin(id=target_user_id, created_at=datetime.datetime.now())
+            activity = FakeActivity(
+                target_user_id, LoveVerb, pin, target_user_id, datetime.datetime.now(), {})
+            target_activities[target_user_id] = activity
+            with patch.object(self.manager, 'get_user_follower_ids', return_value={}):
+                self.manager.add_user_activity(target_user_id, activity)
+
+        with patch.object(BaseFeed, 'hydrate_activities') as hydrate_activities:
+            self.manager.follow_many_users(
+                follower_user_id, [17, 44], async_=False)
+            for f in self.manager.get_feeds(follower_user_id).values():
+                self.assertEqual(f.count(), 2)
+            self.manager.unfollow_many_users(
+                follower_user_id, [17], async_=False)
+            # the activities were copied and removed by id
+            self.assertFalse(hydrate_activities.called)
+
+        for f in self.manager.get_feeds(follower_user_id).values():
+            self.assertEqual(f[:], [target_activities[44]])
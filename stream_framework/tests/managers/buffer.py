@@ -0,0 +1,87 @@
+from stream_framework.feed_managers.buffer import FanoutBuffer
+from stream_framework.tests.managers.memory import InMemoryManager
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+from mock import patch
+import datetime
+import unittest
+
+
+class FanoutBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = InMemoryManager()
+        self.manager.fanout_coalesce_window = 1
+        self.manager.fanout_coalesce_max_items = 3
+        self.manager.fanout_buffer = FanoutBuffer()
+        self.actor_id = 42
+        self.activities = []
+        for i in range(3):
+            pin = Pin(id=i, created_at=datetime.datetime.now())
+            self.activities.append(FakeActivity(
+                self.actor_id, LoveVerb, pin, i,
+                datetime.datetime.now() - datetime.timedelta(seconds=i), {}))
+
+    def tearDown(self):
+        self.manager.get_user_feed(self.actor_id).delete()
+        for feed in self.manager.get_feeds(1).values():
+            feed.delete()
+
+    def add_activities(self, activities):
+        with patch.object(self.manager, 'fanout_flush_task') as flush_task:
+            for activity in activities:
+                self.manager.add_user_activity(self.actor_id, activity)
+        return flush_task
+
+    def assert_feed_activities(self, activities):
+        for feed in self.manager.get_feeds(1).values():
+            self.assertEqual(feed[:], activities)
+
+    def test_coalesce(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            with patch.object(self.manager, 'fanout', wraps=self.manager.fanout) as fanout:
+                flush_task = self.add_activities(self.activities[:2])
+                # the first activity scheduled the flush
+                flush_task.apply_async.assert_called_once_with(
+                    kwargs=dict(feed_manager=self.manager, user_id=self.actor_id),
+                    countdown=1)
+                self.assert_feed_activities([])
+                self.manager.flush_fanout_buffer(self.actor_id)
+        # one fanout per feed class for both activities
+        self.assertEqual(fanout.call_count, len(self.manager.feed_classes))
+        self.assert_feed_activities(self.activities[:2])
+
+    def test_flush_full_buffer(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            flush_task = self.add_activities(self.activities)
+        self.assertEqual(flush_task.apply_async.call_count, 1)
+        self.assert_feed_activities(self.activities)
+
+    def test_skip_removed_activities(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            self.add_activities(self.activities[:2])
+            self.manager.remove_user_activity(self.actor_id, self.activities[0])
+            self.manager.flush_fanout_buffer(self.actor_id)
+        self.assert_feed_activities(self.activities[1:2])
+
+    def test_manager_keys(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            self.add_activities(self.activities[:1])
+            # managers sharing the buffer don't flush each others activities
+            other_manager = InMemoryManager()
+            other_manager.name = 'other'
+            other_manager.fanout_buffer = self.manager.fanout_buffer
+            self.assertEqual(other_manager.flush_fanout_buffer(self.actor_id), [])
+            self.assertEqual(self.manager.flush_fanout_buffer(self.actor_id), self.activities[:1])
+
+    def test_in_process_buffer_needs_eager_tasks(self):
+        with patch.object(self.manager, 'fanout_flush_task') as flush_task:
+            flush_task.app.conf = {}
+            self.assertRaises(
+                ValueError, self.manager.add_user_activity, self.actor_id, self.activities[0])
+
+    def test_flush_task(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1]}):
+            # tasks run eagerly during the tests
+            self.manager.add_user_activity(self.actor_id, self.activities[0])
+        self.assert_feed_activities(self.activities[:1])
@@ -1,4 +1,5 @@
 from stream_framework.feed_managers.base import Manager
+from stream_framework.feeds.aggregated_feed.cassandra import CassandraAggregatedFeed
 from stream_framework.feeds.base import UserBaseFeed
 from stream_framework.feeds.cassandra import CassandraFeed
 from stream_framework.tests.managers.base import BaseManagerTest
@@ -9,6 +10,10 @@ class CassandraUserBaseFeed(UserBaseFeed, CassandraFeed):
     pass
 
 
+class CassandraAggregatedTimelineFeed(CassandraAggregatedFeed):
+    key_format = 'aggregated_feed_%(user_id)s'
+
+
 class CassandraManager(Manager):
     feed_classes = {
         'feed': CassandraFeed
@@ -19,3 +24,4 @@ class CassandraManager(Manager):
 @pytest.mark.usefixtures("cassandra_reset")
 class RedisManagerTest(BaseManagerTest):
     manager_class = CassandraManager
+    aggregated_feed_class = CassandraAggregatedTimelineFeed
@@ -0,0 +1,87 @@
+from stream_framework.feed_managers.base import add_operation
+from stream_framework.feed_managers.checkpoint import FanoutCheckpoint
+from stream_framework.tests.managers.memory import InMemoryManager
+from mock import patch
+import unittest
+
+
+class FanoutCheckpointTest(unittest.TestCase):
+
+    def test_offsets(self):
+        checkpoint = FanoutCheckpoint()
+        self.assertEqual(checkpoint.get_offsets('fanout'), {})
+        checkpoint.set_offset('fanout', 'HIGH:feed', 100)
+        checkpoint.set_offset('fanout', 'HIGH:feed', 200)
+        self.assertEqual(checkpoint.get_offsets('fanout'), {'HIGH:feed': 200})
+        checkpoint.delete('fanout')
+        self.assertEqual(checkpoint.get_offsets('fanout'), {})
+
+
+class FakeTask(object):
+
+    def __init__(self, fail_after=None):
+        self.calls = []
+        self.fail_after = fail_after
+
+    def delay(self, **kwargs):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise RuntimeError('broker went away')
+        self.calls.append(kwargs)
+        return kwargs
+
+
+class StreamingFanoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = InMemoryManager()
+        self.manager.fanout_chunk_size = 3
+        self.operation_kwargs = dict(activities=[], trim=True)
+
+    def follower_source(self, count):
+        # a generator can only be consumed once and has no length
+        for user_id in range(count):
+            yield user_id
+
+    def get_chunks(self, task):
+        chunks = {}
+        for call in task.calls:
+            chunks.setdefault(call['feed_class'], []).append(call['user_ids'])
+        return chunks
+
+    def test_stream_followers(self):
+        task = FakeTask()
+        with patch.object(self.manager, 'get_fanout_task', return_value=task):
+            self.manager.create_fanout_tasks_for_feed_classes(
+                self.follower_source(7),
+                list(self.manager.feed_classes.values()),
+                add_operation,
+                operation_kwargs=self.operation_kwargs
+            )
+        chunks = self.get_chunks(task)
+        self.assertEqual(len(chunks), 2)
+        for feed_chunks in chunks.values():
+            self.assertEqual(feed_chunks, [(0, 1, 2), (3, 4, 5), (6,)])
+
+    def test_resume_from_checkpoint(self):
+        self.manager.fanout_checkpoint = FanoutCheckpoint()
+        followers = {'HIGH': range(8)}
+        failing_task = FakeTask(fail_after=3)
+        with patch.object(self.manager, 'get_user_follower_ids', return_value=followers):
+            with patch.object(self.manager, 'get_fanout_task', return_value=failing_task):
+                self.assertRaises(
+                    RuntimeError, self.manager.create_user_fanout_tasks,
+                    42, add_operation, self.operation_kwargs)
+            task = FakeTask()
+            with patch.object(self.manager, 'get_fanout_task', return_value=task):
+                self.manager.create_user_fanout_tasks(
+                    42, add_operation, self.operation_kwargs)
+
+        # every follower is enqueued exactly once per feed class
+        enqueued = self.get_chunks(failing_task)
+        for feed_class, feed_chunks in self.get_chunks(task).items():
+            enqueued.setdefault(feed_class, []).extend(feed_chunks)
+        self.assertEqual(len(enqueued), 2)
+        for feed_chunks in enqueued.values():
+            self.assertEqual(sorted(sum(feed_chunks, ())), list(range(8)))
+        # the checkpoint is removed once the fanout completed
+        self.assertEqual(self.manager.fanout_checkpoint.offsets, {})
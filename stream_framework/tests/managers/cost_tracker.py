@@ -0,0 +1,82 @@
+from stream_framework.feed_managers.cost_tracker import FanoutCostTracker
+from stream_framework.feeds.memory import Feed
+from stream_framework.tests.managers.memory import InMemoryManager, InMemoryTimelineFeed
+from contextlib import contextmanager
+import time
+import unittest
+
+
+class SlowBatchFeed(Feed):
+
+    @classmethod
+    @contextmanager
+    def get_timeline_batch_interface(cls):
+        yield None
+        # like a pipeline sending the writes when the block exits
+        time.sleep(0.1)
+
+
+class FanoutCostTrackerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = FanoutCostTracker(decay=0.5)
+
+    def test_unknown_cost(self):
+        self.assertEqual(self.tracker.get_cost(Feed), None)
+
+    def test_moving_average(self):
+        self.tracker.record(Feed, 100, 1.0)
+        self.assertAlmostEqual(self.tracker.get_cost(Feed), 0.01)
+        self.tracker.record(Feed, 100, 3.0)
+        self.assertAlmostEqual(self.tracker.get_cost(Feed), 0.02)
+        # other feed classes are tracked separately
+        self.assertEqual(self.tracker.get_cost(InMemoryTimelineFeed), None)
+
+    def test_empty_fanout(self):
+        self.tracker.record(Feed, 0, 1.0)
+        self.assertEqual(self.tracker.get_cost(Feed), None)
+
+
+class AdaptiveChunkSizeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = InMemoryManager()
+        self.manager.adaptive_fanout_chunk_size = True
+        self.manager.fanout_cost_tracker = FanoutCostTracker(decay=1)
+
+    def test_fixed_chunk_size(self):
+        self.manager.adaptive_fanout_chunk_size = False
+        self.manager.fanout_cost_tracker.record(Feed, 10, 10)
+        self.assertEqual(
+            self.manager.get_fanout_chunk_size(Feed), self.manager.fanout_chunk_size)
+
+    def test_not_measured(self):
+        self.assertEqual(
+            self.manager.get_fanout_chunk_size(Feed), self.manager.fanout_chunk_size)
+
+    def test_chunk_size(self):
+        self.manager.fanout_cost_tracker.record(Feed, 100, 0.5)
+        self.assertEqual(self.manager.get_fanout_chunk_size(Feed), 200)
+
+    def test_combined_chunk_size(self):
+        self.manager.fanout_cost_tracker.record(Feed, 100, 0.5)
+        self.manager.fanout_cost_tracker.record(InMemoryTimelineFeed, 100, 1.5)
+        chunk_size = self.manager.get_fanout_chunk_size(
+            (Feed, InMemoryTimelineFeed))
+        self.assertEqual(chunk_size, 50)
+
+    def test_bounds(self):
+        self.manager.fanout_cost_tracker.record(Feed, 100, 1000)
+        self.assertEqual(
+            self.manager.get_fanout_chunk_size(Feed), self.manager.min_fanout_chunk_size)
+        self.manager.fanout_cost_tracker.record(Feed, 100, 0.000001)
+        self.assertEqual(
+            self.manager.get_fanout_chunk_size(Feed), self.manager.max_fanout_chunk_size)
+
+    def test_fanout_records_cost(self):
+        self.manager.fanout([1, 2], Feed, lambda feed, **kwargs: None, dict(activities=[]))
+        self.assertNotEqual(self.manager.fanout_cost_tracker.get_cost(Feed), None)
+
+    def test_fanout_cost_includes_batch_writes(self):
+        self.manager.fanout([1, 2], SlowBatchFeed, lambda feed, **kwargs: None, dict(activities=[]))
+        self.assertTrue(self.manager.fanout_cost_tracker.get_cost(SlowBatchFeed) >= 0.04)
@@ -0,0 +1,80 @@
+from stream_framework.feed_managers.base import add_operation
+from stream_framework.feed_managers.idempotency import FanoutIdempotency
+from stream_framework.tests.managers.memory import InMemoryManager, InMemoryTimelineFeed
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+from mock import patch
+import datetime
+import time
+import unittest
+
+
+class FanoutIdempotencyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = InMemoryManager()
+        self.manager.fanout_idempotency = FanoutIdempotency()
+        pin = Pin(id=1, created_at=datetime.datetime.now())
+        self.activity = FakeActivity(42, LoveVerb, pin, 1, datetime.datetime.now(), {})
+        self.calls = []
+        self.fail_feed_class = None
+
+    def tearDown(self):
+        for user_id in range(1, 4):
+            for feed in self.manager.get_feeds(user_id).values():
+                feed.delete()
+
+    def operation(self, feed, activities, **kwargs):
+        if feed.__class__ is self.fail_feed_class:
+            raise RuntimeError('redis went away')
+        self.calls.append((feed.__class__, feed.user_id))
+        add_operation(feed, activities, **kwargs)
+
+    def fanout(self, user_ids, feed_class, fanout_id=None):
+        self.manager.fanout(
+            user_ids, feed_class, self.operation, dict(activities=[self.activity]),
+            fanout_id=fanout_id)
+
+    def test_skip_completed_chunk(self):
+        feed_class = self.manager.feed_classes['feed']
+        self.fanout([1, 2], feed_class)
+        self.fanout([1, 2], feed_class)
+        self.assertEqual(self.calls, [(feed_class, 1), (feed_class, 2)])
+        # a different chunk is a different unit of work
+        self.fanout([3], feed_class)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_retry_after_failure(self):
+        feed_classes = tuple(self.manager.feed_classes.values())
+        self.fail_feed_class = InMemoryTimelineFeed
+        self.assertRaises(RuntimeError, self.fanout, [1, 2], feed_classes)
+        self.fail_feed_class = None
+        self.fanout([1, 2], feed_classes)
+        # the retry only runs the feed class which failed
+        done = [feed_class for feed_class, _ in self.calls]
+        for feed_class in feed_classes:
+            self.assertEqual(done.count(feed_class), 2)
+
+    def test_new_fanout_of_same_activities(self):
+        feed_class = self.manager.feed_classes['feed']
+        self.fanout([1, 2], feed_class, fanout_id='a')
+        self.fanout([1, 2], feed_class, fanout_id='a')
+        self.assertEqual(len(self.calls), 2)
+        # adding the activities again is another fanout
+        self.fanout([1, 2], feed_class, fanout_id='b')
+        self.assertEqual(len(self.calls), 4)
+
+    def test_readd_activity(self):
+        with patch.object(self.manager, 'get_user_follower_ids', return_value={None: [1, 2]}):
+            self.manager.add_user_activity(3, self.activity)
+            self.manager.remove_user_activity(3, self.activity)
+            self.manager.add_user_activity(3, self.activity)
+        for feed in self.manager.get_feeds(1).values():
+            self.assertEqual(feed.count(), 1)
+
+    def test_bounded_keys(self):
+        idempotency = FanoutIdempotency(capacity=2, ttl=10)
+        idempotency.mark_done(['a', 'b', 'c'])
+        self.assertEqual(idempotency.get_done(['a', 'b', 'c']), set(['b', 'c']))
+        with patch('time.time', return_value=time.time() + 11):
+            self.assertEqual(idempotency.get_done(['b', 'c']), set())
@@ -0,0 +1,30 @@
+from stream_framework.feed_managers.base import Manager
+from stream_framework.feeds.aggregated_feed.base import AggregatedFeed
+from stream_framework.feeds.base import UserBaseFeed
+from stream_framework.feeds.memory import Feed
+from stream_framework.tests.managers.base import BaseManagerTest
+
+
+class InMemoryUserBaseFeed(UserBaseFeed, Feed):
+    pass
+
+
+class InMemoryTimelineFeed(Feed):
+    key_format = 'timeline_feed_%(user_id)s'
+
+
+class InMemoryAggregatedFeed(AggregatedFeed, Feed):
+    key_format = 'aggregated_feed_%(user_id)s'
+
+
+class InMemoryManager(Manager):
+    feed_classes = {
+        'feed': Feed,
+        'timeline': InMemoryTimelineFeed
+    }
+    user_feed_class = InMemoryUserBaseFeed
+
+
+class InMemoryManagerTest(BaseManagerTest):
+    manager_class = InMemoryManager
+    aggregated_feed_class = InMemoryAggregatedFeed
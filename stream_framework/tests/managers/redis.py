@@ -1,4 +1,5 @@
 from stream_framework.feed_managers.base import Manager
+from stream_framework.feeds.aggregated_feed.redis import RedisAggregatedFeed
 from stream_framework.feeds.base import UserBaseFeed
 from stream_framework.feeds.redis import RedisFeed
 from stream_framework.tests.managers.base import BaseManagerTest
@@ -9,6 +10,10 @@ class RedisUserBaseFeed(UserBaseFeed, RedisFeed):
     pass
 
 
+class RedisAggregatedTimelineFeed(RedisAggregatedFeed):
+    key_format = 'aggregated_feed_%(user_id)s'
+
+
 class RedisManager(Manager):
     feed_classes = {
         'feed': RedisFeed
@@ -19,3 +24,4 @@ class RedisManager(Manager):
 @pytest.mark.usefixtures("redis_reset")
 class RedisManagerTest(BaseManagerTest):
     manager_class = RedisManager
+    aggregated_feed_class = RedisAggregatedTimelineFeed
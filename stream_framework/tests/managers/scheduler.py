@@ -0,0 +1,77 @@
+from stream_framework.feed_managers.base import FanoutPriority
+from stream_framework.feed_managers.scheduler import FanoutScheduler, TokenBucket
+from mock import patch
+import unittest
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_refill(self):
+        with patch('time.time', return_value=100):
+            bucket = TokenBucket(10, 20)
+            self.assertEqual(bucket.get_wait(20), 0)
+            bucket.take(20)
+            self.assertEqual(bucket.get_wait(5), 0.5)
+        with patch('time.time', return_value=101):
+            self.assertEqual(bucket.get_wait(10), 0)
+            # chunks larger than the burst wait for a full bucket
+            self.assertEqual(bucket.get_wait(50), 1)
+
+
+class FanoutSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = FanoutScheduler(
+            rate_limits={
+                FanoutPriority.LOW: (10, 10),
+                'feeds.PinFeed': (100, 100),
+            },
+            deadlines={FanoutPriority.LOW: 30}
+        )
+
+    def test_rate_limits(self):
+        with patch('time.time', return_value=100):
+            keys = self.scheduler.get_bucket_keys(FanoutPriority.LOW, 'feeds.PinFeed')
+            self.assertEqual(keys, [FanoutPriority.LOW, 'feeds.PinFeed'])
+            self.assertEqual(self.scheduler.take(keys, 10), 0)
+            self.assertEqual(self.scheduler.take(keys, 5), 0.5)
+            # the high priority chunks only share the feed class bucket
+            keys = self.scheduler.get_bucket_keys(FanoutPriority.HIGH, 'feeds.PinFeed')
+            self.assertEqual(self.scheduler.take(keys, 90), 0)
+            self.assertEqual(self.scheduler.take(keys, 10), 0.1)
+
+    def test_take_turn(self):
+        with patch('time.time', return_value=100):
+            self.assertEqual(self.scheduler.take_turn(
+                FanoutPriority.LOW, 'feeds.PinFeed', 10), 0)
+            self.assertEqual(self.scheduler.take_turn(
+                FanoutPriority.LOW, 'feeds.PinFeed', 5), 0.5)
+            self.assertEqual(self.scheduler.take_turn(
+                FanoutPriority.HIGH, 'feeds.OtherFeed', 1000), 0)
+
+    def test_deadline(self):
+        with patch('time.time', return_value=100):
+            self.assertFalse(self.scheduler.is_expired(FanoutPriority.HIGH, 0))
+            self.assertTrue(self.scheduler.is_expired(FanoutPriority.LOW, 0))
+            self.assertFalse(self.scheduler.is_expired(FanoutPriority.LOW, 80))
+
+    def test_stale_users(self):
+        self.scheduler.mark_stale('pins', [1, 2])
+        self.assertTrue(self.scheduler.pop_stale('pins', 1))
+        self.assertFalse(self.scheduler.pop_stale('pins', 1))
+        self.assertFalse(self.scheduler.pop_stale('pins', 3))
+        # the managers sharing a scheduler have their own stale users
+        self.assertFalse(self.scheduler.pop_stale('other', 2))
+
+        scheduler = FanoutScheduler(expired_action='drop')
+        scheduler.mark_stale('pins', [1])
+        self.assertFalse(scheduler.pop_stale('pins', 1))
+        self.assertRaises(ValueError, FanoutScheduler, expired_action='retry')
+
+    def test_stale_ttl(self):
+        scheduler = FanoutScheduler(stale_ttl=10)
+        with patch('time.time', return_value=100):
+            scheduler.mark_stale('pins', [1, 2])
+            self.assertTrue(scheduler.pop_stale('pins', 1))
+        with patch('time.time', return_value=111):
+            self.assertFalse(scheduler.pop_stale('pins', 2))
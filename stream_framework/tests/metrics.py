@@ -0,0 +1,66 @@
+from stream_framework.feeds.memory import Feed
+from stream_framework.metrics.memory import InMemoryMetrics
+from stream_framework.tests.managers.memory import InMemoryManager, InMemoryTimelineFeed
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as LoveVerb
+from mock import patch
+import datetime
+import unittest
+
+
+class InMemoryMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = InMemoryMetrics()
+
+    def test_histograms(self):
+        self.metrics.on_fanout_chunk(Feed, 2.0, 4)
+        self.metrics.on_fanout_chunk(Feed, 1.0, 0)
+        self.assertEqual(self.metrics.get_histogram('Feed.fanout_chunk_latency'), [2.0, 1.0])
+        self.assertEqual(self.metrics.get_histogram('Feed.fanout_user_latency'), [0.5])
+        with self.metrics.fanout_timer(Feed):
+            pass
+        self.assertEqual(len(self.metrics.get_histogram('Feed.fanout_latency')), 1)
+
+    def test_write_amplification(self):
+        self.assertEqual(self.metrics.get_write_amplification(Feed), None)
+        self.metrics.on_fanout_amplification(Feed, 1, 10)
+        self.metrics.on_fanout_amplification(Feed, 3, 2)
+        self.assertEqual(self.metrics.get_counter('Feed.fanout.feed_writes'), 16)
+        self.assertEqual(self.metrics.get_write_amplification(Feed), 4.0)
+        self.metrics.reset()
+        self.assertEqual(self.metrics.get_counter('Feed.fanout.feed_writes'), 0)
+
+
+class FanoutMetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.metrics = InMemoryMetrics()
+        self.manager = InMemoryManager()
+        self.manager.metrics = self.metrics
+        self.manager.fanout_chunk_size = 2
+        self.follower_ids = [1, 2, 3]
+        pin = Pin(id=1, created_at=datetime.datetime.now())
+        self.activity = FakeActivity(42, LoveVerb, pin, 1, datetime.datetime.now(), {})
+
+    def tearDown(self):
+        self.manager.get_user_feed(42).delete()
+        for user_id in self.follower_ids:
+            for feed in self.manager.get_feeds(user_id).values():
+                feed.delete()
+
+    def test_fanout_metrics(self):
+        with patch.object(self.manager, 'get_user_follower_ids',
+                          return_value={None: self.follower_ids}):
+            self.manager.add_user_activity(42, self.activity)
+        for feed_class in (Feed, InMemoryTimelineFeed):
+            name = feed_class.__name__
+            # 2 chunks per feed class
+            for metric in ('fanout_queue_wait', 'fanout_chunk_latency',
+                           'fanout_user_latency', 'fanout_lag'):
+                values = self.metrics.get_histogram('%s.%s' % (name, metric))
+                self.assertEqual(len(values), 2)
+                self.assertTrue(all(value >= 0 for value in values))
+            self.assertEqual(self.metrics.get_write_amplification(feed_class), 3.0)
+            self.assertEqual(self.metrics.get_counter('%s.fanout.add_operation' % name), 3)
+        self.assertEqual(self.metrics.get_counter('activities.published'), 1)
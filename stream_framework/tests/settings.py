@@ -17,3 +17,16 @@ STREAM_REDIS_CONFIG = {
         'password': None
     },
 }
+
+# the cluster tests spread their keys over these servers, databases of the
+# default server unless TEST_REDIS_CLUSTER_PORTS lists the ports of
+# separate redis processes (eg. 6380,6381). The redis_cluster fixture
+# registers them when the settings aren't loaded through django
+for index, port in enumerate(
+        os.environ.get('TEST_REDIS_CLUSTER_PORTS', '6379,6379').split(','), 1):
+    STREAM_REDIS_CONFIG['cluster_%s' % index] = {
+        'host': '127.0.0.1',
+        'port': int(port),
+        'db': index,
+        'password': None
+    }
@@ -1,9 +1,11 @@
 from stream_framework.activity import Activity
 from stream_framework.storage.base import BaseActivityStorage, BaseTimelineStorage
+from stream_framework.storage.hydration_cache import HydrationCache, SingleFlight
 from stream_framework.verbs.base import Love as PinVerb
 from stream_framework.tests.utils import FakeActivity, Pin
 from mock import patch
 import datetime
+import threading
 import unittest
 import time
 
@@ -107,6 +109,93 @@ class TestBaseActivityStorageStorage(unittest.TestCase):
             self.activity.serialization_id, *self.args, **self.kwargs)
         assert result is None
 
+    @implementation
+    def test_hydration_cache(self):
+        cache = HydrationCache(capacity=10)
+        storage = self.storage_cls(hydration_cache=cache, **self.storage_options)
+        activity_id = self.activity.serialization_id
+        storage.add(self.activity, *self.args, **self.kwargs)
+        self.assertEqual(storage.get(activity_id, *self.args, **self.kwargs), self.activity)
+        # the second read doesn't go to the storage
+        with patch.object(storage, 'get_from_storage') as get_from_storage:
+            self.assertEqual(storage.get(activity_id, *self.args, **self.kwargs), self.activity)
+            self.assertFalse(get_from_storage.called)
+        self.assertEqual(cache.get_stats(), dict(hits=1, misses=1, size=1))
+        # removed activities are invalidated
+        storage.remove(self.activity, *self.args, **self.kwargs)
+        self.assertEqual(storage.get(activity_id, *self.args, **self.kwargs), None)
+        # and cached as missing
+        with patch.object(storage, 'get_from_storage') as get_from_storage:
+            self.assertEqual(storage.get(activity_id, *self.args, **self.kwargs), None)
+            self.assertFalse(get_from_storage.called)
+        storage.add(self.activity, *self.args, **self.kwargs)
+        self.assertEqual(storage.get(activity_id, *self.args, **self.kwargs), self.activity)
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_load_many(self):
+        flights = SingleFlight()
+        loading = threading.Event()
+        release = threading.Event()
+        loads = []
+
+        def load(keys):
+            loads.append(keys)
+            loading.set()
+            release.wait()
+            return dict((key, key * 2) for key in keys if key != 3)
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(flights.load_many([1, 2, 3], load)))
+        leader.start()
+        loading.wait()
+        follower = threading.Thread(
+            target=lambda: results.append(flights.load_many([2, 4], load)))
+        follower.start()
+        while 4 not in flights.flights:
+            time.sleep(0.001)
+        release.set()
+        leader.join()
+        follower.join()
+        # 2 was only loaded by the leader
+        self.assertEqual(sorted(map(sorted, loads)), [[1, 2, 3], [4]])
+        self.assertIn({1: 2, 2: 4, 3: None}, results)
+        self.assertIn({2: 4, 4: 8}, results)
+        self.assertEqual(flights.flights, {})
+
+
+class HydrationCacheTest(unittest.TestCase):
+
+    def test_invalidate_during_load(self):
+        cache = HydrationCache(capacity=10)
+        activity = FakeActivity(
+            1, PinVerb, Pin(id=1, created_at=datetime.datetime.now()), 1, datetime.datetime.now(), {})
+        activity_id = activity.serialization_id
+
+        def load(activity_ids):
+            # the activity is updated while the stale version is loaded
+            cache.invalidate([activity_id])
+            return [activity]
+
+        self.assertEqual(cache.load_many([activity_id], load), {activity_id: activity})
+        # the stale activity isn't cached
+        self.assertEqual(cache.get_many([activity_id]), {})
+        cache.load_many([activity_id], lambda activity_ids: [activity])
+        self.assertEqual(cache.get_many([activity_id]), {activity_id: activity})
+
+    def test_invalidate_missing_during_load(self):
+        cache = HydrationCache(capacity=10)
+
+        def load(activity_ids):
+            cache.invalidate(activity_ids)
+            return []
+
+        self.assertEqual(cache.load_many([1], load), {1: None})
+        # the activity isn't cached as missing
+        self.assertEqual(cache.get_many([1]), {})
+
 
 class TestBaseTimelineStorageClass(unittest.TestCase):
 
@@ -200,6 +289,18 @@ class TestBaseTimelineStorageClass(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.storage.index_of(self.test_key, 0)
 
+    @implementation
+    def test_get_slices(self):
+        other_key = 'other_key'
+        self.addCleanup(self.storage.delete, other_key)
+        activities = self._build_activity_list(range(6, 0, -1))
+        self.storage.add_many(self.test_key, activities[:3])
+        self.storage.add_many(other_key, activities[3:])
+        slices = self.storage.get_slices([self.test_key, other_key], 0, 2)
+        self.assertEqual(len(slices), 2)
+        self.assert_results(slices[0], activities[:2])
+        self.assert_results(slices[1], activities[3:5])
+
     @implementation
     def test_trim(self):
         activities = self._build_activity_list(range(10, 0, -1))
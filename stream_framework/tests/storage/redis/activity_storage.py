@@ -1,6 +1,30 @@
 from stream_framework.tests.storage.base import TestBaseActivityStorageStorage
+from stream_framework.storage.hydration_cache import RedisHydrationCache
 from stream_framework.storage.redis.activity_storage import RedisActivityStorage
+from stream_framework.tests.utils import FakeActivity, Pin
+from stream_framework.verbs.base import Love as PinVerb
+import datetime
+import time
+import unittest
 
 
 class RedisActivityStorageTest(TestBaseActivityStorageStorage):
     storage_cls = RedisActivityStorage
+
+
+class RedisHydrationCacheTest(unittest.TestCase):
+
+    def test_invalidation(self):
+        pin = Pin(id=1, created_at=datetime.datetime.now())
+        activity = FakeActivity(1, PinVerb, pin, 1, datetime.datetime.now(), {})
+        reader = RedisHydrationCache()
+        writer = RedisHydrationCache()
+        reader.set_many([activity])
+        writer.start_listener()
+        writer.invalidate([activity.serialization_id])
+        # the invalidation reaches the other cache through pub/sub
+        for _ in range(50):
+            if not reader.get_many([activity.serialization_id]):
+                break
+            time.sleep(0.02)
+        self.assertEqual(reader.get_many([activity.serialization_id]), {})
@@ -0,0 +1,95 @@
+from stream_framework.storage.redis.cluster import ClusterActivityStorage, \
+    ClusterPipeline, ClusterTimelineStorage, HashRing, get_executor, get_hash_tag, get_slot
+from stream_framework.tests.storage.base import TestBaseActivityStorageStorage, \
+    TestBaseTimelineStorageClass
+from stream_framework.activity import Activity
+from mock import patch
+import pytest
+import unittest
+
+
+CLUSTER_SERVERS = ('cluster_1', 'cluster_2')
+
+
+@pytest.mark.usefixtures("redis_cluster")
+class HashRingTest(unittest.TestCase):
+
+    def test_slot(self):
+        # the slots of redis cluster
+        self.assertEqual(get_slot('foo'), 12182)
+        self.assertEqual(get_slot('123456789'), 12739)
+        self.assertEqual(get_slot('{user1000}.following'), get_slot('{user1000}.followers'))
+        self.assertEqual(get_hash_tag('foo{}{bar}'), 'foo{}{bar}')
+        self.assertEqual(get_hash_tag('foo{{bar}}zap'), '{bar')
+
+    def test_distribution(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = dict((server, ring.slots.count(server)) for server in ring.servers)
+        for count in counts.values():
+            self.assertTrue(count > len(ring.slots) / 4 * 0.7, counts)
+
+    def test_add_server(self):
+        ring = HashRing(['a', 'b', 'c'])
+        bigger = HashRing(['a', 'b', 'c', 'd'])
+        moved = [old for old, new in zip(ring.slots, bigger.slots) if old != new]
+        # only the slots taken over by the new server move
+        self.assertEqual(
+            len(moved), len([new for new in bigger.slots if new == 'd']))
+        self.assertTrue(len(moved) < len(ring.slots) / 3.0)
+
+    def test_pipeline_routing(self):
+        ring = HashRing(CLUSTER_SERVERS)
+        cluster = ClusterPipeline(ring)
+        keys = ['feed_%s' % i for i in range(20)]
+        for key in keys:
+            cluster.pipeline(key).zcard(key)
+        self.assertEqual(set(cluster.pipelines), set(CLUSTER_SERVERS))
+        for server, pipe in cluster.pipelines.items():
+            for args, options in pipe.command_stack:
+                self.assertEqual(ring.get_server(args[1]), server)
+
+    def test_shared_executor(self):
+        ring = HashRing(CLUSTER_SERVERS)
+        executor = get_executor()
+        self.assertTrue(get_executor() is executor)
+        with patch('redis.client.BasePipeline.execute', return_value=[1]):
+            for _ in range(3):
+                cluster = ClusterPipeline(ring)
+                keys = ['feed_%s' % i for i in range(20)]
+                for key in keys:
+                    cluster.pipeline(key).zcard(key)
+                results = cluster.execute()
+                self.assertEqual(set(results), set(CLUSTER_SERVERS))
+        # the pipelines don't start a pool of their own
+        self.assertTrue(get_executor() is executor)
+
+
+@pytest.mark.usefixtures("redis_cluster")
+class ClusterActivityStorageTest(TestBaseActivityStorageStorage):
+    storage_cls = ClusterActivityStorage
+    storage_options = {
+        'activity_class': Activity,
+        'redis_servers': CLUSTER_SERVERS,
+        'shard_count': 16,
+    }
+
+
+@pytest.mark.usefixtures("redis_cluster")
+class ClusterTimelineStorageTest(TestBaseTimelineStorageClass):
+    storage_cls = ClusterTimelineStorage
+    storage_options = {
+        'activity_class': Activity,
+        'redis_servers': CLUSTER_SERVERS,
+    }
+
+    def test_get_many_slices(self):
+        activities = self._build_activity_list(range(5))
+        keys = ['cluster_feed_%s' % i for i in range(6)]
+        with self.storage.get_batch_interface() as batch_interface:
+            for key in keys:
+                self.storage.add_many(key, activities, batch_interface=batch_interface)
+        requests = [(key, 0, 3, None, None) for key in keys]
+        slices = self.storage.get_many_slices_from_storage(requests)
+        self.assertEqual([len(s) for s in slices], [3] * len(keys))
+        for key in keys:
+            self.storage.delete(key)
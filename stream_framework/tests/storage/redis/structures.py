@@ -417,3 +417,47 @@ class ShardedHashCacheTestCase(HashCacheTestCase):
         cache.set_many(key_value_pairs)
         contains = partial(cache.contains, 'key')
         self.assertRaises(NotImplementedError, contains)
+
+
+class VariadicCommandsTestCase(unittest.TestCase):
+
+    '''
+    Counts the commands queued on a pipeline, without sending them
+    '''
+
+    def setUp(self):
+        self.pipe = get_redis_connection().pipeline(transaction=False)
+
+    def get_commands(self):
+        return [args[0] for args, options in self.pipe.command_stack]
+
+    def test_sorted_set_remove_many(self):
+        cache = RedisSortedSetCache('test', redis=self.pipe)
+        cache.remove_many(list(range(1200)))
+        self.assertEqual(self.get_commands(), ['ZREM'] * 3)
+
+    def test_sorted_set_add_many_and_trim(self):
+        cache = RedisSortedSetCache('test', redis=self.pipe)
+        cache.add_many([(i, i) for i in range(150)], max_length=10)
+        self.assertEqual(self.get_commands(), ['ZADD'] * 2 + ['ZREMRANGEBYRANK'])
+        self.assertEqual(self.pipe.command_stack[-1][0][2:], (0, -11))
+
+    def test_sorted_set_remove_by_scores(self):
+        cache = RedisSortedSetCache('test', redis=self.pipe)
+        cache.remove_by_scores(list(range(1200)))
+        self.assertEqual(self.get_commands(), ['EVALSHA'] * 3)
+
+    def test_hash_delete_many(self):
+        cache = RedisHashCache('test', redis=self.pipe)
+        cache.delete_many(list(range(1200)))
+        self.assertEqual(self.get_commands(), ['HDEL'] * 3)
+
+    def test_sharded_hash_set_and_delete_many(self):
+        cache = ShardedHashCache('test', redis=self.pipe)
+        fields = list(range(100))
+        cache.set_many([(field, 'value') for field in fields])
+        cache.delete_many(fields)
+        commands = self.get_commands()
+        # one command per shard
+        self.assertEqual(commands.count('HMSET'), cache.number_of_keys)
+        self.assertEqual(commands.count('HDEL'), cache.number_of_keys)
@@ -1,6 +1,115 @@
 from stream_framework.tests.storage.base import TestBaseTimelineStorageClass
 from stream_framework.storage.redis.timeline_storage import RedisTimelineStorage
+from stream_framework.storage.redis.compact_timeline_storage import CompactRedisTimelineStorage, \
+    decode_id, encode_id
+from stream_framework.storage.redis.list_timeline_storage import RedisListTimelineStorage
+from stream_framework.storage.redis.connection import get_redis_connection
+from stream_framework.serializers.activity_serializer import ActivitySerializer
+import random
+import unittest
 
 
 class TestRedisTimelineStorageClass(TestBaseTimelineStorageClass):
     storage_cls = RedisTimelineStorage
+
+    def test_batch_interface_key(self):
+        other = self.storage_cls(redis_server='default')
+        self.assertEqual(
+            self.storage.get_batch_interface_key(), other.get_batch_interface_key())
+
+    def test_add_many_batch_interface(self):
+        activities = self._build_activity_list(range(3))
+        with self.storage.get_batch_interface() as batch_interface:
+            self.storage.add_many(
+                self.test_key, activities, batch_interface=batch_interface)
+            # nothing is written until the batch is executed
+            self.assertEqual(self.storage.count(self.test_key), 0)
+        self.assertEqual(self.storage.count(self.test_key), 3)
+
+
+class CompactEncodingTest(unittest.TestCase):
+
+    def test_encode_id(self):
+        activity_id = 1373266755000000000042008
+        self.assertEqual(len(encode_id(activity_id)), 15)
+        self.assertEqual(decode_id(encode_id(activity_id)), activity_id)
+        self.assertEqual(encode_id(str(activity_id)), encode_id(activity_id))
+        self.assertRaises(ValueError, encode_id, -1)
+        self.assertRaises(ValueError, encode_id, 10 ** 27)
+
+    def test_order(self):
+        # ids too large for the precision of a float score
+        activity_ids = [10 ** 25 + random.randrange(10 ** 6) for _ in range(100)]
+        members = sorted(map(encode_id, activity_ids))
+        self.assertEqual([decode_id(m) for m in members], sorted(activity_ids))
+
+    def test_filter_bounds(self):
+        storage = CompactRedisTimelineStorage()
+        pipe = get_redis_connection().pipeline(transaction=False)
+        cache, result_kwargs = storage.get_slice_cache(
+            'feed', {'activity_id__lt': 5, 'activity_id__gte': 2}, redis=pipe)
+        cache.get_results(0, 10, **result_kwargs)
+        args = pipe.command_stack[0][0]
+        self.assertEqual(
+            args[:4], ('ZREVRANGEBYLEX', 'feed', '(' + encode_id(5), '[' + encode_id(2)))
+
+    def test_serializer(self):
+        self.assertRaises(
+            ValueError, CompactRedisTimelineStorage, serializer_class=ActivitySerializer)
+
+
+class TestCompactRedisTimelineStorageClass(TestRedisTimelineStorageClass):
+    storage_cls = CompactRedisTimelineStorage
+
+    def test_migrate(self):
+        activities = self._build_activity_list(range(1, 11))
+        RedisTimelineStorage().add_many(self.test_key, activities)
+        self.assertEqual(self.storage.migrate(self.test_key), 10)
+        # converted members are left alone
+        self.assertEqual(self.storage.migrate(self.test_key), 0)
+        results = self.storage.get_slice(self.test_key, 0, None)
+        self.assert_results(results, activities[::-1])
+
+
+class TestRedisListTimelineStorageClass(TestRedisTimelineStorageClass):
+    storage_cls = RedisListTimelineStorage
+
+    def test_add_out_of_order(self):
+        activities = self._build_activity_list(range(10))
+        self.storage.add_many(self.test_key, activities[5:])
+        # older activities and duplicates are merged into the list
+        self.storage.add_many(self.test_key, activities[:7])
+        self.assertEqual(self.storage.count(self.test_key), 10)
+        results = self.storage.get_slice(self.test_key, 0, None)
+        self.assert_results(results, activities[::-1])
+
+    def test_add_and_trim(self):
+        activities = self._build_activity_list(range(10))
+        self.storage.add_many(self.test_key, activities[:5], max_length=3)
+        self.storage.add_many(self.test_key, activities[5:], max_length=3)
+        results = self.storage.get_slice(self.test_key, 0, None)
+        self.assert_results(results, activities[:6:-1])
+
+    def test_get_results_commands(self):
+        pipe = get_redis_connection().pipeline(transaction=False)
+        cache, result_kwargs = self.storage.get_slice_cache('feed', redis=pipe)
+        cache.get_results(5, 10, **result_kwargs)
+        cache, result_kwargs = self.storage.get_slice_cache(
+            'feed', {'activity_id__lt': 5}, redis=pipe)
+        cache.get_results(0, 10, **result_kwargs)
+        commands = [args for args, options in pipe.command_stack]
+        # unfiltered slices are a plain LRANGE
+        self.assertEqual(commands[0], ('LRANGE', 'feed', 5, 9))
+        self.assertEqual(commands[1][0], 'EVALSHA')
+        self.assertEqual(commands[1][-7:], ('', 0, '5', 1, 0, 0, 10))
+
+    def test_remove_many_commands(self):
+        pipe = get_redis_connection().pipeline(transaction=False)
+        cache = self.storage.get_cache('feed', redis=pipe)
+        cache.remove_many_chunk_size = 2
+        cache.remove_many(['1', '2', '3'])
+        commands = [args for args, options in pipe.command_stack]
+        # one script call per chunk instead of a LREM per value
+        self.assertEqual([command[0] for command in commands], ['EVALSHA', 'EVALSHA'])
+        self.assertEqual(commands[0][-3:], ('feed', '1', '2'))
+        self.assertEqual(commands[1][-2:], ('feed', '3'))
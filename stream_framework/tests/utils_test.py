@@ -5,7 +5,7 @@ from datetime import datetime
 import mock
 
 from stream_framework.utils import chunks, warn_on_duplicate, make_list_unique, \
-    warn_on_error, datetime_to_epoch, epoch_to_datetime
+    warn_on_error, datetime_to_epoch, epoch_to_datetime, merge_sorted, LRUCache, MISSING
 from stream_framework.exceptions import DuplicateActivityException
 
 
@@ -22,6 +22,43 @@ class ChunksTest(unittest.TestCase):
         self.assertEqual(chunked, [(0, 1)])
 
 
+class LRUCacheTest(unittest.TestCase):
+
+    def test_capacity(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # b is the least recently used key
+        cache.set('c', 3)
+        self.assertEqual(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('c'), 3)
+        cache.delete('c')
+        self.assertEqual(cache.get('c'), MISSING)
+        self.assertEqual(len(cache), 1)
+
+    def test_ttl(self):
+        cache = LRUCache(2, ttl=10)
+        with mock.patch('time.time', return_value=100):
+            cache.set('a', 1)
+        with mock.patch('time.time', return_value=109):
+            self.assertEqual(cache.get('a'), 1)
+        with mock.patch('time.time', return_value=110):
+            self.assertEqual(cache.get('a'), MISSING)
+
+
+class MergeSortedTest(unittest.TestCase):
+
+    def test_merge_sorted(self):
+        merged = merge_sorted([[1, 4, 7], [2, 5], [], [3, 6, 8]])
+        self.assertEqual(list(merged), list(range(1, 9)))
+
+    def test_merge_sorted_reverse_key(self):
+        merged = merge_sorted(
+            [['9', '5'], ['10', '8', '1']], key=int, reverse=True)
+        self.assertEqual(list(merged), ['10', '9', '8', '5', '1'])
+
+
 def safe_function():
     return 10
 
@@ -2,9 +2,12 @@ from stream_framework.exceptions import DuplicateActivityException
 import collections
 from datetime import datetime, timedelta
 import functools
+import heapq
 import itertools
 import logging
 import six
+import threading
+import time
 
 
 logger = logging.getLogger(__name__)
@@ -14,25 +17,50 @@ MISSING = object()
 
 class LRUCache:
 
-    def __init__(self, capacity):
+    '''
+    A thread safe least recently used cache holding at most capacity keys,
+    with a ttl keys expire after ttl seconds
+    '''
+
+    def __init__(self, capacity, ttl=None):
         self.capacity = capacity
+        self.ttl = ttl
         self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
 
     def get(self, key):
-        try:
-            value = self.cache.pop(key)
-            self.cache[key] = value
+        with self.lock:
+            try:
+                value, expires_at = self.cache.pop(key)
+            except KeyError:
+                return MISSING
+            if expires_at is not None and expires_at <= time.time():
+                return MISSING
+            self.cache[key] = (value, expires_at)
             return value
-        except KeyError:
-            return MISSING
 
     def set(self, key, value):
-        try:
-            self.cache.pop(key)
-        except KeyError:
-            if len(self.cache) >= self.capacity:
-                self.cache.popitem(last=False)
-        self.cache[key] = value
+        expires_at = None
+        if self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self.lock:
+            try:
+                self.cache.pop(key)
+            except KeyError:
+                if len(self.cache) >= self.capacity:
+                    self.cache.popitem(last=False)
+            self.cache[key] = (value, expires_at)
+
+    def delete(self, key):
+        with self.lock:
+            self.cache.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def __len__(self):
+        return len(self.cache)
 
 
 def chunks(iterable, n=10000):
@@ -44,6 +72,51 @@ def chunks(iterable, n=10000):
         yield chunk
 
 
+class _ReversedKey(object):
+
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+
+def merge_sorted(iterables, key=None, reverse=False):
+    '''
+    Merges sorted iterables into one sorted iterator (k-way merge),
+    like heapq.merge(*iterables, key=key, reverse=reverse) which is not
+    available on python 2
+
+    :param iterables: the iterables, each of them sorted
+    :param key: a function returning the value to sort on
+    :param reverse: set to True when the iterables are sorted in descending order
+    '''
+    if key is None:
+        key = lambda item: item
+    wrap = _ReversedKey if reverse else (lambda value: value)
+    heap = []
+    for index, iterable in enumerate(iterables):
+        iterator = iter(iterable)
+        for item in iterator:
+            heap.append((wrap(key(item)), index, item, iterator))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, index, item, iterator = heap[0]
+        yield item
+        for next_item in iterator:
+            heapq.heapreplace(
+                heap, (wrap(key(next_item)), index, next_item, iterator))
+            break
+        else:
+            heapq.heappop(heap)
+
+
 epoch = datetime(1970, 1, 1)
 
 